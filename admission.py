@@ -0,0 +1,293 @@
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, jsonify, make_response, render_template, request, session
+
+import config
+
+
+# Requests are classed by who is logged in, and each class has its own
+# number of slots (requests running at once), queue (requests waiting for a
+# slot) and longest wait. A request beyond its class's queue is turned away
+# at once with a 503. Every slot has a database connection of its own (see
+# lane()), so staff queries never wait behind resident queries on a shared
+# connection.
+#
+# Running and waiting requests both hold a server thread, so the slots and
+# queues of all classes, plus the live-updates streams, add up to at most
+# WEB_THREADS: a burst in one class can never take a thread another needs.
+THREADS = getattr(config, 'WEB_THREADS', 16)
+
+# Live-updates streams (dashboards) open at once in one server process. Each
+# holds a thread for as long as its page is open and uses no database
+# connection; past the cap a dashboard is told to reconnect later.
+# live_server.py serves them without a thread each.
+LIVE_STREAMS = getattr(config, 'LIVE_STREAMS', None) or max(1, THREADS // 4)
+STREAM_RETRY_SECONDS = 30
+
+# name: (share of running, share of waiting, max wait in seconds), shares of
+# the threads left after the streams. REQUEST_CLASSES in config.py sets any
+# class's (slots, queue, max wait) outright. Checked in order, the first
+# session key wins.
+SHARES = {'admin': (0.15, 0.1, 10.0), 'worker': (0.15, 0.2, 10.0),
+          'user': (0.2, 0.05, 3.0), 'public': (0.1, 0.05, 5.0)}
+ROLE_KEYS = [('admin', 'admin_username'), ('worker', 'worker_phone_no'), ('user', 'user_phone_no')]
+
+
+def split_threads(budget):
+    # Rounds each share down and hands the threads left over to classes
+    # with no slot yet, then to the largest remainders, so the limits add
+    # up to the budget and every class runs at least one request
+    wanted = {(name, part): budget * SHARES[name][part] for name in SHARES for part in (0, 1)}
+    given = {key: int(share) for key, share in wanted.items()}
+    spare = budget - sum(given.values())
+    order = sorted(wanted, key=lambda key: (key[1] != 0 or given[key] > 0, given[key] - wanted[key]))
+    for key in order[:max(spare, 0)]:
+        given[key] += 1
+    return {name: (max(1, given[name, 0]), given[name, 1], SHARES[name][2]) for name in SHARES}
+
+
+CLASSES = split_threads(THREADS - LIVE_STREAMS)
+CLASSES.update(getattr(config, 'REQUEST_CLASSES', {}))
+
+# Never queued: files, and the live-updates streams, which have their own cap
+EXEMPT = {'static', 'main.asset'}
+STREAMS = {'main.worker_events', 'main.user_events'}
+
+RETRY_AFTER = 5
+WAITS_KEPT = 1000      # recent queue times per class, for the percentiles
+
+
+class RequestClass:
+
+    def __init__(self, name, slots, queue_limit, max_wait):
+        self.name = name
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self._free = queue.LifoQueue()     # the most recently used slot's connection is the warmest
+        for slot in reversed(range(slots)):
+            self._free.put(slot)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0      # queue full
+        self.timed_out = 0     # waited max_wait without getting a slot
+        self.queued = 0        # admitted after waiting
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=WAITS_KEPT)
+
+    def acquire(self):
+        # -> (slot, seconds waited), or (None, seconds waited) when turned away
+        try:
+            slot = self._free.get_nowait()
+            with self._lock:
+                self.admitted += 1
+                self._waits.append(0.0)
+            return slot, 0.0
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self.waiting >= self.queue_limit:
+                self.rejected += 1
+                return None, 0.0
+            self.waiting += 1
+        started = time.perf_counter()
+        try:
+            slot = self._free.get(timeout=self.max_wait)
+        except queue.Empty:
+            slot = None
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.waiting -= 1
+            if slot is None:
+                self.timed_out += 1
+            else:
+                self.admitted += 1
+                self.queued += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                self._waits.append(waited)
+        return slot, waited
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def metrics(self):
+        with self._lock:
+            waits = sorted(self._waits)
+        pct = lambda q: round(waits[min(int(q * len(waits)), len(waits) - 1)] * 1000, 1) if waits else None
+        return {
+            'slots': self.slots, 'queue': self.queue_limit, 'max_wait_s': self.max_wait,
+            'running': self.slots - self._free.qsize(), 'waiting': self.waiting,
+            'admitted': self.admitted, 'queued': self.queued, 'rejected': self.rejected, 'timed_out': self.timed_out,
+            'wait_avg_ms': round(self.wait_total / self.queued * 1000, 1) if self.queued else None,
+            'wait_max_ms': round(self.wait_max * 1000, 1),
+            'wait_p50_ms': pct(0.5), 'wait_p95_ms': pct(0.95), 'wait_p99_ms': pct(0.99),
+        }
+
+
+classes = {name: RequestClass(name, *limits) for name, limits in CLASSES.items()}
+streams_open = 0
+streams_refused = 0
+_streams_lock = threading.Lock()
+
+
+def classify():
+    for name, key in ROLE_KEYS:
+        if session.get(key):
+            return name
+    return 'public'
+
+
+def lane():
+    # (class, slot) of the running request, which picks its database
+    # connection in tenancy.ShardedConnection; None outside a request
+    if has_request_context():
+        return g.get('admission')
+    return None
+
+
+def lanes():
+    # Every (class, slot) key lane() can return
+    return [(name, slot) for name, request_class in classes.items() for slot in range(request_class.slots)]
+
+
+def admit():
+    if request.endpoint in EXEMPT or request.endpoint in STREAMS or request.endpoint is None:
+        return None
+    request_class = classes[classify()]
+    slot, _ = request_class.acquire()
+    if slot is None:
+        return busy_page(request_class)
+    g.admission = (request_class.name, slot)
+    return None
+
+
+def release(exc=None):
+    taken = g.pop('admission', None)
+    if taken is not None:
+        classes[taken[0]].release(taken[1])
+
+
+def release_response(response):
+    # after_request: the view has finished its database work, so the slot
+    # (and its connection) goes to the next request now. A streamed page
+    # keeps its server thread, and reads its rows, until it has been sent,
+    # so its slot is given back when the response closes. teardown covers
+    # requests that failed.
+    if not response.is_streamed:
+        release()
+        return response
+    taken = g.pop('admission', None)
+    if taken is not None:
+        response.call_on_close(lambda: classes[taken[0]].release(taken[1]))
+    return response
+
+
+def open_stream(events):
+    # -> events wrapped to give the stream's place back when it ends, or
+    # None when this process already has LIVE_STREAMS streams open
+    global streams_open, streams_refused
+    with _streams_lock:
+        if streams_open >= LIVE_STREAMS:
+            streams_refused += 1
+            return None
+        streams_open += 1
+
+    def held():
+        global streams_open
+        try:
+            yield from events
+        finally:
+            with _streams_lock:
+                streams_open -= 1
+    return held()
+
+
+def busy_page(request_class):
+    print(f"Turned away a {request_class.name} request to {request.path}: "
+          f"{request_class.waiting} waiting, {request_class.slots} running.")
+    if request.is_json or request.path.endswith('.json'):
+        response = jsonify({'error': 'The site is busy. Please try again shortly.', 'retry_after': RETRY_AFTER})
+        response.status_code = 503
+    else:
+        response = make_response(render_template('busy.html', retry_after=RETRY_AFTER), 503)
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+def metrics():
+    report = {name: request_class.metrics() for name, request_class in classes.items()}
+    report['live_streams'] = {'limit': LIVE_STREAMS, 'open': streams_open, 'refused': streams_refused}
+    return report
+
+
+def check_limits():
+    used = sum(c.slots + c.queue_limit for c in classes.values()) + LIVE_STREAMS
+    if used > THREADS:
+        raise ValueError(f"REQUEST_CLASSES slots + queues and LIVE_STREAMS need {used} threads, "
+                         f"but WEB_THREADS is {THREADS}; lower them or raise WEB_THREADS.")
+
+
+def init_app(app):
+    # Registered after the blueprint's hooks, so a request the database
+    # circuit breaker answers at once never takes a slot
+    check_limits()
+    app.before_request(admit)
+    app.after_request(release_response)
+    app.teardown_request(release)
+
+
+if __name__ == "__main__":
+    # python admission.py [seconds] -- 40 resident threads hammer a slow
+    # route while one admin and one worker make requests in a loop; prints
+    # staff latency with one shared limit and with per-class limits
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    service = 0.02     # seconds of database work per request
+
+    def run(limits):
+        global classes
+        classes = {name: RequestClass(name, *spec) for name, spec in limits.items()}
+        stop = time.monotonic() + seconds
+        staff_latency = []
+        served = {'user': 0, 'rejected': 0}
+        lock = threading.Lock()
+
+        def client(role, record):
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                request_class = classes[role if role in classes else 'shared']
+                slot, _ = request_class.acquire()
+                if slot is None:
+                    with lock:
+                        served['rejected'] += 1
+                    time.sleep(0.01)
+                    continue
+                time.sleep(service)
+                request_class.release(slot)
+                if record is not None:
+                    record.append(time.perf_counter() - started)
+                else:
+                    with lock:
+                        served['user'] += 1
+
+        threads = [threading.Thread(target=client, args=('user', None)) for _ in range(40)]
+        threads += [threading.Thread(target=client, args=(role, staff_latency)) for role in ('admin', 'worker')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        staff_latency.sort()
+        p = lambda q: staff_latency[min(int(q * len(staff_latency)), len(staff_latency) - 1)] * 1000
+        return len(staff_latency), p(0.5), p(0.99), served
+
+    for label, limits in (('one shared class', {'shared': (7, 40, 10.0)}),
+                          ('per-class limits', {k: v for k, v in CLASSES.items()})):
+        count, p50, p99, served = run(limits)
+        print(f"{label:17} staff requests={count:4}  staff p50={p50:7.1f} ms  p99={p99:7.1f} ms  "
+              f"resident requests={served['user']:5}  turned away={served['rejected']}")
@@ -0,0 +1,241 @@
+import json
+import math
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import event_log
+import tenancy
+from tenancy import ShardedConnection
+
+
+METRIC_ASSIGN = 1     # minutes from complaint_datetime to assignment
+METRIC_RESOLVE = 2    # minutes from complaint_datetime to resolution
+METRIC_BACKLOG = 3    # age in minutes of complaints still open at end of day
+
+METRIC_NAMES = {
+    METRIC_ASSIGN: 'time_to_assign',
+    METRIC_RESOLVE: 'time_to_resolve',
+    METRIC_BACKLOG: 'backlog_age',
+}
+
+DIMENSIONS = ['complaint_type', 'priority', 'tower', 'worker']
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+
+
+class Sketch:
+    # Log-bucketed histogram: bucket i holds values in (GAMMA^(i-1), GAMMA^i],
+    # so every quantile is within ~2.5% of the true value. Two sketches merge
+    # by adding bucket counts, which is what lets daily rollups combine into
+    # any date range without touching the raw rows again.
+    GAMMA = 1.05
+    LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or {}
+
+    def add(self, minutes):
+        index = 0 if minutes < 1 else int(math.ceil(math.log(minutes) / self.LOG_GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        return self
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                if index == 0:
+                    return 0.0
+                return 2 * self.GAMMA ** index / (self.GAMMA + 1)
+        return 2 * self.GAMMA ** max(self.buckets) / (self.GAMMA + 1)
+
+    def to_json(self):
+        return json.dumps(self.buckets, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        return cls({int(k): v for k, v in json.loads(text).items()})
+
+
+# Used by the CLI; routes pass in the app connection
+db = ShardedConnection(check_schema=True, background=True)
+
+
+def _last_rolled_day(cursor):
+    cursor.execute("SELECT last_day FROM sla_rollup_state")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _first_event_day(cursor):
+    cursor.execute("SELECT MIN(created_at) FROM complaint_events")
+    row = cursor.fetchone()
+    return row[0].date() if row and row[0] else None
+
+
+def _collect_day(cursor, day):
+    # One pass over the day's events (idx_events_type_time) plus the complaints
+    # that were open at midnight. Returns {(metric, type, priority, tower, worker_id): [minutes]}
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    groups = {}
+
+    cursor.execute("""
+        SELECT e.event_type, c.complaint_type, c.complaint_priority,
+               COALESCE(a.user_tower_no, 'Community'),
+               CASE WHEN e.event_type = %s THEN CAST(e.detail AS SIGNED) ELSE c.worker_id END,
+               TIMESTAMPDIFF(MINUTE, c.complaint_datetime, e.created_at)
+        FROM complaint_events e
+        JOIN user_complaints_details c ON c.complaint_id = e.complaint_id
+        LEFT JOIN user_address_details a
+               ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+        WHERE e.created_at >= %s AND e.created_at < %s
+          AND (e.event_type = %s OR (e.event_type = %s AND e.detail = 'Resolved'))
+    """, (event_log.ASSIGNED, start, end, event_log.ASSIGNED, event_log.STATUS_CHANGED))
+    for event_type, c_type, priority, tower, worker, minutes in cursor.fetchall():
+        metric = METRIC_ASSIGN if event_type == event_log.ASSIGNED else METRIC_RESOLVE
+        key = (metric, c_type or '', priority or '', tower or '', worker or 0)
+        groups.setdefault(key, []).append(max(minutes or 0, 0))
+
+    # Backlog snapshot: created before the end of the day and not resolved by then
+    cursor.execute("""
+        SELECT c.complaint_type, c.complaint_priority,
+               COALESCE(a.user_tower_no, 'Community'), c.worker_id,
+               TIMESTAMPDIFF(MINUTE, c.complaint_datetime, %s)
+        FROM user_complaints_details c
+        LEFT JOIN user_address_details a
+               ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+        WHERE c.complaint_datetime < %s
+          AND NOT EXISTS (
+              SELECT 1 FROM complaint_events r
+              WHERE r.complaint_id = c.complaint_id AND r.event_type = %s
+                AND r.detail = 'Resolved' AND r.created_at < %s)
+          AND (c.status != 'Resolved' OR EXISTS (
+              SELECT 1 FROM complaint_events r2
+              WHERE r2.complaint_id = c.complaint_id AND r2.event_type = %s
+                AND r2.detail = 'Resolved'))
+    """, (end, end, event_log.STATUS_CHANGED, end, event_log.STATUS_CHANGED))
+    for c_type, priority, tower, worker, minutes in cursor.fetchall():
+        key = (METRIC_BACKLOG, c_type or '', priority or '', tower or '', worker or 0)
+        groups.setdefault(key, []).append(max(minutes or 0, 0))
+
+    return groups
+
+
+def rollup_day(cursor, day):
+    groups = _collect_day(cursor, day)
+    cursor.execute("DELETE FROM sla_daily_rollups WHERE day = %s", (day,))
+    rows = []
+    for (metric, c_type, priority, tower, worker), values in groups.items():
+        sketch = Sketch()
+        for minutes in values:
+            sketch.add(minutes)
+        rows.append((day, metric, c_type, priority, tower, worker,
+                     len(values), sum(values), sketch.to_json()))
+    if rows:
+        cursor.executemany("""
+            INSERT INTO sla_daily_rollups
+                (day, metric, complaint_type, priority, tower, worker_id, sample_count, sum_minutes, sketch)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+    return len(rows)
+
+
+def run_rollups(backfill=False, conn=None):
+    # Rolls up every complete day after the watermark. backfill=True wipes
+    # the rollups and rebuilds them from the first recorded event.
+    conn = conn or db
+    started = time.perf_counter()
+    event_log.events.flush()
+    cursor = conn.cursor()
+
+    if backfill:
+        cursor.execute("DELETE FROM sla_daily_rollups")
+        cursor.execute("DELETE FROM sla_rollup_state")
+        conn.commit()
+        last_day = None
+    else:
+        last_day = _last_rolled_day(cursor)
+
+    day = last_day + timedelta(days=1) if last_day else _first_event_day(cursor)
+    yesterday = date.today() - timedelta(days=1)
+    processed = 0
+    while day and day <= yesterday:
+        rollup_day(cursor, day)
+        cursor.execute("DELETE FROM sla_rollup_state")
+        cursor.execute("INSERT INTO sla_rollup_state (last_day) VALUES (%s)", (day,))
+        conn.commit()
+        processed += 1
+        day += timedelta(days=1)
+
+    cursor.close()
+    print(f"SLA rollups: {processed} day(s) processed in {(time.perf_counter() - started) * 1000:.1f} ms.")
+    return processed
+
+
+def report(days=30, conn=None):
+    # Merges the stored daily sketches; never reads user_complaints_details
+    conn = conn or db
+    since = date.today() - timedelta(days=days)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT day, metric, complaint_type, priority, tower, worker_id, sample_count, sum_minutes, sketch
+        FROM sla_daily_rollups
+        WHERE day >= %s
+    """, (since,))
+    rows = cursor.fetchall()
+    cursor.execute("SELECT worker_id, worker_name FROM workers_details")
+    names = dict(cursor.fetchall())
+    last_day = _last_rolled_day(cursor)
+    cursor.close()
+
+    merged = {}
+    for day, metric, c_type, priority, tower, worker, count, total, sketch_json in rows:
+        # Backlog is a point-in-time snapshot; only the latest day counts
+        if metric == METRIC_BACKLOG and day != last_day:
+            continue
+        sketch = Sketch.from_json(sketch_json)
+        # Workers are shown by name; one deleted since keeps its id
+        if worker:
+            worker = names.get(worker, f"Worker #{worker}")
+        values = dict(zip(DIMENSIONS, (c_type, priority, tower, worker)))
+        for dimension in DIMENSIONS:
+            key = (metric, dimension, values[dimension])
+            entry = merged.setdefault(key, [0, 0, Sketch()])
+            entry[0] += count
+            entry[1] += float(total)
+            entry[2].merge(sketch)
+
+    result = {'since': since.isoformat(), 'through': last_day.isoformat() if last_day else None, 'metrics': {}}
+    for (metric, dimension, value), (count, total, sketch) in sorted(merged.items(), key=lambda i: (i[0][0], i[0][1], str(i[0][2]))):
+        by_dimension = result['metrics'].setdefault(METRIC_NAMES[metric], {}).setdefault(dimension, [])
+        stats = {'value': value or 'Unassigned', 'count': count,
+                 'mean_minutes': round(total / count, 1) if count else None}
+        for q in QUANTILES:
+            estimate = sketch.quantile(q)
+            stats[f"p{int(q * 100)}_minutes"] = round(estimate, 1) if estimate is not None else None
+        by_dimension.append(stats)
+    return result
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rollup'
+    if command not in ('rollup', 'backfill'):
+        print("Usage: python analytics.py [rollup|backfill]")
+        sys.exit(1)
+    for complex_id in tenancy.COMPLEXES:
+        with tenancy.use(complex_id):
+            if db:
+                run_rollups(backfill=command == 'backfill')
@@ -1,48 +1,190 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, Response, jsonify, abort, send_from_directory, make_response
 from flask_mail import Mail, Message
 from werkzeug.utils import secure_filename
 
 import hashlib
+import mimetypes
 import random
 import os
+import time
 from datetime import datetime
 
-from db_setup import connection, create_tables
+import tenancy
+from tenancy import ShardedConnection
+import circuit
+from live_updates import broker, worker_channel, user_channel, notify_assignment, notify_status, events_url
+import complaint_state
+import event_log
+import analytics
+import complaint_cube
+import worker_scores
+import dedup
+import idempotency
+from worker_directory import directory
+from notifications import notifier
+import scheduler
+import maintenance
+import assets
+import compression
+import profiling
+import admission
+from streaming import RowStream, stream_page
+from db_router import router
 import mysql.connector
 
+import config
 from config import MAIL_SERVER, MAIL_PORT, MAIL_USE_TLS, MAIL_USERNAME, MAIL_PASSWORD
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))  
-
 UPLOAD_FOLDER = os.path.join('static', 'complaint_images')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+RESET_CODE_TTL_MINUTES = getattr(config, 'RESET_CODE_TTL_MINUTES', 15)
+MAX_SYNC_ITEMS = 100     # queued offline resolutions accepted per sync request
+
+main = Blueprint('main', __name__)
+mail = Mail()
+
+# Opened on first use, not at import, so pre-forked workers each get their own
+# socket; each request class slot (admission.py) has a connection of its own
+db = ShardedConnection(check_schema=True, lane=admission.lane)
+# The pages that can still be shown while the database is down, as last served
+last_good = tenancy.PerComplex(circuit.LastGood)
+
+# Endpoints that work while the database circuit breaker is open: pages that
+# never query it, the login and registration forms (GET only), and the pages
+# that fall back to last_good
+WITHOUT_DB = {'main.home', 'main.user_dashboard', 'main.admin_dashboard', 'main.worker_dashboard',
+              'main.logout', 'main.admin_logout', 'main.worker_logout', 'main.asset', 'static',
+              'main.profiles', 'main.profile_file', 'main.job_metrics', 'main.db_status', 'main.request_metrics',
+              'main.worker_events', 'main.user_events'}
+FORMS_WITHOUT_DB = {'main.registration', 'main.user_login', 'main.admin_login', 'main.worker_login',
+                    'main.forgot_password', 'main.verify_reset_code', 'main.reset_password'}
+FROM_LAST_GOOD = {'main.view_complain', 'main.view_assigned_complaints', 'main.sla_reports'}
+
+
+def create_app():
+    started = time.perf_counter()
+
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
+    app.config['MAIL_SERVER'] = MAIL_SERVER
+    app.config['MAIL_PORT'] = MAIL_PORT
+    app.config['MAIL_USE_TLS'] = MAIL_USE_TLS
+    app.config['MAIL_USERNAME'] = MAIL_USERNAME
+    app.config['MAIL_PASSWORD'] = MAIL_PASSWORD
+    app.config['MAIL_DEFAULT_SENDER'] = MAIL_USERNAME
+
+    mail.init_app(app)
+    notifier.init_app(app, mail)
+    app.config['SCHEDULER_ENABLED'] = getattr(config, 'SCHEDULER_ENABLED', True)
+    profiling.init_app(app)
+    tenancy.init_app(app)
+    app.register_blueprint(main)
+    admission.init_app(app)
+    assets.init_app(app)
+    app.jinja_env.globals['events_url'] = events_url
+    app.after_request(compression.compress_response)
+
+    app.config['STARTUP_MS'] = (time.perf_counter() - started) * 1000
+    print(f"App created in {app.config['STARTUP_MS']:.1f} ms (database connects on first request).")
+    return app
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
-app.config['MAIL_SERVER'] = MAIL_SERVER
-app.config['MAIL_PORT'] = MAIL_PORT
-app.config['MAIL_USE_TLS'] = MAIL_USE_TLS
-app.config['MAIL_USERNAME'] = MAIL_USERNAME
-app.config['MAIL_PASSWORD'] = MAIL_PASSWORD
-app.config['MAIL_DEFAULT_SENDER'] = MAIL_USERNAME
-
-mail = Mail(app)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Connect to DB once when Flask starts
-db = connection()
-if not db:
-    print("DB connection failed.")
 
-@app.route('/')
+def current_user_id():
+    # Sessions created before integer user ids existed only carry the phone number
+    if 'user_id' not in session and session.get('user_phone_no'):
+        cursor = db.cursor()
+        cursor.execute("SELECT user_id FROM user_registeration_details WHERE user_phone_no = %s",
+                       (session['user_phone_no'],))
+        row = cursor.fetchone()
+        cursor.close()
+        if row:
+            session['user_id'] = row[0]
+    return session.get('user_id')
+
+
+def current_worker_id():
+    if 'worker_id' not in session and session.get('worker_phone_no'):
+        cursor = db.cursor()
+        cursor.execute("SELECT worker_id FROM workers_details WHERE worker_phone_no = %s",
+                       (session['worker_phone_no'],))
+        row = cursor.fetchone()
+        cursor.close()
+        if row:
+            session['worker_id'] = row[0]
+    return session.get('worker_id')
+
+@main.before_app_request
+def start_background_jobs():
+    # Started from the first request rather than create_app() so each
+    # pre-forked worker runs its own scheduler thread
+    if current_app.config['SCHEDULER_ENABLED']:
+        scheduler.start()
+
+
+@main.before_app_request
+def fail_fast_when_db_down():
+    # Answers at once while the database is known to be down, instead of
+    # tying up a request thread waiting on it
+    endpoint = request.endpoint
+    if (endpoint is None or endpoint in WITHOUT_DB or endpoint in FROM_LAST_GOOD
+            or (request.method == 'GET' and endpoint in FORMS_WITHOUT_DB)):
+        return None
+    breaker = tenancy.breaker()
+    if breaker is not None and breaker.blocked():
+        return degraded_page(breaker)
+
+
+@main.app_errorhandler(circuit.CircuitOpen)
+def circuit_open(err):
+    # The breaker opened while this request was running, in a route that
+    # doesn't handle database errors itself
+    return degraded_page(err.breaker)
+
+
+def degraded_page(breaker):
+    retry_after = breaker.retry_after()
+    if request.is_json or request.path.endswith('.json'):
+        response = jsonify({'error': 'The database is temporarily unavailable.', 'retry_after': retry_after})
+        response.status_code = 503
+    else:
+        response = make_response(render_template('degraded.html', retry_after=retry_after), 503)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def saved_page(key, template, message, fallback):
+    # When the database can't be reached: the page as it was last served,
+    # marked with its time, or else the usual error and redirect
+    saved = last_good.get(key)
+    if saved is None:
+        flash(message)
+        return redirect(url_for(fallback))
+    saved_at, context = saved
+    return render_template(template, stale_since=saved_at, **context)
+
+
+@main.after_app_request
+def remember_writes(response):
+    # Pins this session's reads to the primary for a few seconds after it
+    # changed something, so it never sees a replica from before its write
+    if request.method == 'POST' and response.status_code < 400:
+        router.mark_write()
+    return response
+
+
+@main.route('/')
 def home():
     return render_template('home.html')
 # -------------------------------------------------------------------------------------------------------------------------------------------------
 
-@app.route('/registration', methods=['GET', 'POST'])
+@main.route('/registration', methods=['GET', 'POST'])
 def registration():
     if request.method == 'POST':
         first_name = request.form.get('first_name')
@@ -54,19 +196,19 @@ def registration():
 
         if not all([first_name, email, phone, password]):
             flash("First name, phone number, email, and password are required.", "user_error")
-            return redirect(url_for('registration'))
+            return redirect(url_for('main.registration'))
 
         if not phone.isdigit():
             flash("Phone number should contain digits only.", "user_error")
-            return redirect(url_for("registration"))
+            return redirect(url_for("main.registration"))
 
         if len(phone) != 10:
             flash("Phone number must be exactly 10 digits.", "user_error")
-            return redirect(url_for("registration"))
+            return redirect(url_for("main.registration"))
 
         if len(password) < 6:
             flash("Password must be at least 6 characters long.", "user_error")
-            return redirect(url_for("registration"))
+            return redirect(url_for("main.registration"))
 
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
 
@@ -77,14 +219,14 @@ def registration():
 
             if result:
                 flash("You have already registered before. Please login.", "user_error")
-                return redirect(url_for('user_login'))
+                return redirect(url_for('main.user_login'))
 
             cursor.execute("SELECT user_email_id FROM user_registeration_details WHERE user_email_id = %s", (email,))
             email_exists = cursor.fetchone()
 
             if email_exists:         
                 flash("This email is already registered. Please login.", "user_error")
-                return redirect(url_for('user_login'))
+                return redirect(url_for('main.user_login'))
 
             cursor.execute(
                 "INSERT INTO user_registeration_details (user_first_name, user_last_name, user_email_id, user_phone_no, user_gender, user_password) VALUES (%s, %s, %s, %s, %s, %s)",
@@ -94,17 +236,17 @@ def registration():
             cursor.close()
 
             flash("Registration successful! Now login.")
-            return redirect(url_for('user_login'))
+            return redirect(url_for('main.user_login'))
 
         except Exception as e:
             flash(f"Database error: {str(e)}", "user_error")
-            return redirect(url_for('registration'))
+            return redirect(url_for('main.registration'))
 
     return render_template('registration.html')
 
 
 
-@app.route('/user_login', methods=['GET', 'POST']) 
+@main.route('/user_login', methods=['GET', 'POST']) 
 def user_login():
     if request.method == 'POST':
         user_phone_no = request.form.get('user_phone_no')
@@ -112,14 +254,14 @@ def user_login():
 
         if not all([user_phone_no, user_password]):
             flash("Phone number and password are required.", "user_error")
-            return redirect(url_for('user_login'))
+            return redirect(url_for('main.user_login'))
 
         hashed_password = hashlib.sha256(user_password.encode()).hexdigest()
 
         try:
             my_cursor = db.cursor()
             query = """
-                SELECT user_phone_no
+                SELECT user_phone_no, user_id
                 FROM user_registeration_details
                 WHERE user_phone_no = %s AND user_password = %s;
             """
@@ -129,30 +271,31 @@ def user_login():
             
             if result:
                 session['user_phone_no'] = user_phone_no
+                session['user_id'] = result[1]
                 flash("Login successful.", "user_success")  
-                return redirect(url_for('user_dashboard'))
+                return redirect(url_for('main.user_dashboard'))
             else:
                 flash("Incorrect phone number or password.", "user_error")
-                return redirect(url_for('user_login'))
+                return redirect(url_for('main.user_login'))
 
         except Exception as e:
             flash(f"Login failed: {e}", "user_error")  
-            return redirect(url_for('user_login'))
+            return redirect(url_for('main.user_login'))
 
     return render_template('user_login.html')
 
 
 
-@app.route('/add_your_address', methods=['GET', 'POST'])
+@main.route('/add_your_address', methods=['GET', 'POST'])
 def add_your_address():
     if not db:
         flash("No database connection available.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
     
     user_phone_no = session['user_phone_no']
     if 'user_phone_no' not in session:
         flash("Please log in first.", "error")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
 
     my_cursor = db.cursor()
     query = "SELECT * FROM user_address_details WHERE user_phone_no = %s"
@@ -162,7 +305,7 @@ def add_your_address():
 
     if address:
         flash("Address already added.", "info")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     if request.method == 'POST':
         house_no = request.form.get('house_no')
@@ -178,11 +321,11 @@ def add_your_address():
             my_cursor = db.cursor()
             if not all([house_no, tower, floor, locality, area, city, state, pincode]):
                 flash("All address fields are required.")
-                return redirect(url_for('add_your_address'))
+                return redirect(url_for('main.add_your_address'))
 
             if not house_no.isdigit() or not floor.isdigit() or not pincode.isdigit():
                 flash("House No., Floor, and Pincode must be numeric.")
-                return redirect(url_for('add_your_address'))
+                return redirect(url_for('main.add_your_address'))
 
             house_no = int(house_no)
             floor = int(floor)
@@ -199,33 +342,34 @@ def add_your_address():
             my_cursor.close()
 
             flash("Address added successfully.", "success")
-            return redirect(url_for('user_dashboard'))
+            return redirect(url_for('main.user_dashboard'))
 
         except Exception as e:
             flash(f"Error adding address: {e}", "error")
-            return redirect(url_for('add_your_address'))
+            return redirect(url_for('main.add_your_address'))
 
     return render_template('add_your_address.html')
 
 
 
 
-@app.route('/add_complain', methods=['GET', 'POST'])
+@main.route('/add_complain', methods=['GET', 'POST'])
 def add_complain():
     if not db:
         flash("No database connection available.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     user_phone_no = session.get('user_phone_no')
     if not user_phone_no:
         flash("Session expired. Please log in again.")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
 
     if request.method == 'POST':
+        idem_key = ''
         complaint_scope = request.form.get('complain')  # P or C
         if complaint_scope not in ["P", "C"]:
             flash("Invalid scope. Use 'P' for Personal or 'C' for Community.")
-            return redirect(url_for('add_complain'))
+            return redirect(url_for('main.add_complain'))
 
         try:
             if complaint_scope == "P":
@@ -236,7 +380,7 @@ def add_complain():
 
                 if not address_result:
                     flash("You must add your address before submitting a personal complaint.")
-                    return redirect(url_for('add_your_address'))
+                    return redirect(url_for('main.add_your_address'))
 
             complaint_type = request.form.get('complain_type')
             complaint_description = request.form.get('complain_description')
@@ -246,43 +390,78 @@ def add_complain():
             filename = None
             verification_code = str(random.randint(100000, 999999))
 
+            if complaint_priority not in ["Urgent", "Normal"]:
+                flash("Invalid priority. Choose 'Urgent' or 'Normal'.")
+                return redirect(url_for('main.add_complain'))
+
+            # A double-tapped or retried POST carries the same key as the
+            # first one; it gets the first one's result instead of another
+            # insert, image copy and email
+            idem_key = request.form.get('idempotency_key', '')
+            if idem_key and not idempotency.valid(idem_key):
+                flash("This form has expired. Please submit your complaint again.")
+                return redirect(url_for('main.add_complain'))
+            if idem_key:
+                claimed, earlier_id = idempotency.claim(db, idem_key, current_user_id())
+                if not claimed:
+                    if earlier_id:
+                        flash("Complaint submitted successfully.")
+                    else:
+                        flash("Your complaint is already being submitted.")
+                    return redirect(url_for('main.user_dashboard'))
+
             if image_file and allowed_file(image_file.filename):
                 filename = secure_filename(image_file.filename)
                 timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                new_filename = f"complaint_{user_phone_no}_{timestamp}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+                new_filename = f"complaint_{tenancy.current_complex_id()}_{user_phone_no}_{timestamp}_{filename}"
+                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], new_filename)
                 image_file.save(filepath)
             else:
                 new_filename = None 
 
-            if complaint_priority not in ["Urgent", "Normal"]:
-                flash("Invalid priority. Choose 'Urgent' or 'Normal'.")
-                return redirect(url_for('add_complain'))
-
             complaint_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+            # Community complaints about the same place and problem are flagged for an admin to merge
+            duplicate = None
+            if complaint_scope == "C":
+                dedup.index.warm(db)
+                duplicate = dedup.index.find(location, complaint_type, complaint_description)
+
             cursor = db.cursor()
             insert_query = """
                 INSERT INTO user_complaints_details (
-                    user_phone_no, complaint_type, complaint_desc, complaint_priority, 
-                    complaint_datetime, status, complaint_scope, location, assigned_to, image_path,verification_code
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
+                    user_phone_no, user_id, complaint_type, complaint_desc, complaint_priority, 
+                    complaint_datetime, status, complaint_scope, location, image_path,verification_code,
+                    suspected_duplicate_of
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
             """
             cursor.execute(insert_query, (
-                user_phone_no, complaint_type, complaint_description, complaint_priority,
+                user_phone_no, current_user_id(), complaint_type, complaint_description, complaint_priority,
                 complaint_datetime, 'Pending', 'Personal' if complaint_scope == 'P' else 'Community',
-                location, 'Not Assigned',new_filename,verification_code
+                location, new_filename,verification_code,
+                duplicate[0] if duplicate else None
             ))
+            new_complaint_id = cursor.lastrowid
+            event_log.record(new_complaint_id, event_log.CREATED, event_log.ROLE_USER, user_phone_no, complaint_priority, cursor)
+            if idem_key:
+                idempotency.complete(cursor, idem_key, new_complaint_id)
             db.commit()
 
+            if complaint_priority == 'Urgent':
+                notifier.notify_admins(f"New Urgent complaint ID {new_complaint_id} ({complaint_type}): {complaint_description}")
+
+            if duplicate:
+                flash(f"A similar complaint (ID {duplicate[0]}) is already open for this location. "
+                      "An admin may merge yours into it so it is handled together.")
+            elif complaint_scope == "C":
+                dedup.index.add(new_complaint_id, location, complaint_type, complaint_description)
+
             cursor = db.cursor()
             cursor.execute("""
                 SELECT complaint_id, complaint_type, complaint_desc, complaint_priority
                 FROM user_complaints_details
-                WHERE user_phone_no = %s
-                ORDER BY complaint_datetime DESC
-                LIMIT 1
-            """, (user_phone_no,))
+                WHERE complaint_id = %s
+            """, (new_complaint_id,))
             complaint = cursor.fetchone()
             cursor.close()
 
@@ -319,60 +498,66 @@ def add_complain():
 
             cursor.close()
             flash("Complaint submitted successfully.")
-            return redirect(url_for('user_dashboard'))
-
-        except mysql.connector.Error as err:
+            return redirect(url_for('main.user_dashboard'))
+
+        except Exception as err:
+            # Whatever failed (the database, saving the image), the key is
+            # given back so the form can be sent again; a complaint already
+            # committed keeps it
+            db.rollback()
+            if idem_key:
+                idempotency.release(db, idem_key)
+            if not isinstance(err, mysql.connector.Error):
+                raise
             flash(f"Database error: {err}")
-            return redirect(url_for('add_complain'))
+            return redirect(url_for('main.add_complain'))
 
-    return render_template('add_complaint.html')
+    return render_template('add_complaint.html', idempotency_key=idempotency.new_key())
 
 
-@app.route('/view_complaints', methods=['GET', 'POST'])
+@main.route('/view_complaints', methods=['GET', 'POST'])
 def view_complain():
-    if not db:
-        flash("No database connection available.")
-        return redirect(url_for('user_dashboard'))
-
     user_phone_no = session.get('user_phone_no')
     if not user_phone_no:
         flash("Session expired. Please log in again.")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
+
+    key = ('view_complaints', user_phone_no)
+    if not db:
+        return saved_page(key, 'view_complaints.html', "No database connection available.", 'main.user_dashboard')
 
-    complaints = []
     try:
-        my_cursor = db.cursor()
         query = """
-            SELECT complaint_id, user_phone_no, complaint_type, complaint_desc, 
-                   complaint_priority, complaint_datetime, status, complaint_scope, 
-                   location, assigned_to, worker_phone_no, image_path
-            FROM user_complaints_details
-            WHERE user_phone_no = %s ORDER BY complaint_datetime DESC
+            SELECT c.complaint_id, c.user_phone_no, c.complaint_type, c.complaint_desc, 
+                   c.complaint_priority, c.complaint_datetime, c.status, c.complaint_scope, 
+                   c.location, COALESCE(w.worker_name, 'Not Assigned'), w.worker_phone_no, c.image_path
+            FROM user_complaints_details c
+            LEFT JOIN workers_details w ON w.worker_id = c.worker_id
+            WHERE c.user_id = %s ORDER BY c.complaint_datetime DESC
         """
-        my_cursor.execute(query, (user_phone_no,))
-        complaints = my_cursor.fetchall()
-        my_cursor.close()
-
-        if not complaints:
-            flash("No complaints found.")
+        complaints = RowStream(query, (current_user_id(),), connect=router.stream_connection)
 
     except mysql.connector.Error as err:
-        flash(f"Database error: {err}")
-        return redirect(url_for('user_dashboard'))
+        return saved_page(key, 'view_complaints.html', f"Database error: {err}", 'main.user_dashboard')
 
-    return render_template('view_complaints.html', complaints=complaints)
+    # Rows are rendered as they come off the cursor; the template shows
+    # "No complaints found." when there are none. The list is kept for when
+    # the database is down.
+    return stream_page('view_complaints.html', complaints=last_good.tee(key, complaints), stream=complaints)
 
 
-@app.route('/delete_complaint', methods=['GET', 'POST'])
+
+
+@main.route('/delete_complaint', methods=['GET', 'POST'])
 def delete_complaint():
     if not db:
         flash("No database connection available.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     user_phone_no = session.get('user_phone_no')
     if not user_phone_no:
         flash("Session expired. Please log in again.")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
 
     complaints = []
     
@@ -382,14 +567,14 @@ def delete_complaint():
         query = """SELECT complaint_id, complaint_type, complaint_desc, complaint_priority, 
                           complaint_datetime, status, complaint_scope 
                    FROM user_complaints_details 
-                   WHERE user_phone_no = %s 
+                   WHERE user_id = %s 
                    ORDER BY complaint_datetime DESC"""
-        my_cursor.execute(query, (user_phone_no,))
+        my_cursor.execute(query, (current_user_id(),))
         complaints = my_cursor.fetchall()
         my_cursor.close()
     except Exception as e:
         flash(f"Error fetching complaints: {e}")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     # Handle POST (form submitted)
     if request.method == 'POST':
@@ -402,13 +587,15 @@ def delete_complaint():
         try:
             my_cursor = db.cursor()
             delete_query = """DELETE FROM user_complaints_details 
-                              WHERE complaint_id = %s AND user_phone_no = %s AND status = 'Pending'"""
-            my_cursor.execute(delete_query, (int(complaint_id), user_phone_no))
+                              WHERE complaint_id = %s AND user_id = %s AND status = 'Pending'"""
+            my_cursor.execute(delete_query, (int(complaint_id), current_user_id()))
 
             if my_cursor.rowcount == 0:
                 flash("Complaint not found or already processed.")
             else:
+                event_log.record(int(complaint_id), event_log.DELETED, event_log.ROLE_USER, user_phone_no, None, my_cursor)
                 db.commit()
+                dedup.index.discard(int(complaint_id))
                 flash("Complaint deleted successfully.")
             
             my_cursor.close()
@@ -420,27 +607,28 @@ def delete_complaint():
 
 
 
-@app.route('/give_feedback', methods=['GET', 'POST'])
+@main.route('/give_feedback', methods=['GET', 'POST'])
 def give_feedback():
     if not db:
         flash("No database connection available.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     user_phone_no = session.get('user_phone_no')
     if not user_phone_no:
         flash("Session expired. Please log in again.")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
 
     complaints = []
     try:
         my_cursor = db.cursor()
         # Fetch unresolved complaints for feedback
         query = """ 
-            SELECT complaint_id, complaint_desc, complaint_datetime, complaint_priority
-            FROM user_complaints_details
-            WHERE user_phone_no = %s AND status = 'Resolved' AND feedback_rating IS NULL
+            SELECT c.complaint_id, c.complaint_desc, c.complaint_datetime, c.complaint_priority,
+                   c.worker_id, c.complaint_type
+            FROM user_complaints_details c
+            WHERE c.user_id = %s AND c.status = 'Resolved' AND c.feedback_rating IS NULL
         """
-        my_cursor.execute(query, (user_phone_no,))
+        my_cursor.execute(query, (current_user_id(),))
         complaints = my_cursor.fetchall()
         my_cursor.close()
 
@@ -450,7 +638,7 @@ def give_feedback():
 
     except mysql.connector.Error as err:
         flash(f"Database error while fetching complaints: {err}")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     # If feedback form submitted
     if request.method == 'POST':
@@ -471,37 +659,43 @@ def give_feedback():
             update_query = """
                 UPDATE user_complaints_details
                 SET feedback_rating = %s, feedback_text = %s
-                WHERE complaint_id = %s AND user_phone_no = %s
+                WHERE complaint_id = %s AND user_id = %s AND feedback_rating IS NULL
             """
-            my_cursor.execute(update_query, (int(feedback_rating), feedback_text, int(complaint_id), user_phone_no))
+            my_cursor.execute(update_query, (int(feedback_rating), feedback_text, int(complaint_id), current_user_id()))
+            if my_cursor.rowcount:
+                event_log.record(int(complaint_id), event_log.FEEDBACK, event_log.ROLE_USER, user_phone_no, feedback_rating, my_cursor)
+                rated = {c[0]: (c[4], c[5]) for c in complaints}
+                if int(complaint_id) in rated:
+                    worker_scores.record_feedback(my_cursor, *rated[int(complaint_id)], int(feedback_rating))
             db.commit()
             my_cursor.close()
             flash("Thank you for your feedback.")
-            return redirect(url_for('user_dashboard'))
+            return redirect(url_for('main.user_dashboard'))
 
         except mysql.connector.Error as err:
             flash(f"Database error while saving feedback: {err}")
 
     return render_template('give_feedback.html', complaints=complaints)
 
-@app.route('/user_dashboard')
+@main.route('/user_dashboard')
 def user_dashboard():
     user_phone_no = session.get('user_phone_no')
     if not user_phone_no:
         flash("Session expired. Please log in again.")
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
     return render_template('user_dashboard.html', user_phone_no=user_phone_no)
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     session.pop('user_phone_no', None)
+    session.pop('user_id', None)
     flash("You have been logged out.")
-    return redirect(url_for('user_login'))
+    return redirect(url_for('main.user_login'))
 
 
 # ADMIN -----------------------------------------------------------------------------------------------------------------------------------
 
-@app.route('/admin_login', methods=['GET', 'POST']) 
+@main.route('/admin_login', methods=['GET', 'POST']) 
 def admin_login():
     if request.method == 'POST':
         admin_username = request.form.get('admin_username')
@@ -509,7 +703,7 @@ def admin_login():
 
         if not all([admin_username, admin_password]):
             flash("All fields are required.")
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('main.admin_login'))
 
         hashed_password = hashlib.sha256(admin_password.encode()).hexdigest()
 
@@ -526,7 +720,7 @@ def admin_login():
                 session['admin_username'] = admin_username
                 session['admin_username'] = result[0]
                 flash("Admin login successful.")
-                return redirect(url_for('admin_dashboard'))
+                return redirect(url_for('main.admin_dashboard'))
             else:
                 flash("Invalid credentials.")
         except Exception as e:
@@ -535,20 +729,20 @@ def admin_login():
     return render_template('admin_login.html')
 
 
-@app.route('/admin_dashboard')
+@main.route('/admin_dashboard')
 def admin_dashboard():
     if 'admin_username' not in session:
         flash("Please log in as admin.")
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
 
     return render_template('admin_dashboard.html', admin_username=session.get('admin_username'))
 
 
-@app.route('/view_all_complaints', methods=['GET', 'POST'])
+@main.route('/view_all_complaints', methods=['GET', 'POST'])
 def view_all_complaints():
     if 'admin_username' not in session:
         flash("Please log in as admin.")
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
 
     filters = []
     values = []
@@ -558,50 +752,56 @@ def view_all_complaints():
         status = request.form.get('status')
         scope = request.form.get('scope')
         assigned_to = request.form.get('assigned_to')
+        assigned_worker_id = request.form.get('assigned_worker_id')
 
         if priority and priority in ['Urgent', 'Normal']:
-            filters.append("complaint_priority = %s")
+            filters.append("c.complaint_priority = %s")
             values.append(priority)
 
         if status and status in ['Pending', 'In progress', 'Resolved']:
-            filters.append("status = %s")
+            filters.append("c.status = %s")
             values.append(status)
 
         if scope and scope in ['Personal', 'Community']:
-            filters.append("complaint_scope = %s")
+            filters.append("c.complaint_scope = %s")
             values.append(scope)
 
-        if assigned_to:
-            filters.append("assigned_to = %s")
-            values.append(assigned_to)
+        # Filter on worker_id (idx_complaints_worker) rather than comparing names
+        if assigned_worker_id and assigned_worker_id.isdigit():
+            filters.append("c.worker_id = %s")
+            values.append(int(assigned_worker_id))
+        elif assigned_to and assigned_to.strip().lower() == 'not assigned':
+            filters.append("c.worker_id IS NULL")
+        elif assigned_to:
+            worker_ids = directory.ids_named(db, assigned_to) or [0]
+            filters.append("c.worker_id IN (" + ", ".join(["%s"] * len(worker_ids)) + ")")
+            values.extend(worker_ids)
 
     query = """
-        SELECT complaint_id, user_phone_no, complaint_type, complaint_desc, 
-               complaint_priority, complaint_datetime, status, complaint_scope, 
-               location, assigned_to, image_path
-        FROM user_complaints_details
+        SELECT c.complaint_id, c.user_phone_no, c.complaint_type, c.complaint_desc, 
+               c.complaint_priority, c.complaint_datetime, c.status, c.complaint_scope, 
+               c.location, COALESCE(w.worker_name, 'Not Assigned'), c.image_path
+        FROM user_complaints_details c
+        LEFT JOIN workers_details w ON w.worker_id = c.worker_id
     """
     if filters:
         query += " WHERE " + " AND ".join(filters)
-    query += " ORDER BY complaint_datetime DESC"
+    query += " ORDER BY c.complaint_datetime DESC"
 
+    key = ('view_all_complaints', tuple(filters), tuple(values))
     try:
-        cursor = db.cursor()
-        cursor.execute(query, tuple(values))
-        complaints = cursor.fetchall()
-        cursor.close()
-    except Exception as e:
-        flash(f"Database error: {e}")
-        complaints = []
+        complaints = RowStream(query, values, connect=router.stream_connection)
+    except mysql.connector.Error as err:
+        return saved_page(key, 'view_all_complaints.html', f"Database error: {err}", 'main.admin_dashboard')
 
-    return render_template('view_all_complaints.html', complaints=complaints)
+    return stream_page('view_all_complaints.html', complaints=last_good.tee(key, complaints), stream=complaints)
 
 
-@app.route('/add_worker', methods=['GET', 'POST'])
+@main.route('/add_worker', methods=['GET', 'POST'])
 def add_worker():
     if 'admin_username' not in session:
         flash("Please log in as admin.")
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
 
     if request.method == 'POST':
         worker_name = request.form.get('worker_name').strip()
@@ -638,9 +838,10 @@ def add_worker():
             my_cursor.execute(insert_query, (worker_name, worker_phone_no, hashed_password, specialization))
             db.commit()
             my_cursor.close()
+            directory.invalidate()
 
             flash("Worker added successfully.")
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
 
         except mysql.connector.Error as err:
             flash(f"Database error: {err}")
@@ -649,29 +850,32 @@ def add_worker():
     return render_template('add_worker.html')
 
 
-@app.route('/assign_complaint', methods=['GET', 'POST'])
+@main.route('/assign_complaint', methods=['GET', 'POST'])
 def assign_complaint():
     if not db:
         flash("Database connection unavailable.")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     try:
         cursor = db.cursor()
 
         # Fetch unassigned complaints
         cursor.execute("""
-            SELECT complaint_id, complaint_type, complaint_scope, location 
+            SELECT complaint_id, complaint_type, complaint_scope, location, user_phone_no 
             FROM user_complaints_details 
-            WHERE assigned_to = 'Not Assigned'
+            WHERE worker_id IS NULL AND status != 'Resolved' AND parent_complaint_id IS NULL
         """)
         complaints = cursor.fetchall()
 
-        # Fetch all available workers
+        # Fetch all available workers, with their running feedback score
         cursor.execute("""
-            SELECT worker_id, worker_name, specialization 
-            FROM workers_details
+            SELECT w.worker_id, w.worker_name, w.specialization,
+                   s.rating_count, s.rating_sum, s.rating_sum_sq, s.decayed_sum, s.decayed_weight
+            FROM workers_details w
+            LEFT JOIN worker_feedback_scores s
+                   ON s.worker_id = w.worker_id AND s.complaint_type = ''
         """)
-        workers = cursor.fetchall()
+        workers = [w[:3] + (worker_scores.summary(*w[3:]),) for w in cursor.fetchall()]
         cursor.close()
 
         if request.method == 'POST':
@@ -680,19 +884,9 @@ def assign_complaint():
 
             if not complaint_id or not complaint_id.isdigit() or not worker_id or not worker_id.isdigit():
                 flash("Invalid Complaint ID or Worker ID.")
-                return redirect(url_for('assign_complaint'))
+                return redirect(url_for('main.assign_complaint'))
 
             cursor = db.cursor()
-            # Check if complaint exists and is still unassigned
-            cursor.execute("""
-                SELECT complaint_id FROM user_complaints_details 
-                WHERE complaint_id = %s AND assigned_to = 'Not Assigned'
-            """, (int(complaint_id),))
-            if not cursor.fetchone():
-                flash("Complaint is either invalid or already assigned.")
-                cursor.close()
-                return redirect(url_for('assign_complaint'))
-
             # Get selected worker details
             cursor.execute("""
                 SELECT worker_name, worker_phone_no FROM workers_details 
@@ -702,95 +896,86 @@ def assign_complaint():
             if not worker:
                 flash("Invalid Worker ID.")
                 cursor.close()
-                return redirect(url_for('assign_complaint'))
+                return redirect(url_for('main.assign_complaint'))
 
             worker_name, worker_phone_no = worker
-
-            # Update complaint
-            cursor.execute("""
-                UPDATE user_complaints_details 
-                SET assigned_to = %s, worker_phone_no = %s, status = 'In Progress'
-                WHERE complaint_id = %s
-            """, (worker_name, worker_phone_no, int(complaint_id)))
-            db.commit()
             cursor.close()
 
+            # Conditional update: fails if another admin assigned it first
+            if not complaint_state.assign(db, int(complaint_id), int(worker_id), actor=session.get('admin_username')):
+                flash("Complaint is either invalid or already assigned.")
+                return redirect(url_for('main.assign_complaint'))
+
+            owners = {c[0]: c[4] for c in complaints}
+            notify_assignment(worker_phone_no, owners.get(int(complaint_id)), int(complaint_id), worker_name)
+            notifier.notify_user(owners.get(int(complaint_id)),
+                                 f"Complaint ID {complaint_id} was assigned to {worker_name} and is now In Progress.")
             flash(f"Complaint ID {complaint_id} assigned to {worker_name}.")
-            return redirect(url_for('assign_complaint'))
+            return redirect(url_for('main.assign_complaint'))
 
         return render_template('assign_complaint.html', complaints=complaints, workers=workers)
 
     except mysql.connector.Error as err:
         flash(f"Database error: {err}")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
 
-@app.route('/update_complaint_status', methods=['GET', 'POST'])
+@main.route('/update_complaint_status', methods=['GET', 'POST'])
 def update_complaint_status():
     if not db:
         flash("Database connection unavailable.")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     try:
-        cursor = db.cursor()
-
-        # Fetch all complaints
-        cursor.execute("""
-            SELECT complaint_id, complaint_desc, status 
-            FROM user_complaints_details
-            ORDER BY complaint_datetime DESC
-        """)
-        complaints = cursor.fetchall()
-        cursor.close()
-
         if request.method == 'POST':
             complaint_id = request.form.get('complaint_id')
             new_status = request.form.get('new_status')
 
             if not complaint_id or not complaint_id.isdigit():
                 flash("Invalid Complaint ID.")
-                return redirect(url_for('update_complaint_status'))
+                return redirect(url_for('main.update_complaint_status'))
 
-            valid_statuses = ['Pending', 'In Progress', 'Resolved']
-            if new_status not in valid_statuses:
+            if new_status not in complaint_state.STATUSES:
                 flash("Invalid status selected.")
-                return redirect(url_for('update_complaint_status'))
+                return redirect(url_for('main.update_complaint_status'))
 
-            cursor = db.cursor()
-            cursor.execute("SELECT status FROM user_complaints_details WHERE complaint_id = %s", (int(complaint_id),))
-            result = cursor.fetchone()
-            if not result:
-                flash("Complaint ID not found.")
-                cursor.close()
-                return redirect(url_for('update_complaint_status'))
+            # Version the admin saw when the page loaded, if the form sent one
+            version = request.form.get('version')
+            expected_version = int(version) if version and version.isdigit() else None
 
-            current_status = result[0]
-            if current_status == 'Resolved' and new_status != 'Resolved':
-                flash("Cannot downgrade from Resolved. No changes made.")
-                cursor.close()
-                return redirect(url_for('update_complaint_status'))
+            updated, reason = complaint_state.change_status(db, int(complaint_id), new_status, expected_version, actor=session.get('admin_username'))
+            if not updated:
+                flash(reason)
+                return redirect(url_for('main.update_complaint_status'))
 
-            cursor.execute(
-                "UPDATE user_complaints_details SET status = %s WHERE complaint_id = %s",
-                (new_status, int(complaint_id))
-            )
-            db.commit()
+            cursor = db.cursor()
+            cursor.execute("SELECT user_phone_no FROM user_complaints_details WHERE complaint_id = %s",
+                           (int(complaint_id),))
+            owner = cursor.fetchone()
             cursor.close()
+            owner_phone_no = owner[0] if owner else None
+            notify_status(owner_phone_no, int(complaint_id), new_status)
+            notifier.notify_user(owner_phone_no, f"Complaint ID {complaint_id} is now {new_status}.")
             flash(f"Complaint ID {complaint_id} status updated to {new_status}.")
-            return redirect(url_for('update_complaint_status'))
+            return redirect(url_for('main.update_complaint_status'))
 
-        return render_template('update_complaint_status.html', complaints=complaints)
+        complaints = RowStream("""
+            SELECT complaint_id, complaint_desc, status, version
+            FROM user_complaints_details
+            ORDER BY complaint_datetime DESC
+        """, connect=router.stream_connection)
+        return stream_page('update_complaint_status.html', complaints=complaints, stream=complaints)
 
     except mysql.connector.Error as err:
         flash(f"Database error: {err}")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
 
-@app.route('/delete_worker', methods=['GET', 'POST'])
+@main.route('/delete_worker', methods=['GET', 'POST'])
 def delete_worker():
     if not db:
         flash("Database not connected.")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     try:
         cursor = db.cursor()
@@ -807,7 +992,7 @@ def delete_worker():
             worker_id = request.form.get('worker_id')
             if not worker_id or not worker_id.isdigit():
                 flash("Invalid Worker ID.")
-                return redirect(url_for('delete_worker'))
+                return redirect(url_for('main.delete_worker'))
 
             worker_id = int(worker_id)
 
@@ -816,36 +1001,251 @@ def delete_worker():
             result = cursor.fetchone()
             if not result:
                 flash("Worker not found.")
-                return redirect(url_for('delete_worker'))
+                return redirect(url_for('main.delete_worker'))
 
             worker_name = result[0]
+            # Open jobs go back to the assignment queue and the worker's feedback
+            # scores go with it; the FK clears worker_id on the rest
+            reopened = complaint_state.unassign_worker(cursor, worker_id, actor=session.get('admin_username'))
+            cursor.execute("DELETE FROM worker_feedback_scores WHERE worker_id = %s", (worker_id,))
             cursor.execute("DELETE FROM workers_details WHERE worker_id = %s", (worker_id,))
             db.commit()
             cursor.close()
-            flash(f"Worker '{worker_name}' deleted successfully.")
-            return redirect(url_for('delete_worker'))
+            directory.invalidate()
+            flash(f"Worker '{worker_name}' deleted successfully."
+                  + (f" {len(reopened)} open complaint(s) are back in the assignment queue." if reopened else ""))
+            return redirect(url_for('main.delete_worker'))
 
         return render_template('delete_worker.html', workers=workers)
 
     except Exception as e:
         flash(f"Error during deletion: {e}")
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
+
+
+@main.route('/review_duplicates', methods=['GET', 'POST'])
+def review_duplicates():
+    if 'admin_username' not in session:
+        flash("Please log in as admin.")
+        return redirect(url_for('main.admin_login'))
+
+    if not db:
+        flash("Database connection unavailable.")
+        return redirect(url_for('main.admin_dashboard'))
+
+    try:
+        if request.method == 'POST':
+            complaint_id = request.form.get('complaint_id')
+            action = request.form.get('action')
+
+            if not complaint_id or not complaint_id.isdigit() or action not in ['merge', 'dismiss']:
+                flash("Invalid request.")
+                return redirect(url_for('main.review_duplicates'))
+
+            if action == 'merge':
+                if complaint_state.merge_duplicate(db, int(complaint_id), actor=session.get('admin_username')):
+                    flash(f"Complaint ID {complaint_id} merged. Assigning the parent now covers it.")
+                else:
+                    flash("Complaint could not be merged. It may already be assigned or merged.")
+            else:
+                complaint_state.dismiss_duplicate(db, int(complaint_id))
+                flash(f"Complaint ID {complaint_id} kept as a separate complaint.")
+            return redirect(url_for('main.review_duplicates'))
+
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT c.complaint_id, c.complaint_type, c.location, c.complaint_desc, c.complaint_datetime,
+                   p.complaint_id, p.complaint_desc, p.status, COALESCE(w.worker_name, 'Not Assigned')
+            FROM user_complaints_details c
+            JOIN user_complaints_details p ON p.complaint_id = c.suspected_duplicate_of
+            LEFT JOIN workers_details w ON w.worker_id = p.worker_id
+            WHERE c.parent_complaint_id IS NULL AND c.status = 'Pending'
+            ORDER BY c.complaint_datetime DESC
+        """)
+        duplicates = cursor.fetchall()
+        cursor.close()
+
+    except mysql.connector.Error as err:
+        flash(f"Database error: {err}")
+        return redirect(url_for('main.admin_dashboard'))
+
+    return render_template('review_duplicates.html', duplicates=duplicates)
+
+
+@main.route('/assets/<path:filename>')
+def asset(filename):
+    original, digest = assets.split_fingerprint(filename)
+    try:
+        current = assets.fingerprint(original)
+    except OSError:
+        abort(404)
+    if digest != current:
+        # Stale or missing fingerprint: send them to the current version
+        return redirect(assets.asset_url(original))
+    encoding = compression.choose_encoding(request.headers.get('Accept-Encoding'))
+    body = assets.compressed(original, encoding)
+    if body is None:
+        response = send_from_directory(current_app.static_folder, original, max_age=assets.MAX_AGE)
+    else:
+        response = current_app.response_class(body, mimetype=mimetypes.guess_type(original)[0])
+        response.headers['Content-Encoding'] = encoding
+        response.cache_control.max_age = assets.MAX_AGE
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@main.route('/profiles')
+def profiles():
+    if 'admin_username' not in session:
+        flash("Please log in as admin.")
+        return redirect(url_for('main.admin_login'))
+    return render_template('profiles.html', profiles=profiling.saved_profiles(),
+                           sample_rate=profiling.SAMPLE_RATE)
+
+
+@main.route('/profiles/<route>/<name>')
+def profile_file(route, name):
+    if 'admin_username' not in session:
+        abort(403)
+    # Only the per-route directories profiling wrote; send_from_directory
+    # keeps the file name inside PROFILE_DIR
+    if route not in profiling.profile_routes():
+        abort(404)
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), f"{route}/{name}",
+                               as_attachment=True)
+
+
+@main.route('/worker_suggestions')
+def worker_suggestions():
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+    if not db:
+        return jsonify([])
+    return jsonify(directory.search(db, request.args.get('q', '')))
+
+
+@main.route('/job_metrics')
+def job_metrics():
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+    return jsonify(scheduler.metrics())
+
+
+@main.route('/db_status')
+def db_status():
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+    return jsonify({'breakers': circuit.status(), 'replicas': router.status()})
+
+
+@main.route('/request_metrics')
+def request_metrics():
+    # Slots, queue lengths and queue times per request class, this process only
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+    return jsonify(admission.metrics())
+
 
+def sla_report_days():
+    days = request.args.get('days', '30')
+    return min(int(days), 365) if days.isdigit() and int(days) > 0 else 30
 
-@app.route('/admin_logout')
+
+@main.route('/sla_reports')
+def sla_reports():
+    if 'admin_username' not in session:
+        flash("Please log in as admin.")
+        return redirect(url_for('main.admin_login'))
+
+    key = ('sla_reports', sla_report_days())
+    try:
+        with router.reader(db) as conn:
+            report = analytics.report(sla_report_days(), conn=conn)
+    except mysql.connector.Error as err:
+        return saved_page(key, 'sla_reports.html', f"Database error: {err}", 'main.admin_dashboard')
+
+    last_good.put(key, {'report': report, 'dimensions': analytics.DIMENSIONS})
+    return render_template('sla_reports.html', report=report, dimensions=analytics.DIMENSIONS)
+
+
+@main.route('/sla_reports.json')
+def sla_reports_json():
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+
+    try:
+        with router.reader(db) as conn:
+            return jsonify(analytics.report(sla_report_days(), conn=conn))
+    except mysql.connector.Error as err:
+        return jsonify({'error': str(err)}), 503
+
+
+def heatmap_args():
+    rows = request.args.get('rows', 'tower')
+    cols = request.args.get('cols', 'hour')
+    filters = {d: request.args[d] for d in complaint_cube.DIMENSIONS if request.args.get(d)}
+    return rows, cols, filters
+
+
+@main.route('/complaint_heatmap')
+def complaint_heatmap():
+    if 'admin_username' not in session:
+        flash("Please log in as admin.")
+        return redirect(url_for('main.admin_login'))
+    if not complaint_cube.available():
+        flash("The complaint heatmap needs NumPy: pip install numpy")
+        return redirect(url_for('main.admin_dashboard'))
+    if not db:
+        flash("Database not connected.")
+        return redirect(url_for('main.admin_dashboard'))
+
+    rows, cols, filters = heatmap_args()
+    try:
+        heatmap = complaint_cube.cube.heatmap(db, rows, cols, filters)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('main.complaint_heatmap'))
+    except mysql.connector.Error as err:
+        flash(f"Database error: {err}")
+        return redirect(url_for('main.admin_dashboard'))
+
+    return render_template('complaint_heatmap.html', heatmap=heatmap,
+                           dimensions=complaint_cube.DIMENSIONS, labels=complaint_cube.cube.axis_labels())
+
+
+@main.route('/complaint_heatmap.json')
+def complaint_heatmap_json():
+    if 'admin_username' not in session:
+        return jsonify({'error': 'admin login required'}), 401
+    if not complaint_cube.available():
+        return jsonify({'error': 'NumPy is not installed'}), 503
+    if not db:
+        return jsonify({'error': 'Database not connected.'}), 503
+
+    try:
+        return jsonify(complaint_cube.cube.heatmap(db, *heatmap_args()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except mysql.connector.Error as err:
+        return jsonify({'error': str(err)}), 503
+
+
+@main.route('/admin_logout')
 def admin_logout():
     session.pop('admin_username', None)
     session.pop('admin_username', None)
     flash("Admin logged out.")
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
 #WORKER ----------------------------------------------------------------------------------------------------------------------------------
 
-@app.route('/worker_login', methods=['GET', 'POST'])
+@main.route('/worker_login', methods=['GET', 'POST'])
 def worker_login():
     if not db:
         flash("No database connection available.")
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     if request.method == 'POST':
         worker_phone_no = request.form.get('worker_phone_no').strip()
@@ -860,7 +1260,7 @@ def worker_login():
         try:
             cursor = db.cursor()
             cursor.execute("""
-                SELECT worker_phone_no 
+                SELECT worker_phone_no, worker_id 
                 FROM workers_details 
                 WHERE worker_phone_no = %s AND worker_password = %s
             """, (worker_phone_no, hashed_password))
@@ -869,8 +1269,9 @@ def worker_login():
 
             if result:
                 session['worker_phone_no'] = result[0]
+                session['worker_id'] = result[1]
                 flash(f"Welcome, Worker {worker_phone_no}!")
-                return redirect(url_for('worker_dashboard'))
+                return redirect(url_for('main.worker_dashboard'))
             else:
                 flash("Incorrect phone number or password.")
                 return render_template('worker_login.html')
@@ -882,50 +1283,50 @@ def worker_login():
     return render_template('worker_login.html')
 
 
-@app.route('/view_assigned_complaints')
+@main.route('/view_assigned_complaints')
 def view_assigned_complaints():
     if 'worker_phone_no' not in session:
         flash("Please log in as worker.")
-        return redirect(url_for('worker_login'))
+        return redirect(url_for('main.worker_login'))
 
     worker_phone_no = session['worker_phone_no']
+    key = ('view_assigned_complaints', worker_phone_no)
     complaints = []
 
     try:
-        cursor = db.cursor()
-        # Fetch complaints assigned to this worker
-        cursor.execute("""
-            SELECT complaint_id, user_phone_no, complaint_type, complaint_desc, 
-                   complaint_priority, complaint_scope, location 
-            FROM user_complaints_details 
-            WHERE worker_phone_no = %s
-        """, (worker_phone_no,))
-        complaints_data = cursor.fetchall()
+        with router.reader(db) as conn:
+            cursor = conn.cursor()
+            # Open jobs in the order job_route planned at the last assignment
+            # change, resolved ones after; addresses come in the same query
+            cursor.execute("""
+                SELECT c.complaint_id, c.user_phone_no, c.complaint_type, c.complaint_desc,
+                       c.complaint_priority, c.complaint_scope, c.location, c.status, c.route_position,
+                       a.user_house_no, a.user_tower_no, a.user_floor_no,
+                       a.user_locality, a.user_area, a.user_city, a.user_state, a.user_pincode
+                FROM user_complaints_details c
+                LEFT JOIN user_address_details a
+                       ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+                WHERE c.worker_id = %s
+                ORDER BY c.status = 'Resolved', c.route_position IS NULL, c.route_position, c.complaint_id
+            """, (current_worker_id(),))
+            complaints_data = cursor.fetchall()
+            cursor.close()
 
         for complaint in complaints_data:
-            complaint_id, user_phone_no, c_type, desc, priority, scope, location = complaint
+            complaint_id, user_phone_no, c_type, desc, priority, scope, location, status, stop = complaint[:9]
+            addr = complaint[9:]
             address = None
-
-            if scope == 'Personal':
-                # Fetch personal address if complaint is personal
-                cursor.execute("""
-                    SELECT user_house_no, user_tower_no, user_floor_no, 
-                           user_locality, user_area, user_city, user_state, user_pincode
-                    FROM user_address_details
-                    WHERE user_phone_no = %s
-                """, (user_phone_no,))
-                addr = cursor.fetchone()
-                if addr:
-                    address = {
-                        'house_no': addr[0],
-                        'tower': addr[1],
-                        'floor': addr[2],
-                        'locality': addr[3],
-                        'area': addr[4],
-                        'city': addr[5],
-                        'state': addr[6],
-                        'pincode': addr[7]
-                    }
+            if scope == 'Personal' and addr[0] is not None:
+                address = {
+                    'house_no': addr[0],
+                    'tower': addr[1],
+                    'floor': addr[2],
+                    'locality': addr[3],
+                    'area': addr[4],
+                    'city': addr[5],
+                    'state': addr[6],
+                    'pincode': addr[7]
+                }
 
             complaints.append({
                 'complaint_id': complaint_id,
@@ -935,23 +1336,23 @@ def view_assigned_complaints():
                 'priority': priority,
                 'scope': scope,
                 'location': location,
+                'status': status,
+                'stop': stop if status != 'Resolved' else None,
                 'address': address
             })
 
-        cursor.close()
-
     except mysql.connector.Error as err:
-        flash(f"Database error: {err}")
-        return redirect(url_for('worker_dashboard'))
+        return saved_page(key, 'view_assigned_complaints.html', f"Database error: {err}", 'main.worker_dashboard')
 
+    last_good.put(key, {'complaints': complaints})
     return render_template('view_assigned_complaints.html', complaints=complaints)
 
 
-@app.route('/update_assigned_complaint_status', methods=['GET', 'POST'])
+@main.route('/update_assigned_complaint_status', methods=['GET', 'POST'])
 def update_assigned_complaint_status():
     if 'worker_phone_no' not in session:
         flash("Please log in as worker.")
-        return redirect(url_for('worker_login'))
+        return redirect(url_for('main.worker_login'))
 
     worker_phone_no = session['worker_phone_no']
     complaints = []
@@ -961,10 +1362,11 @@ def update_assigned_complaint_status():
 
         # Fetch complaints assigned to this worker and not already resolved
         cursor.execute("""
-            SELECT complaint_id, complaint_type, complaint_scope, status 
+            SELECT complaint_id, complaint_type, complaint_scope, status, user_phone_no 
             FROM user_complaints_details 
-            WHERE worker_phone_no = %s AND status != 'Resolved'
-        """, (worker_phone_no,))
+            WHERE worker_id = %s AND status != 'Resolved'
+            ORDER BY route_position IS NULL, route_position, complaint_id
+        """, (current_worker_id(),))
         complaints = cursor.fetchall()
 
         if request.method == 'POST':
@@ -973,73 +1375,137 @@ def update_assigned_complaint_status():
 
             if not complaint_id or not complaint_id.isdigit() or not entered_code:
                 flash("Complaint ID or code is missing or invalid.")
-                return redirect(url_for('update_assigned_complaint_status'))
+                return redirect(url_for('main.update_assigned_complaint_status'))
 
-            # Fetch the actual verification code for this complaint
-            cursor.execute("""
-                SELECT verification_code FROM user_complaints_details 
-                WHERE complaint_id = %s AND worker_phone_no = %s
-            """, (int(complaint_id), worker_phone_no))
-            result = cursor.fetchone()
+            cursor.close()
 
-            if not result:
-                flash("Complaint not found or not assigned to you.")
-                return redirect(url_for('update_assigned_complaint_status'))
-
-            actual_code = result[0]
-
-            if entered_code == actual_code:
-                # Mark as resolved
-                cursor.execute("""
-                    UPDATE user_complaints_details 
-                    SET status = 'Resolved' 
-                    WHERE complaint_id = %s AND worker_phone_no = %s
-                """, (int(complaint_id), worker_phone_no))
-                db.commit()
+            # Code check and status change happen in one conditional UPDATE
+            resolved, reason = complaint_state.resolve_with_code(db, int(complaint_id), current_worker_id(), worker_phone_no, entered_code)
+            if resolved:
+                owners = {c[0]: c[4] for c in complaints}
+                notify_status(owners.get(int(complaint_id)), int(complaint_id), complaint_state.RESOLVED)
+                notifier.notify_user(owners.get(int(complaint_id)), f"Complaint ID {complaint_id} was marked Resolved by the worker.")
                 flash(f"Complaint ID {complaint_id} marked as Resolved.")
             else:
-                flash("Incorrect verification code.")
+                flash(reason)
 
-            return redirect(url_for('update_assigned_complaint_status'))
+            return redirect(url_for('main.update_assigned_complaint_status'))
 
         cursor.close()
 
     except mysql.connector.Error as err:
         flash(f"Database error: {err}")
-        return redirect(url_for('worker_dashboard'))
+        return redirect(url_for('main.worker_dashboard'))
 
     return render_template('update_assigned_complaint_status.html', complaints=complaints)
 
 
+SYNC_MESSAGES = {
+    'resolved': "marked as Resolved.",
+    'already_resolved': "was already Resolved.",
+    'wrong_code': "not resolved: incorrect verification code.",
+    'not_found': "not found or not assigned to you.",
+}
+
+
+@main.route('/sync_resolutions', methods=['POST'])
+def sync_resolutions():
+    # Resolutions queued by the worker pages while offline:
+    # {"items": [{"complaint_id": 12, "code": "123456", "resolved_at": <epoch ms>}, ...]}
+    if 'worker_phone_no' not in session:
+        return jsonify({'error': 'worker login required'}), 401
+    if not db:
+        return jsonify({'error': 'Database not connected.'}), 503
+
+    payload = request.get_json(silent=True) or {}
+    raw_items = payload.get('items')
+    if not isinstance(raw_items, list) or not raw_items or len(raw_items) > MAX_SYNC_ITEMS:
+        return jsonify({'error': f"Send between 1 and {MAX_SYNC_ITEMS} items."}), 400
+
+    items = []
+    for item in raw_items:
+        try:
+            complaint_id = int(item['complaint_id'])
+            code = str(item.get('code', '')).strip()
+            stamp = item.get('resolved_at')
+            resolved_at = datetime.fromtimestamp(float(stamp) / 1000) if stamp else None
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            return jsonify({'error': f"Malformed item: {item!r}"[:200]}), 400
+        items.append((complaint_id, code, resolved_at))
 
+    try:
+        results = complaint_state.resolve_batch(db, current_worker_id(), session['worker_phone_no'], items)
+    except mysql.connector.Error as err:
+        # Nothing was applied; the client keeps its queue and retries
+        return jsonify({'error': str(err)}), 503
 
-@app.route('/worker_dashboard')
+    for complaint_id, result, owner in results:
+        if result == 'resolved':
+            notify_status(owner, complaint_id, complaint_state.RESOLVED)
+            notifier.notify_user(owner, f"Complaint ID {complaint_id} was marked Resolved by the worker.")
+    return jsonify({'results': [{'complaint_id': complaint_id, 'result': result,
+                                 'message': f"Complaint ID {complaint_id} {SYNC_MESSAGES[result]}"}
+                                for complaint_id, result, _ in results]})
+
+
+
+
+@main.route('/worker_dashboard')
 def worker_dashboard():
     if 'worker_phone_no' not in session:
         flash("Please log in as worker.")
-        return redirect(url_for('worker_login'))
+        return redirect(url_for('main.worker_login'))
 
     worker_phone_no = session['worker_phone_no']
     return render_template('worker_dashboard.html', worker_phone_no=worker_phone_no)
 
-@app.route('/worker_logout')
+def event_stream(channel):
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    events = admission.open_stream(broker.listen(channel, last_event_id))
+    if events is None:
+        # This process has LIVE_STREAMS dashboards open. An error status
+        # would make the browser give up for good; an empty stream with a
+        # retry time has it try again later, maybe on another worker.
+        events = [f"retry: {admission.STREAM_RETRY_SECONDS * 1000}\n\n"]
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@main.route('/worker_events')
+def worker_events():
+    if 'worker_phone_no' not in session:
+        return Response(status=401)
+    return event_stream(worker_channel(session['worker_phone_no']))
+
+
+@main.route('/user_events')
+def user_events():
+    if 'user_phone_no' not in session:
+        return Response(status=401)
+    return event_stream(user_channel(session['user_phone_no']))
+
+
+@main.route('/worker_logout')
 def worker_logout():
     session.pop('worker_phone_no', None)
+    session.pop('worker_id', None)
     flash("Worker logged out.")
-    return redirect(url_for('worker_login'))
+    return redirect(url_for('main.worker_login'))
 
 
 
 
 
-@app.route('/forgot_password', methods=['GET', 'POST'])
+@main.route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':  
         email = request.form.get("email")
 
         if not email:
             flash("Email is required.")
-            return redirect(url_for('forgot_password'))
+            return redirect(url_for('main.forgot_password'))
 
         cursor = db.cursor()
         cursor.execute("SELECT user_phone_no FROM user_registeration_details WHERE user_email_id = %s", (email,))
@@ -1048,11 +1514,12 @@ def forgot_password():
 
         if not result:
             flash("No user found with this email.")
-            return redirect(url_for('forgot_password'))
+            return redirect(url_for('main.forgot_password'))
         
         user_phone_no = result[0]
         verification_code = str(random.randint(100000, 999999))
         session['reset_code'] = verification_code
+        session['reset_code_at'] = time.time()
         session['reset_phone'] = user_phone_no
 
         try:
@@ -1060,36 +1527,43 @@ def forgot_password():
             msg.body = f"Your verification code is: {verification_code}"
             mail.send(msg)
             flash("Verification code sent to your email.")
-            return redirect(url_for('verify_reset_code'))
+            return redirect(url_for('main.verify_reset_code'))
         except Exception as e:
             flash(f"Error sending email: {e}")
-            return redirect(url_for('forgot_password'))
+            return redirect(url_for('main.forgot_password'))
 
     return render_template('forgot_password.html')
 
-@app.route('/verify_reset_code', methods=['GET', 'POST'])
+@main.route('/verify_reset_code', methods=['GET', 'POST'])
 def verify_reset_code():
     if 'reset_code' not in session or 'reset_phone' not in session:
         flash("Session expired or invalid access.")
-        return redirect(url_for('forgot_password'))
+        return redirect(url_for('main.forgot_password'))
+
+    if time.time() - session.get('reset_code_at', 0) > RESET_CODE_TTL_MINUTES * 60:
+        session.pop('reset_code', None)
+        session.pop('reset_code_at', None)
+        session.pop('reset_phone', None)
+        flash("Verification code expired. Please request a new one.")
+        return redirect(url_for('main.forgot_password'))
 
     if request.method == 'POST':
         entered_code = request.form.get("verification_code")
 
         if entered_code == session['reset_code']:
             flash("Code verified. Please set a new password.")
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
         else:
             flash("Incorrect verification code.")
-            return redirect(url_for('verify_reset_code'))
+            return redirect(url_for('main.verify_reset_code'))
 
     return render_template('verify_reset_code.html')
 
-@app.route('/reset_password', methods=['GET', 'POST'])
+@main.route('/reset_password', methods=['GET', 'POST'])
 def reset_password():
     if 'reset_phone' not in session:
         flash("Unauthorized access. Please start the reset process again.")
-        return redirect(url_for('forgot_password'))
+        return redirect(url_for('main.forgot_password'))
 
     if request.method == 'POST':
         new_password = request.form.get("new_password")
@@ -1097,15 +1571,15 @@ def reset_password():
 
         if not new_password or not confirm_password:
             flash("Both password fields are required.")
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
 
         if new_password != confirm_password:
             flash("Passwords do not match.")
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
 
         if len(new_password) < 6:
             flash("Password must be at least 6 characters long.")
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
 
         hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
 
@@ -1121,17 +1595,20 @@ def reset_password():
             # Clear session values
             session.pop('reset_phone', None)
             session.pop('reset_code', None)
+            session.pop('reset_code_at', None)
 
             flash("Password reset successful. Please log in.")
-            return redirect(url_for('user_login'))
+            return redirect(url_for('main.user_login'))
 
         except Exception as e:
             flash(f"Error updating password: {e}")
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
 
     return render_template('reset_password.html')
 
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Development server with the debugger on; in production run
+    # gunicorn -c gunicorn.conf.py wsgi:app (see wsgi.py)
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import current_app, url_for
+
+import compression
+
+
+# Fingerprinted URLs change whenever the file does, so browsers can keep
+# them for a year without ever revalidating
+MAX_AGE = 365 * 24 * 3600
+
+_fingerprints = {}   # filename -> (mtime, digest)
+_compressed = {}     # (filename, encoding) -> (digest, compressed bytes)
+_compress_lock = threading.Lock()
+
+
+def fingerprint(filename):
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:10]
+    _fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+def compressed(filename, encoding):
+    # The file compressed with `encoding`, made once per version of the file
+    # at the highest level (it is sent many times), or None for types that
+    # don't compress and files too small to bother
+    mimetype = mimetypes.guess_type(filename)[0]
+    if encoding is None or mimetype not in compression.COMPRESSIBLE:
+        return None
+    digest = fingerprint(filename)
+    cached = _compressed.get((filename, encoding))
+    if cached and cached[0] == digest:
+        return cached[1]
+    with _compress_lock:
+        cached = _compressed.get((filename, encoding))
+        if cached and cached[0] == digest:
+            return cached[1]
+        with open(os.path.join(current_app.static_folder, filename), 'rb') as f:
+            data = f.read()
+        body = compression.compress(data, encoding, level=11) if len(data) >= compression.MIN_SIZE else None
+        _compressed[(filename, encoding)] = (digest, body)
+        return body
+
+
+def asset_url(filename):
+    # css/forms.css -> /assets/css/forms.3f2a9c1d0b.css
+    base, ext = os.path.splitext(filename)
+    return url_for('main.asset', filename=f"{base}.{fingerprint(filename)}{ext}")
+
+
+def split_fingerprint(filename):
+    # Returns (original filename, digest), or (filename, None) if there is no digest
+    base, ext = os.path.splitext(filename)
+    original, dot, digest = base.rpartition('.')
+    if not dot or len(digest) != 10:
+        return filename, None
+    return original + ext, digest
+
+
+def init_app(app):
+    app.jinja_env.globals['asset_url'] = asset_url
@@ -0,0 +1,261 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import mysql.connector
+
+import config
+
+
+# One breaker per database server. After FAILURE_THRESHOLD calls in a row
+# that failed or took longer than SLOW_CALL_MS, the breaker opens: database
+# calls raise CircuitOpen at once instead of piling request threads up on a
+# stalled server. After OPEN_SECONDS one request is let through as a probe
+# (half-open); its first call closes the breaker again or re-opens it.
+FAILURE_THRESHOLD = getattr(config, 'DB_FAILURE_THRESHOLD', 5)
+SLOW_CALL_MS = getattr(config, 'DB_SLOW_CALL_MS', 2000)
+OPEN_SECONDS = getattr(config, 'DB_OPEN_SECONDS', 15)
+
+LAST_GOOD_PAGES = getattr(config, 'LAST_GOOD_PAGES', 2000)   # saved pages per complex
+LAST_GOOD_ROWS = getattr(config, 'LAST_GOOD_ROWS', 500)      # longest list saved
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+# Server or connection trouble; a SQL error (ProgrammingError, a duplicate
+# key) means the server answered and says nothing about its health
+HEALTH_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+
+class CircuitOpen(mysql.connector.errors.OperationalError):
+    # An OperationalError, so every route's `except mysql.connector.Error`
+    # already handles it
+
+    def __init__(self, breaker):
+        super().__init__(msg="The database is temporarily unavailable. Please try again shortly.")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, slow_ms=SLOW_CALL_MS, open_seconds=OPEN_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.slow_ms = slow_ms
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.strikes = 0           # failed or slow calls in a row
+        self.opened_at = 0
+        self.probe_thread = None
+        self.probe_started = 0
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def _probe_due(self, now):
+        if self.state == OPEN:
+            return now - self.opened_at >= self.open_seconds
+        # A probe that never reached the database (its request made no call)
+        # is given up after the same wait
+        return self.state == HALF_OPEN and now - self.probe_started >= self.open_seconds
+
+    def blocked(self):
+        # True when a call from this thread would be refused; no side effects
+        if self.state == CLOSED:
+            return False
+        if self.state == HALF_OPEN and self.probe_thread == threading.get_ident():
+            return False
+        return not self._probe_due(time.monotonic())
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            me = threading.get_ident()
+            if self.state == CLOSED or (self.state == HALF_OPEN and self.probe_thread == me):
+                return True
+            now = time.monotonic()
+            if self._probe_due(now):
+                self.state = HALF_OPEN
+                self.probe_thread = me
+                self.probe_started = now
+                print(f"Database {self.name}: circuit half-open, probing.")
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(self)
+
+    def record(self, ok, elapsed_ms=0, error=None):
+        slow = elapsed_ms >= self.slow_ms
+        if ok and not slow and self.state == CLOSED and not self.strikes:
+            return
+        with self._lock:
+            if ok and not slow:
+                if self.state != CLOSED:
+                    print(f"Database {self.name}: circuit closed.")
+                self.state = CLOSED
+                self.strikes = 0
+                self.probe_thread = None
+                return
+            self.strikes += 1
+            self.last_error = str(error) if error is not None else f"slow call ({elapsed_ms:.0f} ms)"
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.strikes >= self.threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_thread = None
+                self.trips += 1
+                print(f"Database {self.name}: circuit open for {self.open_seconds}s ({self.last_error}).")
+
+    def call(self, func, *args, on_failure=None, **kwargs):
+        # Runs one database call, timing it; a health error also drops the
+        # caller's connection (on_failure) so the next call reconnects
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except HEALTH_ERRORS as err:
+            if not isinstance(err, CircuitOpen):
+                self.record(False, error=err)
+                if on_failure is not None:
+                    on_failure()
+            raise
+        self.record(True, (time.perf_counter() - started) * 1000)
+        return result
+
+    def retry_after(self):
+        if self.state == CLOSED:
+            return 0
+        since = self.opened_at if self.state == OPEN else self.probe_started
+        return max(1, int(self.open_seconds - (time.monotonic() - since) + 0.999))
+
+    def status(self):
+        return {'state': self.state, 'strikes': self.strikes, 'trips': self.trips,
+                'rejected': self.rejected, 'retry_after': self.retry_after(), 'last_error': self.last_error}
+
+
+class GuardedCursor:
+    # A cursor whose execute and fetch calls go through the breaker; every
+    # other attribute (rowcount, lastrowid, close, ...) is the cursor's own.
+    # transaction: the connection wrapper whose commit() ends its work.
+
+    def __init__(self, cursor, breaker, on_failure, transaction=None):
+        self._cursor = cursor
+        self._breaker = breaker
+        self._on_failure = on_failure
+        self.transaction = transaction
+
+    def execute(self, *args, **kwargs):
+        return self._breaker.call(self._cursor.execute, *args, on_failure=self._on_failure, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._breaker.call(self._cursor.executemany, *args, on_failure=self._on_failure, **kwargs)
+
+    def fetchone(self):
+        return self._breaker.call(self._cursor.fetchone, on_failure=self._on_failure)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._breaker.call(self._cursor.fetchmany, *args, on_failure=self._on_failure, **kwargs)
+
+    def fetchall(self):
+        return self._breaker.call(self._cursor.fetchall, on_failure=self._on_failure)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(name, **settings):
+    # settings (threshold, slow_ms, open_seconds) apply when it is created
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name, **settings))
+    return breaker
+
+
+def status():
+    return {name: breaker.status() for name, breaker in _breakers.items()}
+
+
+class LastGood:
+    # The data behind a page, as it was last served successfully, keyed by
+    # page and viewer. Shown (marked with its time) while the database is
+    # unavailable. Least recently saved pages are dropped past the limit.
+
+    def __init__(self, limit=LAST_GOOD_PAGES):
+        self.limit = limit
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, context):
+        with self._lock:
+            self._pages[key] = (datetime.now(), context)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.limit:
+                self._pages.popitem(last=False)
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def tee(self, key, rows, name='complaints', max_rows=LAST_GOOD_ROWS):
+        # Passes streamed rows through to the page and saves them once the
+        # whole list has been sent. Lists longer than max_rows, or cut
+        # short by a database error, aren't saved, and copying stops as
+        # soon as a list is known to be too long.
+        kept = []
+        for row in rows:
+            if kept is not None:
+                kept.append(row)
+                if len(kept) > max_rows:
+                    kept = None
+            yield row
+        if kept is not None and getattr(rows, 'error', None) is None:
+            self.put(key, {name: kept})
+
+
+if __name__ == "__main__":
+    # python circuit.py [calls] -- a stalled server seen from 8 request
+    # threads, with and without the breaker: how long each thread is stuck
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    stall = 0.5   # seconds each call hangs before the driver gives up
+
+    def stalled_call():
+        time.sleep(stall)
+        raise mysql.connector.errors.OperationalError(msg="Lost connection to MySQL server during query")
+
+    for label, breaker in (('no breaker', None), ('breaker', CircuitBreaker('bench', open_seconds=60))):
+        waited = []
+
+        def request():
+            started = time.perf_counter()
+            try:
+                if breaker is None:
+                    stalled_call()
+                else:
+                    breaker.check()
+                    breaker.call(stalled_call)
+            except mysql.connector.Error:
+                pass
+            waited.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(calls // 8 or 1):
+            threads = [threading.Thread(target=request) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        elapsed = time.perf_counter() - started
+        waited.sort()
+        print(f"{label:10} requests={len(waited):4}  wall={elapsed:6.2f}s  "
+              f"median wait={waited[len(waited) // 2] * 1000:7.1f} ms  max={waited[-1] * 1000:7.1f} ms")
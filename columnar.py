@@ -0,0 +1,476 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:     # writing needs only the standard library; reading needs NumPy
+    np = None
+
+
+# One table per file, column after column, for reports that scan a few
+# columns of every row. Layout:
+#
+#   MAGIC | column 1 | column 2 | ... | footer JSON | footer length (u64) | MAGIC
+#
+# Each column is a fixed-width little-endian array, one value per row,
+# starting on a 64-byte boundary so a reader can map it in place:
+#   int       narrowest of int8/16/32/64 that fits; NULL is the type's minimum
+#   datetime  int64 seconds since 1970-01-01 (naive, as stored); NULL as int
+#   str       codes into a sorted dictionary kept in the footer, uint8/16/32;
+#             code 0 is NULL, so codes compare like the strings they stand for
+# The footer also holds a zone map per column: the min and max value of every
+# BLOCK_ROWS rows (null for a block with no values), which lets a query skip
+# blocks that cannot match. Rows written in id order make the datetime zone
+# maps very selective for date ranges.
+
+MAGIC = b'CCOLv1\0\0'
+ALIGN = 64
+BLOCK_ROWS = 4096
+
+INT_TYPES = [('b', '<i1', 8), ('h', '<i2', 16), ('i', '<i4', 32), ('q', '<i8', 64)]
+CODE_TYPES = [('B', '<u1', 8), ('H', '<u2', 16), ('I', '<u4', 32)]
+NULL_64 = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+OPS = ('=', '!=', '<', '<=', '>', '>=', 'in')
+
+
+def available():
+    return np is not None
+
+
+def _little(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _ColumnWriter:
+
+    def __init__(self, name, kind, block_rows):
+        if kind not in ('int', 'datetime', 'str'):
+            raise ValueError(f"Unknown column kind {kind!r} for {name}")
+        self.name = name
+        self.kind = kind
+        self.block_rows = block_rows
+        self.values = array('q') if kind != 'str' else array('I')
+        self.words = {}           # str -> provisional code (1-based, insertion order)
+        self.nulls_in_block = []
+
+    def append(self, value):
+        if len(self.values) % self.block_rows == 0:
+            self.nulls_in_block.append(0)
+        if value is None:
+            self.values.append(NULL_64 if self.kind != 'str' else 0)
+            self.nulls_in_block[-1] += 1
+        elif self.kind == 'str':
+            code = self.words.get(value)
+            if code is None:
+                code = self.words[value] = len(self.words) + 1
+            self.values.append(code)
+        elif self.kind == 'datetime':
+            self.values.append((value - EPOCH) // timedelta(seconds=1))
+        else:
+            self.values.append(int(value))
+
+    def finish(self):
+        # -> (footer entry without offset, column bytes)
+        null = NULL_64
+        if self.kind == 'str':
+            dictionary = sorted(self.words)
+            remap = [0] * (len(dictionary) + 1)
+            for final, word in enumerate(dictionary, 1):
+                remap[self.words[word]] = final
+            typecode, dtype = next((t, d) for t, d, bits in CODE_TYPES if len(dictionary) < 2 ** bits)
+            values = array(typecode, map(remap.__getitem__, self.values))
+            null = 0
+        else:
+            values = self.values
+
+        zone_min, zone_max = [], []
+        for block, nulls in enumerate(self.nulls_in_block):
+            part = values[block * self.block_rows:(block + 1) * self.block_rows]
+            if nulls == len(part):
+                zone_min.append(None)
+                zone_max.append(None)
+            elif nulls:
+                present = [v for v in part if v != null]
+                zone_min.append(min(present))
+                zone_max.append(max(present))
+            else:
+                zone_min.append(min(part))
+                zone_max.append(max(part))
+
+        entry = {'name': self.name, 'kind': self.kind, 'zone_min': zone_min, 'zone_max': zone_max}
+        if self.kind == 'str':
+            entry.update(dtype=dtype, null=0, dictionary=dictionary)
+        elif self.kind == 'datetime':
+            entry.update(dtype='<i8', null=NULL_64)
+        else:
+            low = min((v for v in zone_min if v is not None), default=0)
+            high = max((v for v in zone_max if v is not None), default=0)
+            # The type's minimum is reserved for NULL
+            typecode, dtype, bits = next(t for t in INT_TYPES if -2 ** (t[2] - 1) < low and high < 2 ** (t[2] - 1))
+            narrow_null = -2 ** (bits - 1)
+            if bits < 64:
+                if any(self.nulls_in_block):
+                    values = array(typecode, (narrow_null if v == NULL_64 else v for v in values))
+                else:
+                    values = array(typecode, values)
+            entry.update(dtype=dtype, null=narrow_null)
+        return entry, _little(values)
+
+
+def write_table(path, columns, rows, block_rows=BLOCK_ROWS, name=None):
+    # columns: [(name, kind)], rows: iterable of tuples in that order.
+    # Written to path.tmp and renamed, so readers see the old file or the
+    # whole new one. Returns the row count.
+    writers = [_ColumnWriter(col, kind, block_rows) for col, kind in columns]
+    count = 0
+    for row in rows:
+        for writer, value in zip(writers, row):
+            writer.append(value)
+        count += 1
+
+    footer = {'format': 1, 'table': name or os.path.splitext(os.path.basename(path))[0],
+              'rows': count, 'block_rows': block_rows,
+              'created_at': datetime.now().isoformat(timespec='seconds'), 'columns': []}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        for writer in writers:
+            entry, data = writer.finish()
+            f.write(b'\0' * (-f.tell() % ALIGN))
+            entry['offset'] = f.tell()
+            f.write(data)
+            footer['columns'].append(entry)
+            writer.values = None
+        meta = json.dumps(footer, separators=(',', ':')).encode()
+        f.write(meta)
+        f.write(struct.pack('<Q', len(meta)) + MAGIC)
+    os.replace(path + '.tmp', path)
+    return count
+
+
+class Table:
+    # A written table, memory-mapped read-only. column() is a NumPy view of
+    # the file itself (no copy); query() prunes blocks with the zone maps,
+    # then filters and aggregates the rest with vectorized scans.
+
+    def __init__(self, path):
+        if np is None:
+            raise RuntimeError("Reading columnar snapshots needs NumPy: pip install numpy")
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        if size < 2 * len(MAGIC) + 8 or self._map[:8] != MAGIC or self._map[-8:] != MAGIC:
+            raise ValueError(f"{path} is not a columnar snapshot")
+        meta_len = struct.unpack('<Q', self._map[-16:-8])[0]
+        footer = json.loads(self._map[size - 16 - meta_len:size - 16])
+        self.path = path
+        self.name = footer['table']
+        self.rows = footer['rows']
+        self.block_rows = footer['block_rows']
+        self.created_at = footer['created_at']
+        self.meta = {col['name']: col for col in footer['columns']}
+        self._views = {}
+        self._zones = {}
+        self.last_scan = None       # (blocks scanned, blocks) of the last select()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._views = {}
+        try:
+            self._map.close()
+        except BufferError:
+            pass    # a caller still holds a column view; the map closes with it
+
+    @property
+    def columns(self):
+        return list(self.meta)
+
+    def column(self, name):
+        view = self._views.get(name)
+        if view is None:
+            col = self._meta(name)
+            view = np.frombuffer(self._map, dtype=np.dtype(col['dtype']), count=self.rows, offset=col['offset'])
+            self._views[name] = view
+        return view
+
+    def _meta(self, name):
+        try:
+            return self.meta[name]
+        except KeyError:
+            raise ValueError(f"No column {name!r} in {self.name}; columns: {', '.join(self.meta)}") from None
+
+    def zones(self, name):
+        # (min, max) int64 arrays per block; a block without values gets an
+        # empty range (max < min), which no predicate matches
+        zones = self._zones.get(name)
+        if zones is None:
+            col = self._meta(name)
+            zmin = np.array([v if v is not None else 2 ** 63 - 1 for v in col['zone_min']], dtype=np.int64)
+            zmax = np.array([v if v is not None else -2 ** 63 for v in col['zone_max']], dtype=np.int64)
+            zones = self._zones[name] = (zmin, zmax)
+        return zones
+
+    def _stored(self, col, value):
+        if col['kind'] == 'datetime':
+            return (value - EPOCH) // timedelta(seconds=1)
+        return int(value)
+
+    @staticmethod
+    def _code(words, value):
+        at = bisect_left(words, value)
+        return at + 1 if at < len(words) and words[at] == value else 0
+
+    def _predicate(self, name, op, value):
+        # One filter in the stored domain: ('range', lo, hi) inclusive,
+        # ('in', codes) or ('!=', v). NULL never matches, as in SQL.
+        col = self._meta(name)
+        if op not in OPS:
+            raise ValueError(f"Unknown operator {op!r}; use one of {', '.join(OPS)}")
+        null = col['null']
+        low_bound = null + 1
+        high_bound = np.iinfo(np.dtype(col['dtype'])).max
+        if col['kind'] == 'str':
+            words = col['dictionary']
+            if op == 'in':
+                codes = [self._code(words, v) for v in value]
+                return ('in', np.array([c for c in codes if c], dtype=np.int64))
+            at = bisect_left(words, value)
+            found = self._code(words, value) != 0
+            if op == '=':
+                return ('range', at + 1, at + 1) if found else ('in', np.array([], dtype=np.int64))
+            if op == '!=':
+                return ('!=', at + 1 if found else null)
+            after = bisect_right(words, value) + 1     # first code above value
+            return {'<': ('range', low_bound, at), '<=': ('range', low_bound, after - 1),
+                    '>': ('range', after, high_bound), '>=': ('range', at + 1, high_bound)}[op]
+        if op == 'in':
+            return ('in', np.array([self._stored(col, v) for v in value], dtype=np.int64))
+        v = self._stored(col, value)
+        if op == '!=':
+            return ('!=', v)
+        return {'=': ('range', v, v), '<': ('range', low_bound, v - 1), '<=': ('range', low_bound, v),
+                '>': ('range', v + 1, high_bound), '>=': ('range', v, high_bound)}[op]
+
+    def _block_hits(self, name, pred):
+        zmin, zmax = self.zones(name)
+        if pred[0] == 'range':
+            return (zmax >= pred[1]) & (zmin <= pred[2])
+        if pred[0] == 'in':
+            if not len(pred[1]):
+                return np.zeros(len(zmin), dtype=bool)
+            return ((zmin[None, :] <= pred[1][:, None]) & (zmax[None, :] >= pred[1][:, None])).any(axis=0)
+        return (zmax >= zmin) & ~((zmin == pred[1]) & (zmax == pred[1]))
+
+    def _matches(self, values, col, pred):
+        if pred[0] == 'range':
+            lo, hi = max(pred[1], col['null'] + 1), pred[2]
+            if lo == hi:
+                return values == lo
+            return (values >= lo) & (values <= hi)
+        if pred[0] == 'in':
+            return np.isin(values, pred[1])
+        return (values != pred[1]) & (values != col['null'])
+
+    def select(self, where=()):
+        # Row numbers matching every (column, op, value) in where, ascending
+        preds = [(name, self._predicate(name, op, value)) for name, op, value in where]
+        blocks = -(-self.rows // self.block_rows)
+        hits = np.ones(blocks, dtype=bool)
+        for name, pred in preds:
+            hits &= self._block_hits(name, pred)
+        self.last_scan = (int(hits.sum()), blocks)
+        if not preds:
+            return np.arange(self.rows)
+
+        # Runs of consecutive candidate blocks become one slice each
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], hits.view(np.int8), [0]))))
+        found = []
+        for first, last in zip(edges[::2], edges[1::2]):
+            start, stop = first * self.block_rows, min(last * self.block_rows, self.rows)
+            mask = None
+            for name, pred in preds:
+                part = self._matches(self.column(name)[start:stop], self.meta[name], pred)
+                mask = part if mask is None else mask & part
+            found.append(np.flatnonzero(mask) + start)
+        return np.concatenate(found) if found else np.array([], dtype=np.int64)
+
+    def _key(self, spec, rows):
+        # A group-by column, or "column:day" / "column:month" for datetimes
+        name, _, unit = spec.partition(':')
+        col = self._meta(name)
+        values = self.column(name)[rows]
+        if unit:
+            if col['kind'] != 'datetime' or unit not in ('day', 'month'):
+                raise ValueError(f"Can't group {name} by {unit}")
+            stamps = values.astype('datetime64[s]').astype('datetime64[D]' if unit == 'day' else 'datetime64[M]')
+            nulls = values == col['null']
+            values = np.where(nulls, np.iinfo(np.int64).min, stamps.astype(np.int64))
+        return values
+
+    def _decode(self, spec, value):
+        name, _, unit = spec.partition(':')
+        col = self.meta[name]
+        if col['kind'] == 'str':
+            return col['dictionary'][value - 1] if value else None
+        if value == col['null'] or (unit and value == np.iinfo(np.int64).min):
+            return None
+        if unit == 'day':
+            return (EPOCH + timedelta(days=int(value))).date()
+        if unit == 'month':
+            return f"{1970 + int(value) // 12}-{int(value) % 12 + 1:02d}"
+        if col['kind'] == 'datetime':
+            return EPOCH + timedelta(seconds=int(value))
+        return int(value)
+
+    def query(self, where=(), group_by=(), aggregates=None):
+        # where: [(column, op, value)]; group_by: [column or "column:day"];
+        # aggregates: {label: ('count',) or (fn, column)} with fn one of
+        # count, sum, mean, min, max (NULLs ignored). Returns a list of dicts.
+        aggregates = aggregates or {'count': ('count',)}
+        rows = self.select(where)
+        if group_by:
+            keys = [self._key(spec, rows) for spec in group_by]
+            uniques, inverses = zip(*(np.unique(k, return_inverse=True) for k in keys))
+            combined = np.ravel_multi_index(inverses, [len(u) for u in uniques]) if len(keys) > 1 else inverses[0]
+            groups, group_of = np.unique(combined, return_inverse=True)
+            parts = np.unravel_index(groups, [len(u) for u in uniques]) if len(keys) > 1 else (groups,)
+            labels = [u[p] for u, p in zip(uniques, parts)]
+        else:
+            group_of = np.zeros(len(rows), dtype=np.int64)
+            labels = []
+        size = len(labels[0]) if labels else 1
+
+        results = {}
+        for label, (fn, *target) in aggregates.items():
+            if fn == 'count' and not target:
+                results[label] = np.bincount(group_of, minlength=size)
+                continue
+            name = target[0]
+            col = self._meta(name)
+            if col['kind'] == 'str' and fn not in ('count', 'min', 'max'):
+                raise ValueError(f"Can't take the {fn} of text column {name}")
+            values = self.column(name)[rows]
+            present = values != col['null']
+            groups = group_of[present]
+            values = values[present]
+            count = np.bincount(groups, minlength=size)
+            if fn == 'count':
+                results[label] = count
+            elif fn in ('sum', 'mean'):
+                total = np.bincount(groups, weights=values.astype(np.float64), minlength=size)
+                if fn == 'sum':
+                    results[label] = total.round().astype(np.int64)
+                else:
+                    results[label] = np.divide(total, count, out=np.full(size, np.nan), where=count > 0)
+            elif fn in ('min', 'max'):
+                fill = np.iinfo(np.int64).max if fn == 'min' else np.iinfo(np.int64).min
+                out = np.full(size, fill, dtype=np.int64)
+                (np.minimum if fn == 'min' else np.maximum).at(out, groups, values)
+                results[label] = [self._decode(name, v) if n else None for v, n in zip(out.tolist(), count.tolist())]
+            else:
+                raise ValueError(f"Unknown aggregate {fn!r}")
+
+        report = []
+        for i in range(size):
+            entry = {spec: self._decode(spec, labels[k][i]) for k, spec in enumerate(group_by)}
+            for label, values in results.items():
+                value = values[i]
+                if isinstance(value, np.generic):
+                    value = value.item()
+                if isinstance(value, float) and value != value:
+                    value = None
+                entry[label] = value
+            report.append(entry)
+        return report
+
+
+def _synthetic_rows(count):
+    import random
+    rng = random.Random(3)
+    types = ['Plumbing', 'Electrical', 'Lift', 'Cleaning', 'Security', 'Parking', 'Garden', 'Other']
+    statuses = ['Pending', 'In Progress', 'Resolved']
+    start = datetime(2024, 1, 1)
+    step = (datetime(2026, 1, 1) - start) / count
+    for i in range(count):
+        created = start + step * i
+        status = rng.choices(statuses, (1, 1, 8))[0]
+        yield (i + 1, rng.choice(types), status, created,
+               created + timedelta(hours=rng.randrange(1, 96)) if status == 'Resolved' else None,
+               f"Tower {chr(65 + rng.randrange(8))}", rng.randrange(20),
+               rng.randrange(1, 6) if status == 'Resolved' and rng.random() < 0.4 else None)
+
+
+if __name__ == "__main__":
+    # python columnar.py [rows] -- writes synthetic complaints, then runs a
+    # date-range report three ways: zone maps + vectorized scan, full
+    # vectorized scan, and a plain Python loop over the rows
+    import tempfile
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    if np is None:
+        print("Needs NumPy: pip install numpy")
+        sys.exit(1)
+    columns = [('complaint_id', 'int'), ('complaint_type', 'str'), ('status', 'str'),
+               ('complaint_datetime', 'datetime'), ('resolved_at', 'datetime'),
+               ('tower', 'str'), ('floor', 'int'), ('feedback_rating', 'int')]
+    path = os.path.join(tempfile.mkdtemp(), 'complaints.col')
+    started = time.perf_counter()
+    write_table(path, columns, _synthetic_rows(count))
+    print(f"wrote {count} rows in {time.perf_counter() - started:.1f}s, {os.path.getsize(path) / 1024 / 1024:.1f} MiB "
+          f"({os.path.getsize(path) / count:.1f} bytes/row)")
+
+    where = [('complaint_datetime', '>=', datetime(2025, 12, 1)), ('status', '=', 'Resolved')]
+    aggregates = {'complaints': ('count',), 'avg_rating': ('mean', 'feedback_rating')}
+
+    def timed(label, run, repeat=5):
+        best = min(_time(run) for _ in range(repeat))
+        print(f"{label:28} {best * 1000:8.2f} ms")
+
+    def _time(run):
+        started = time.perf_counter()
+        run()
+        return time.perf_counter() - started
+
+    with Table(path) as table:
+        report = table.query(where, ['tower'], aggregates)
+        print(f"zone maps kept {table.last_scan[0]} of {table.last_scan[1]} blocks")
+        timed('zone maps + vectorized', lambda: table.query(where, ['tower'], aggregates))
+        full = Table(path)
+        full.block_rows = count    # one block: no pruning
+        full.meta = {name: dict(col, zone_min=[min((v for v in col['zone_min'] if v is not None), default=None)],
+                                zone_max=[max((v for v in col['zone_max'] if v is not None), default=None)])
+                     for name, col in table.meta.items()}
+        timed('full vectorized scan', lambda: full.query(where, ['tower'], aggregates))
+        assert full.query(where, ['tower'], aggregates) == report
+
+    rows = list(_synthetic_rows(count))
+
+    def python_loop():
+        since = datetime(2025, 12, 1)
+        totals = {}
+        for row in rows:
+            if row[3] >= since and row[2] == 'Resolved':
+                entry = totals.setdefault(row[5], [0, 0, 0])
+                entry[0] += 1
+                if row[7] is not None:
+                    entry[1] += row[7]
+                    entry[2] += 1
+        return totals
+
+    timed('python rows in memory', python_loop, repeat=2)
+    for entry in report:
+        print(f"  {entry['tower']:8} complaints={entry['complaints']:6}  avg_rating={entry['avg_rating'] or 0:.2f}")
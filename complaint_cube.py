@@ -0,0 +1,361 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:     # the heatmap page asks for it; nothing else needs it
+    np = None
+
+import config
+import event_log
+import tenancy
+from complaint_state import STATUSES
+
+
+CUBE_DIR = getattr(config, 'CUBE_DIR', 'cube')
+REFRESH_SECONDS = 2          # how stale a heatmap may be before it reads new events
+REBUILD_SECONDS = 24 * 3600  # full rebuild, which also picks up changes made without an event
+MAX_CACHED_RESULTS = 256
+
+# Axes of the stored array are tower x floor x type x hour-of-week x status;
+# queries see hour-of-week as two axes, weekday x hour
+DIMENSIONS = ['tower', 'floor', 'type', 'weekday', 'hour', 'status']
+CATEGORY_AXES = ['tower', 'floor', 'type']     # grow when a new label shows up
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+HOURS = [f"{h:02d}:00" for h in range(24)]
+
+# Events after which a complaint's cell may have changed
+MOVING_EVENTS = {event_log.CREATED, event_log.ASSIGNED, event_log.STATUS_CHANGED,
+                 event_log.DELETED, event_log.MERGED, event_log.UNASSIGNED, event_log.ARCHIVED}
+
+# Merged duplicates are counted once, through their parent
+CUBE_ROWS = """
+    SELECT c.complaint_id, COALESCE(a.user_tower_no, 'Community'), a.user_floor_no,
+           c.complaint_type, c.complaint_datetime, c.status
+    FROM user_complaints_details c
+    LEFT JOIN user_address_details a
+           ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+    WHERE c.parent_complaint_id IS NULL
+"""
+
+
+def available():
+    return np is not None
+
+
+def _natural(label):
+    return (0, int(label), '') if label.lstrip('-').isdigit() else (1, 0, label)
+
+
+class ComplaintCube:
+    # Complaint counts in a dense int32 array, one cell per
+    # (tower, floor, type, hour of week, status). Built once from the
+    # database (or a memory-mapped snapshot), then kept current by reading
+    # complaint_events past last_event_id and re-reading only the complaints
+    # they touch, so a heatmap is a NumPy slice and sum, never a GROUP BY.
+
+    def __init__(self, refresh=REFRESH_SECONDS):
+        self.refresh = refresh
+        self.cells = None
+        self.labels = {axis: [] for axis in CATEGORY_AXES}
+        self.coords = {}            # complaint_id -> cell index
+        self.last_event_id = 0
+        self.built_at = None
+        self._positions = {axis: {} for axis in CATEGORY_AXES}
+        self._checked_at = None
+        self._version = 0           # bumped on every change; keys the result cache
+        self._results = {}
+        self._lock = threading.Lock()           # guards the arrays and labels
+        self._refresh_lock = threading.Lock()   # one build / catch-up at a time
+
+    def _changed(self):
+        # Caller holds _lock
+        self._version += 1
+        self._results = {}
+
+    def _position(self, axis, label):
+        positions = self._positions[axis]
+        if label not in positions:
+            positions[label] = len(self.labels[axis])
+            self.labels[axis].append(label)
+            number = CATEGORY_AXES.index(axis)
+            if self.cells is not None and self.cells.shape[number] < len(positions):
+                padding = [(0, 0)] * self.cells.ndim
+                padding[number] = (0, len(positions) - self.cells.shape[number])
+                self.cells = np.pad(self.cells, padding)
+        return positions[label]
+
+    def _cell(self, tower, floor, c_type, created, status):
+        if status not in STATUSES or created is None:
+            return None
+        return (self._position('tower', tower or 'Community'),
+                self._position('floor', '-' if floor is None else str(floor)),
+                self._position('type', c_type or 'Other'),
+                created.weekday() * 24 + created.hour,
+                STATUSES.index(status))
+
+    def _fill(self, rows, last_event_id):
+        # rows: (complaint_id, tower, floor, type, complaint_datetime, status)
+        with self._lock:
+            self.labels = {axis: [] for axis in CATEGORY_AXES}
+            self._positions = {axis: {} for axis in CATEGORY_AXES}
+            self.cells = None
+            coords = {}
+            for complaint_id, *values in rows:
+                cell = self._cell(*values)
+                if cell is not None:
+                    coords[complaint_id] = cell
+            shape = tuple(max(len(self.labels[axis]), 1) for axis in CATEGORY_AXES) + (168, len(STATUSES))
+            cells = np.zeros(shape, dtype=np.int32)
+            if coords:
+                np.add.at(cells, tuple(np.array(list(coords.values()), dtype=np.intp).T), 1)
+            self.cells = cells
+            self.coords = coords
+            self.last_event_id = last_event_id
+            self.built_at = time.time()
+            self._changed()
+
+    def build(self, db):
+        started = time.perf_counter()
+        event_log.events.flush()
+        cursor = db.cursor()
+        # Read the watermark first: an event written during the scan is
+        # replayed by the next catch_up, which is harmless
+        cursor.execute("SELECT COALESCE(MAX(event_id), 0) FROM complaint_events")
+        last_event_id = cursor.fetchone()[0]
+        cursor.execute(CUBE_ROWS)
+        rows = cursor.fetchall()
+        cursor.close()
+        self._fill(rows, last_event_id)
+        self._checked_at = time.time()
+        print(f"Complaint cube built from {len(self.coords)} complaints, shape {self.cells.shape}, "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    def catch_up(self, db):
+        event_log.events.flush()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT event_id, complaint_id, event_type FROM complaint_events
+            WHERE event_id > %s ORDER BY event_id
+        """, (self.last_event_id,))
+        events = cursor.fetchall()
+        if not events:
+            cursor.close()
+            return 0
+
+        touched = sorted({complaint_id for _, complaint_id, event_type in events if event_type in MOVING_EVENTS})
+        current = {}
+        for start in range(0, len(touched), 500):
+            batch = touched[start:start + 500]
+            cursor.execute(CUBE_ROWS + f" AND c.complaint_id IN ({', '.join(['%s'] * len(batch))})", tuple(batch))
+            current.update((row[0], row[1:]) for row in cursor.fetchall())
+        cursor.close()
+
+        with self._lock:
+            for complaint_id in touched:
+                old = self.coords.pop(complaint_id, None)
+                if old is not None:
+                    self.cells[old] -= 1
+                # Deleted, merged and archived complaints are gone from CUBE_ROWS
+                if complaint_id in current:
+                    cell = self._cell(*current[complaint_id])
+                    if cell is not None:
+                        self.cells[cell] += 1
+                        self.coords[complaint_id] = cell
+            self.last_event_id = events[-1][0]
+            if touched:
+                self._changed()
+        return len(touched)
+
+    def _ensure(self, db):
+        if self._checked_at is not None and time.time() - self._checked_at < self.refresh:
+            return
+        with self._refresh_lock:
+            now = time.time()
+            if self.cells is None:
+                if not self.load():
+                    self.build(db)
+                    return
+            elif now - self.built_at > REBUILD_SECONDS:
+                self.build(db)
+                return
+            if self._checked_at is None or now - self._checked_at >= self.refresh:
+                self.catch_up(db)
+                self._checked_at = now
+
+    def axis_labels(self):
+        labels = {axis: sorted(self.labels[axis], key=_natural) for axis in CATEGORY_AXES}
+        labels.update(weekday=WEEKDAYS, hour=HOURS, status=STATUSES)
+        return labels
+
+    def _index_of(self, dimension, label):
+        if dimension in CATEGORY_AXES:
+            return self._positions[dimension].get(label)
+        fixed = {'weekday': WEEKDAYS, 'hour': HOURS, 'status': STATUSES}[dimension]
+        return fixed.index(label) if label in fixed else None
+
+    def heatmap(self, db, rows='tower', cols='hour', filters=None):
+        # Counts summed over every dimension except rows and cols, limited
+        # to the cells matching filters ({dimension: label}). A result is
+        # reused until the next change to the cube.
+        if rows not in DIMENSIONS or cols not in DIMENSIONS or rows == cols:
+            raise ValueError("Pick two different dimensions for rows and columns.")
+        self._ensure(db)
+        started = time.perf_counter()
+        filters = {d: label for d, label in (filters or {}).items() if d in DIMENSIONS and label}
+        key = (rows, cols, tuple(sorted(filters.items())))
+
+        with self._lock:
+            version = self._version
+            result = self._results.get(key)
+            if result is None:
+                cells = self.cells
+                index = []
+                for dimension in DIMENSIONS:
+                    if dimension not in filters:
+                        index.append(slice(None))
+                        continue
+                    position = self._index_of(dimension, filters[dimension])
+                    # An unknown label matches nothing
+                    index.append(slice(0, 0) if position is None else slice(position, position + 1))
+                row_order = self._order(rows)
+                col_order = self._order(cols)
+                labels = self.axis_labels()
+
+        if result is None:
+            view = cells.reshape(cells.shape[:3] + (7, 24) + cells.shape[4:])[tuple(index)]
+            # einsum sums every other axis in one pass, straight into rows x cols
+            letters = 'abcdef'
+            grid = np.einsum(f"{letters}->{letters[DIMENSIONS.index(rows)]}{letters[DIMENSIONS.index(cols)]}", view)
+            grid = grid[np.ix_(row_order, col_order)] if row_order and col_order else grid[:0, :0]
+            result = {
+                'rows': rows, 'cols': cols, 'filters': filters,
+                'row_labels': labels[rows], 'col_labels': labels[cols],
+                'cells': grid.tolist(),
+                'total': int(grid.sum()), 'max': int(grid.max()) if grid.size else 0,
+                'last_event_id': self.last_event_id,
+            }
+            with self._lock:
+                if self._version == version:
+                    if len(self._results) >= MAX_CACHED_RESULTS:
+                        self._results.clear()
+                    self._results[key] = result
+        return dict(result, query_us=round((time.perf_counter() - started) * 1e6, 1))
+
+    def _order(self, dimension):
+        # Array positions of a dimension's labels in display order
+        if dimension in CATEGORY_AXES:
+            return [self._positions[dimension][label]
+                    for label in sorted(self.labels[dimension], key=_natural)]
+        return list(range({'weekday': 7, 'hour': 24, 'status': len(STATUSES)}[dimension]))
+
+    def _snapshot_dir(self):
+        return os.path.join(CUBE_DIR, str(tenancy.current_complex_id()))
+
+    def save(self, db):
+        # meta.json is replaced last and names the array files, so a reader
+        # never sees a half-written snapshot
+        self._ensure(db)
+        directory = self._snapshot_dir()
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        with self._lock:
+            coords = np.array([(cid,) + cell for cid, cell in self.coords.items()], dtype=np.int64).reshape(-1, 6)
+            np.save(os.path.join(directory, f"cells-{stamp}.npy"), np.asarray(self.cells))
+            np.save(os.path.join(directory, f"coords-{stamp}.npy"), coords)
+            meta = {'stamp': stamp, 'labels': self.labels, 'statuses': STATUSES,
+                    'last_event_id': self.last_event_id, 'built_at': self.built_at}
+        with open(os.path.join(directory, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+        for name in os.listdir(directory):
+            if name.endswith('.npy') and stamp not in name:
+                os.remove(os.path.join(directory, name))
+        print(f"Complaint cube snapshot saved to {directory} (event {meta['last_event_id']}).")
+
+    def load(self):
+        # The cell array is memory-mapped copy-on-write: a restart maps the
+        # file instead of reading it, and later increments stay in memory
+        directory = self._snapshot_dir()
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta['statuses'] != STATUSES:
+                return False
+            cells = np.load(os.path.join(directory, f"cells-{meta['stamp']}.npy"), mmap_mode='c')
+            coords = np.load(os.path.join(directory, f"coords-{meta['stamp']}.npy"))
+        except (OSError, ValueError, KeyError) as err:
+            if not isinstance(err, FileNotFoundError):
+                print(f"Complaint cube snapshot in {directory} not usable:", err)
+            return False
+
+        with self._lock:
+            self.labels = meta['labels']
+            self._positions = {axis: {label: i for i, label in enumerate(self.labels[axis])}
+                               for axis in CATEGORY_AXES}
+            self.cells = cells
+            self.coords = dict(zip(coords[:, 0].tolist(), map(tuple, coords[:, 1:].tolist())))
+            self.last_event_id = meta['last_event_id']
+            self.built_at = meta['built_at']
+            self._checked_at = None
+            self._changed()
+        print(f"Complaint cube loaded from {directory} ({len(self.coords)} complaints, event {self.last_event_id}).")
+        return True
+
+
+cube = tenancy.PerComplex(ComplaintCube)
+
+
+def _synthetic_rows(count, towers=8, floors=20):
+    types = ['Plumbing', 'Electrical', 'Lift', 'Cleaning', 'Security', 'Parking', 'Garden', 'Other']
+    start = datetime(2026, 1, 1)
+    rng = random.Random(42)
+    for i in range(count):
+        community = rng.random() < 0.1
+        yield (i + 1, None if community else f"Tower {chr(65 + rng.randrange(towers))}",
+               None if community else rng.randrange(floors), rng.choice(types),
+               start + timedelta(minutes=rng.randrange(365 * 24 * 60)), rng.choice(STATUSES))
+
+
+if __name__ == "__main__":
+    # python complaint_cube.py [complaints] -- builds a cube from synthetic
+    # rows and times heatmap queries, a snapshot save and a mapped reload
+    if np is None:
+        print("NumPy is not installed: pip install numpy")
+        sys.exit(1)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    CUBE_DIR = os.path.join('/tmp', 'complaint_cube_bench')
+
+    bench = ComplaintCube(refresh=float('inf'))
+    started = time.perf_counter()
+    bench._fill(_synthetic_rows(count), 0)
+    bench._checked_at = time.time()
+    print(f"built from {count} complaints in {(time.perf_counter() - started) * 1000:.1f} ms, "
+          f"shape {bench.cells.shape}, {bench.cells.nbytes / 1024 / 1024:.1f} MiB")
+
+    queries = [('tower', 'hour', {}), ('tower', 'floor', {'type': 'Plumbing'}),
+               ('weekday', 'hour', {'tower': 'Tower A', 'status': 'Pending'}), ('type', 'status', {})]
+    for rows, cols, filters in queries:
+        timings = []
+        for _ in range(50):
+            bench._results = {}
+            timings.append(bench.heatmap(None, rows, cols, filters)['query_us'])
+        cached = sorted(bench.heatmap(None, rows, cols, filters)['query_us'] for _ in range(200))
+        print(f"{rows:>8} x {cols:<7} {str(filters):45} computed {sorted(timings)[25]:8.1f} us"
+              f"  cached {cached[100]:6.1f} us")
+
+    with tenancy.use(next(iter(tenancy.COMPLEXES))):
+        started = time.perf_counter()
+        bench.save(None)
+        saved = (time.perf_counter() - started) * 1000
+        reloaded = ComplaintCube()
+        started = time.perf_counter()
+        reloaded.load()
+        loaded = (time.perf_counter() - started) * 1000
+    same = bool((reloaded.cells == bench.cells).all())
+    print(f"snapshot save {saved:.1f} ms, mapped reload {loaded:.1f} ms, counts match: {same}")
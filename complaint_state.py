@@ -0,0 +1,332 @@
+import sys
+import threading
+from datetime import datetime
+
+import dedup
+import event_log
+import job_route
+
+PENDING = 'Pending'
+IN_PROGRESS = 'In Progress'
+RESOLVED = 'Resolved'
+
+STATUSES = [PENDING, IN_PROGRESS, RESOLVED]
+
+# Forward-only: nothing leaves Resolved, and a complaint is only resolved
+# once it has been assigned
+TRANSITIONS = {
+    PENDING: {IN_PROGRESS},
+    IN_PROGRESS: {RESOLVED},
+    RESOLVED: set(),
+}
+
+# The one move back, made only by unassign_worker() when a worker is
+# removed; the admin form can't pick it
+UNASSIGN = (IN_PROGRESS, PENDING)
+
+# Statuses a complaint can only be in with a worker assigned
+NEEDS_WORKER = {IN_PROGRESS, RESOLVED}
+
+
+def sources_for(new_status):
+    return [s for s in STATUSES if new_status in TRANSITIONS[s]]
+
+
+def _in_clause(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _cascade_status(cursor, parent_id, new_status):
+    # Complaints merged into a parent follow it through the same transition
+    sources = sources_for(new_status)
+    cursor.execute(f"""
+        UPDATE user_complaints_details
+        SET status = %s, version = version + 1
+        WHERE parent_complaint_id = %s AND status IN ({_in_clause(sources)})
+    """, (new_status, parent_id, *sources))
+    if new_status == RESOLVED:
+        dedup.index.discard(parent_id)
+
+
+def _failure_reason(cursor, complaint_id, new_status, expected_version=None):
+    # Only runs after a conditional UPDATE matched nothing, to explain why
+    cursor.execute("SELECT status, version, worker_id FROM user_complaints_details WHERE complaint_id = %s",
+                   (complaint_id,))
+    row = cursor.fetchone()
+    if not row:
+        return "Complaint ID not found."
+    status, version, worker_id = row
+    if status == new_status:
+        return f"Complaint is already {status}. No changes made."
+    if status == RESOLVED:
+        return "Cannot downgrade from Resolved. No changes made."
+    if new_status not in TRANSITIONS[status]:
+        return f"Cannot move a complaint from {status} to {new_status}."
+    if new_status in NEEDS_WORKER and worker_id is None:
+        return f"Assign a worker before marking the complaint {new_status}."
+    if expected_version is not None and version != expected_version:
+        return "Complaint was changed by someone else. Please reload and try again."
+    return "Complaint could not be updated."
+
+
+def change_status(db, complaint_id, new_status, expected_version=None, actor=None):
+    # One conditional UPDATE; the WHERE clause is the state machine.
+    # Returns (True, None) or (False, reason).
+    if new_status not in TRANSITIONS:
+        return False, "Invalid status selected."
+
+    sources = sources_for(new_status)
+    cursor = db.cursor()
+    if not sources:
+        reason = _failure_reason(cursor, complaint_id, new_status)
+        cursor.close()
+        return False, reason
+
+    query = f"""
+        UPDATE user_complaints_details
+        SET status = %s, version = version + 1
+        WHERE complaint_id = %s AND status IN ({_in_clause(sources)})
+    """
+    params = [new_status, complaint_id, *sources]
+    if new_status in NEEDS_WORKER:
+        query += " AND worker_id IS NOT NULL"
+    if expected_version is not None:
+        query += " AND version = %s"
+        params.append(expected_version)
+
+    cursor.execute(query, tuple(params))
+    if cursor.rowcount == 1:
+        event_log.record(complaint_id, event_log.STATUS_CHANGED, event_log.ROLE_ADMIN, actor, new_status, cursor)
+        _cascade_status(cursor, complaint_id, new_status)
+        db.commit()
+        cursor.close()
+        return True, None
+
+    db.rollback()
+    reason = _failure_reason(cursor, complaint_id, new_status, expected_version)
+    cursor.close()
+    return False, reason
+
+
+def assign(db, complaint_id, worker_id, actor=None):
+    # Only an unassigned open complaint can be assigned, so when two admins
+    # race exactly one UPDATE matches and the other sees rowcount 0.
+    # (In Progress with no worker is only left on rows older than unassign_worker.)
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE user_complaints_details
+        SET worker_id = %s, status = %s, version = version + 1
+        WHERE complaint_id = %s AND worker_id IS NULL AND status IN (%s, %s)
+    """, (worker_id, IN_PROGRESS, complaint_id, PENDING, IN_PROGRESS))
+    assigned = cursor.rowcount == 1
+    if assigned:
+        event_log.record(complaint_id, event_log.ASSIGNED, event_log.ROLE_ADMIN, actor, worker_id, cursor)
+        # One assignment covers every complaint merged into this one
+        cursor.execute("""
+            UPDATE user_complaints_details
+            SET worker_id = %s, status = %s, version = version + 1
+            WHERE parent_complaint_id = %s AND worker_id IS NULL AND status IN (%s, %s)
+        """, (worker_id, IN_PROGRESS, complaint_id, PENDING, IN_PROGRESS))
+        job_route.replan(cursor, worker_id)
+        db.commit()
+    else:
+        db.rollback()
+    cursor.close()
+    return assigned
+
+
+def unassign_worker(cursor, worker_id, actor=None):
+    # Sends a worker's open complaints (merged ones included) back to the
+    # assignment queue, with an event each, in the caller's transaction.
+    # Returns their ids.
+    source, target = UNASSIGN
+    cursor.execute("""
+        SELECT complaint_id FROM user_complaints_details
+        WHERE worker_id = %s AND status = %s FOR UPDATE
+    """, (worker_id, source))
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return []
+    cursor.execute(f"""
+        UPDATE user_complaints_details
+        SET worker_id = NULL, status = %s, route_position = NULL, version = version + 1
+        WHERE complaint_id IN ({_in_clause(ids)}) AND worker_id = %s AND status = %s
+    """, (target, *ids, worker_id, source))
+    for complaint_id in ids:
+        event_log.record(complaint_id, event_log.UNASSIGNED, event_log.ROLE_ADMIN, actor, worker_id, cursor)
+    return ids
+
+
+def resolve_with_code(db, complaint_id, worker_id, worker_phone_no, code):
+    # The verification code check is part of the UPDATE's WHERE clause
+    cursor = db.cursor()
+    cursor.execute(f"""
+        UPDATE user_complaints_details
+        SET status = %s, version = version + 1
+        WHERE complaint_id = %s AND worker_id = %s AND verification_code = %s
+          AND status IN ({_in_clause(sources_for(RESOLVED))})
+    """, (RESOLVED, complaint_id, worker_id, code, *sources_for(RESOLVED)))
+    if cursor.rowcount == 1:
+        event_log.record(complaint_id, event_log.STATUS_CHANGED, event_log.ROLE_WORKER, worker_phone_no, RESOLVED, cursor)
+        _cascade_status(cursor, complaint_id, RESOLVED)
+        db.commit()
+        cursor.close()
+        return True, None
+
+    db.rollback()
+    cursor.execute("""
+        SELECT status FROM user_complaints_details
+        WHERE complaint_id = %s AND worker_id = %s
+    """, (complaint_id, worker_id))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        return False, "Complaint not found or not assigned to you."
+    if row[0] == RESOLVED:
+        return False, "Complaint is already Resolved."
+    return False, "Incorrect verification code."
+
+
+def resolve_batch(db, worker_id, worker_phone_no, items):
+    # Resolutions a worker queued offline: [(complaint_id, code, resolved_at)].
+    # One IN (...) query checks every code, then the valid ones are resolved
+    # in a single transaction. resolved_at is clamped between the complaint's
+    # creation and now. Returns [(complaint_id, result, user_phone_no)] in
+    # the order given; result is 'resolved', 'already_resolved',
+    # 'wrong_code' or 'not_found'. A replayed batch comes back as
+    # 'already_resolved', so the client can drop it either way.
+    ids = sorted({complaint_id for complaint_id, _, _ in items})
+    if not ids:
+        return []
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT complaint_id, status, verification_code, user_phone_no, complaint_datetime
+        FROM user_complaints_details
+        WHERE worker_id = %s AND complaint_id IN ({_in_clause(ids)})
+    """, (worker_id, *ids))
+    found = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    now = datetime.now()
+    results = []
+    done = set()
+    try:
+        for complaint_id, code, resolved_at in items:
+            if complaint_id not in found:
+                results.append((complaint_id, 'not_found', None))
+                continue
+            status, expected_code, user_phone_no, created = found[complaint_id]
+            if status == RESOLVED or complaint_id in done:
+                results.append((complaint_id, 'already_resolved', user_phone_no))
+                continue
+            if code != expected_code:
+                results.append((complaint_id, 'wrong_code', user_phone_no))
+                continue
+            cursor.execute(f"""
+                UPDATE user_complaints_details
+                SET status = %s, version = version + 1
+                WHERE complaint_id = %s AND worker_id = %s AND verification_code = %s
+                  AND status IN ({_in_clause(sources_for(RESOLVED))})
+            """, (RESOLVED, complaint_id, worker_id, code, *sources_for(RESOLVED)))
+            if cursor.rowcount != 1:
+                # Resolved by an admin since the SELECT
+                results.append((complaint_id, 'already_resolved', user_phone_no))
+                continue
+            at = min(max(resolved_at or now, created or now), now)
+            event_log.record(complaint_id, event_log.STATUS_CHANGED, event_log.ROLE_WORKER,
+                             worker_phone_no, RESOLVED, cursor, at)
+            _cascade_status(cursor, complaint_id, RESOLVED)
+            done.add(complaint_id)
+            results.append((complaint_id, 'resolved', user_phone_no))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    return results
+
+
+def merge_duplicate(db, complaint_id, actor=None):
+    # Folds a flagged complaint into the one it duplicates. If that one was
+    # itself merged, the root parent is used. The child takes on the
+    # parent's current assignment and status in the same UPDATE.
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE user_complaints_details c
+        JOIN user_complaints_details s ON s.complaint_id = c.suspected_duplicate_of
+        JOIN user_complaints_details p ON p.complaint_id = COALESCE(s.parent_complaint_id, s.complaint_id)
+        SET c.parent_complaint_id = p.complaint_id, c.suspected_duplicate_of = NULL,
+            c.worker_id = p.worker_id, c.status = p.status, c.version = c.version + 1
+        WHERE c.complaint_id = %s AND c.parent_complaint_id IS NULL
+          AND c.status = %s AND c.worker_id IS NULL
+          AND p.complaint_id != c.complaint_id
+    """, (complaint_id, PENDING))
+    merged = cursor.rowcount == 1
+    if merged:
+        event_log.record(complaint_id, event_log.MERGED, event_log.ROLE_ADMIN, actor, None, cursor)
+        # The merged complaint joins the parent's worker's route
+        cursor.execute("SELECT worker_id FROM user_complaints_details WHERE complaint_id = %s", (complaint_id,))
+        job_route.replan(cursor, cursor.fetchone()[0])
+        db.commit()
+        dedup.index.discard(complaint_id)
+    else:
+        db.rollback()
+    cursor.close()
+    return merged
+
+
+def dismiss_duplicate(db, complaint_id):
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE user_complaints_details SET suspected_duplicate_of = NULL
+        WHERE complaint_id = %s AND parent_complaint_id IS NULL
+    """, (complaint_id,))
+    db.commit()
+    cursor.close()
+
+
+def hammer(complaint_id, worker_id, threads=50):
+    # Stress check against a real database: many threads, each with its own
+    # connection, try to assign and then resolve the same Pending complaint.
+    # Exactly one assignment and one transition must win.
+    from db_setup import connection
+
+    results = {'assigned': 0, 'resolved': 0, 'errors': 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def run(n):
+        conn = connection()
+        if conn is None:
+            with lock:
+                results['errors'] += 1
+            barrier.abort()
+            return
+        try:
+            barrier.wait()
+            won_assign = assign(conn, complaint_id, worker_id, actor=f"hammer-{n}")
+            barrier.wait()
+            won_resolve, _ = change_status(conn, complaint_id, RESOLVED)
+            with lock:
+                results['assigned'] += won_assign
+                results['resolved'] += won_resolve
+        except threading.BrokenBarrierError:
+            pass
+        finally:
+            conn.close()
+
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python complaint_state.py <pending_complaint_id> <worker_id> [threads]")
+        sys.exit(1)
+    outcome = hammer(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 50)
+    print(outcome)
+    sys.exit(0 if outcome['assigned'] == 1 and outcome['resolved'] == 1 else 1)
@@ -0,0 +1,123 @@
+import gzip
+import sys
+import time
+import zlib
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIN_SIZE = getattr(config, 'COMPRESS_MIN_SIZE', 1024)
+LEVEL = getattr(config, 'COMPRESS_LEVEL', 6)
+COMPRESSIBLE = {'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+                'application/javascript', 'application/json', 'image/svg+xml'}
+
+
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=LEVEL):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=min(level, 9))
+
+
+def _compressor(encoding):
+    if encoding == 'br':
+        return brotli.Compressor(quality=min(LEVEL, 11))
+    return zlib.compressobj(LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # gzip framing
+
+
+def _stream(chunks, encoding):
+    # Flushes after every chunk so a streamed page still arrives piece by
+    # piece instead of waiting for the compressor's buffer to fill
+    compressor = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if encoding == 'br':
+                out = compressor.process(chunk) + compressor.flush()
+            else:
+                out = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if out:
+                yield out
+        yield compressor.finish() if encoding == 'br' else compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    # after_request hook. Event streams are left alone: they are tiny
+    # messages that must not sit in a compressor or proxy buffer. Files
+    # (direct_passthrough) are skipped too; /assets/ sends its own
+    # pre-compressed copies (assets.compressed).
+    from flask import request
+
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+if __name__ == "__main__":
+    # Renders the All Complaints table with N synthetic rows (the heaviest
+    # page) and reports what each encoding saves. No database needed.
+    from datetime import datetime
+    from app import create_app
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    complaints = [(i, f"98765{i % 1000:05d}", ['Plumbing', 'Electrical', 'Lift', 'Cleaning'][i % 4],
+                   f"Complaint {i}: water leaking near the staircase on floor {i % 12}",
+                   'Urgent' if i % 5 == 0 else 'Normal', datetime(2026, 1, 1, 9, i % 60),
+                   ['Pending', 'In Progress', 'Resolved'][i % 3], 'Personal', f"Tower {chr(65 + i % 6)}",
+                   'Not Assigned', None) for i in range(rows)]
+    app = create_app()
+    with app.test_request_context():
+        from flask import render_template
+        html = render_template('view_all_complaints.html', complaints=complaints).encode('utf-8')
+
+    print(f"view_all_complaints with {rows} rows: {len(html) / 1024:.1f} KiB uncompressed")
+    for encoding in ['gzip'] + (['br'] if brotli is not None else []):
+        started = time.perf_counter()
+        out = compress(html, encoding)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"  {encoding:5} {len(out) / 1024:8.1f} KiB  ({len(out) / len(html):.1%})  {elapsed:.1f} ms")
+    if brotli is None:
+        print("  br    not available (pip install brotli)")
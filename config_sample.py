@@ -11,3 +11,140 @@ MAIL_PASSWORD = "your-app-password"
 MAIL_SERVER = "smtp.gmail.com"
 MAIL_PORT = 587
 MAIL_USE_TLS = True
+
+# Complaint event log: True writes each event inside the request's transaction,
+# False buffers events and flushes them in batched inserts
+EVENT_LOG_DURABLE = False
+EVENT_LOG_BATCH_SIZE = 200
+EVENT_LOG_FLUSH_SECONDS = 2.0
+
+# Worker feedback: a rating's weight in the "recent" score halves every N days
+FEEDBACK_HALF_LIFE_DAYS = 30
+
+# Duplicate Community complaints: how far back to look and how similar the
+# descriptions must be (0-1) once location and type already match
+DEDUP_WINDOW_HOURS = 72
+DEDUP_THRESHOLD = 0.3
+
+# Status-change emails are grouped per recipient for this many seconds and
+# sent as one digest; admins listed here get a digest of new Urgent complaints
+NOTIFY_WINDOW_SECONDS = 120
+ADMIN_NOTIFY_EMAILS = []
+
+# Background jobs (escalation, SLA rollups). Every app process may run the
+# scheduler; a row lock in the database makes sure each run happens once.
+SCHEDULER_ENABLED = True
+ESCALATE_URGENT_AFTER_HOURS = 4
+# Resolved complaints untouched for this long move to the archive tables
+ARCHIVE_AFTER_DAYS = 365
+RESET_CODE_TTL_MINUTES = 15
+
+# Responses larger than this many bytes are gzip'd (brotli if installed)
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+# Database circuit breaker (per server). A stalled server fails a call after
+# DB_TIMEOUT_SECONDS. After DB_FAILURE_THRESHOLD failed calls in a row, or
+# calls slower than DB_SLOW_CALL_MS, pages that need the database answer at
+# once with a "be right back" page for DB_OPEN_SECONDS, then one request
+# tries the database again. Meanwhile complaint lists, workers' job lists
+# and the SLA reports are shown as they were last served (up to
+# LAST_GOOD_PAGES kept per complex, in each server process; lists longer
+# than LAST_GOOD_ROWS rows aren't kept).
+DB_TIMEOUT_SECONDS = 10
+DB_FAILURE_THRESHOLD = 5
+DB_SLOW_CALL_MS = 2000
+DB_OPEN_SECONDS = 15
+LAST_GOOD_PAGES = 2000
+LAST_GOOD_ROWS = 500
+
+# Read replicas for the listing pages and reports: host names, or dicts of
+# connect() arguments such as {"host": "127.0.0.1", "port": 3307}. A replica
+# more than REPLICA_MAX_LAG_SECONDS behind, or down, is skipped; a session
+# reads from the primary for READ_YOUR_WRITES_SECONDS after it writes.
+DB_REPLICAS = []
+REPLICA_POOL_SIZE = 5
+REPLICA_MAX_LAG_SECONDS = 5
+READ_YOUR_WRITES_SECONDS = 10
+# Streamed pages read from the primary when no replica can take them, on
+# connections of their own: at most this many per complex in each server
+# process, reused between pages
+STREAM_POOL_SIZE = 4
+
+# Several residential complexes in one app. Each complex gets its own
+# database (created and migrated on first use) on the shard named by
+# 'shard'; 'hosts' picks the complex from the site's host name, otherwise
+# the login and registration forms show a picker. Leave COMPLEXES empty to
+# run one complex in DB_NAME.
+COMPLEXES = {}
+# COMPLEXES = {
+#     1: {'name': 'Green View', 'database': 'user_database', 'hosts': ['greenview.example.com']},
+#     2: {'name': 'Lake Towers', 'database': 'lake_towers', 'shard': 'big',
+#         'admin_emails': ['office@laketowers.example.com']},
+# }
+# Shard name -> connect() arguments; 'main' is DB_HOST
+DB_SHARDS = {}
+# DB_SHARDS = {'big': {'host': 'db2.internal', 'port': 3306}}
+
+# Request profiling: this fraction of requests is stack-sampled and saved
+# under PROFILE_DIR (see the admin Request Profiles page). A request with an
+# "X-Profile: 1" or "X-Profile: cprofile" header is always profiled if it
+# comes from a logged-in admin or ends with ":<PROFILE_TOKEN>".
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_TOKEN = None
+PROFILE_DIR = "profiles"
+
+# A complaint form can be re-submitted (double tap, browser retry) for this
+# long and still only create one complaint
+IDEMPOTENCY_TTL_HOURS = 24
+
+# The admin Complaint Heatmap keeps complaint counts in memory (needs NumPy:
+# pip install numpy) and snapshots them here so a restart maps the file
+# instead of rebuilding from the database
+CUBE_DIR = "cube"
+
+# Nightly columnar copy of complaints, addresses, workers and feedback for
+# reports (python report_snapshot.py report | query ...; reading needs NumPy).
+# The last REPORT_SNAPSHOT_KEEP days are kept for each complex.
+REPORT_SNAPSHOT_DIR = "report_snapshots"
+REPORT_SNAPSHOT_KEEP = 7
+
+# Requests are classed by who is logged in: admin, worker, user (resident)
+# or public. Each class runs at most `slots` requests at once, each on a
+# database connection of its own, queues up to `queue` more for at most
+# `max_wait` seconds, and turns the rest away with a "busy" page. By default
+# the limits are shares of WEB_THREADS (admission.SHARES); REQUEST_CLASSES
+# sets a class outright. All slots + queues + LIVE_STREAMS must fit in
+# WEB_THREADS or the app refuses to start.
+# A server process opens up to the sum of all slots connections per complex.
+# REQUEST_CLASSES = {'admin': (2, 1, 10.0), 'worker': (2, 2, 10.0), 'user': (2, 1, 3.0), 'public': (1, 1, 5.0)}
+REQUEST_CLASSES = {}
+
+# Live-updates streams (worker and resident dashboards) each server process
+# keeps open, each holding one thread; None = a quarter of WEB_THREADS.
+# Dashboards past the cap reconnect 30s later, possibly to another process.
+# In production, serve the streams from live_server.py instead (below).
+LIVE_STREAMS = None
+
+# python live_server.py (with the web workers' SECRET_KEY in its
+# environment) serves /worker_events and /user_events from one event loop,
+# with no thread per open dashboard. Either send those paths to
+# LIVE_SERVER_BIND from the proxy in front of gunicorn, or set
+# LIVE_EVENTS_URL to its public address (e.g. "http://example.org:5001")
+# so the pages open their streams there. LIVE_RELAY_DIR (None = a temp
+# directory per checkout) holds the sockets the processes pass events
+# through; they must all see the same one.
+LIVE_SERVER_BIND = "127.0.0.1:5001"
+LIVE_SERVER_MAX_STREAMS = 10000
+LIVE_EVENTS_URL = None
+LIVE_RELAY_DIR = None
+
+# Production server: gunicorn -c gunicorn.conf.py wsgi:app (Linux/macOS).
+# WEB_WORKERS = None sizes the pool at 2 x CPU cores + 1. Each worker runs
+# WEB_THREADS threads; see REQUEST_CLASSES and LIVE_STREAMS above.
+# A worker is replaced after WEB_MAX_REQUESTS requests (0 = never).
+WEB_BIND = "0.0.0.0:5000"
+WEB_WORKERS = None
+WEB_THREADS = 16
+WEB_MAX_REQUESTS = 5000
+WEB_PIDFILE = "gunicorn.pid"
@@ -0,0 +1,392 @@
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import pooling
+from flask import has_request_context, session
+
+import admission
+import config
+import tenancy
+from db_setup import RECONNECT_DELAY
+
+
+# Each entry is a host name or a dict of mysql.connector.connect() arguments;
+# anything left out (user, password) is taken from the primary's. Replicas
+# copy the 'main' shard; complexes on other shards always read their primary.
+REPLICAS = getattr(config, 'DB_REPLICAS', [])
+POOL_SIZE = getattr(config, 'REPLICA_POOL_SIZE', 5)
+MAX_LAG_SECONDS = getattr(config, 'REPLICA_MAX_LAG_SECONDS', 5)
+STICKY_SECONDS = getattr(config, 'READ_YOUR_WRITES_SECONDS', 10)
+STREAM_POOL_SIZE = getattr(config, 'STREAM_POOL_SIZE', 4)   # primary connections open per complex, at most
+STREAM_WAIT_SECONDS = 5     # how long a page waits for one when all are in use
+CHECK_SECONDS = 5     # how long a replica's health/lag result is reused
+# Per complex: the event log, notifications, scheduler and analytics each
+# keep a connection of their own (ShardedConnection(background=True))
+BACKGROUND_CONNECTIONS = 4
+
+
+def _connect_args(spec):
+    args = {'host': config.DB_HOST, 'user': config.DB_USER,
+            'password': config.DB_PASS, 'database': config.DB_NAME}
+    args.update({'host': spec} if isinstance(spec, str) else spec)
+    return args
+
+
+class Replica:
+    def __init__(self, spec, number):
+        self.args = _connect_args(spec)
+        self.name = f"{self.args['host']}:{self.args.get('port', 3306)}"
+        self.number = number
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        self._pool = None
+        self._failed_at = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None and time.monotonic() - self._failed_at >= RECONNECT_DELAY:
+                    try:
+                        self._pool = pooling.MySQLConnectionPool(
+                            pool_name=f"replica{self.number}", pool_size=POOL_SIZE,
+                            connection_timeout=2, **self.args)
+                    except mysql.connector.Error as err:
+                        print(f"Replica {self.name} unavailable:", err)
+                        self._failed_at = time.monotonic()
+        return self._pool
+
+    def connect(self):
+        pool = self._get_pool()
+        if pool is None:
+            return None
+        try:
+            return pool.get_connection()
+        except mysql.connector.errors.PoolError:
+            return None     # every pooled connection is busy; the primary takes this read
+        except mysql.connector.Error as err:
+            print(f"Replica {self.name} connection failed:", err)
+            self.healthy = False
+            self.checked_at = time.monotonic()
+            return None
+
+    def _read_lag(self, conn):
+        # None means replication is configured but not running
+        cursor = conn.cursor(dictionary=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                cursor.execute("SHOW SLAVE STATUS")     # MySQL before 8.0.22
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if row is None:
+            return 0        # a standalone copy, e.g. a second local server in testing
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return int(lag) if lag is not None else None
+
+    def usable(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < CHECK_SECONDS:
+            return self.healthy
+        self.checked_at = now
+        conn = self.connect()
+        if conn is None:
+            self.healthy = False
+            return False
+        try:
+            self.lag = self._read_lag(conn)
+            self.healthy = self.lag is not None and self.lag <= MAX_LAG_SECONDS
+        except mysql.connector.Error as err:
+            print(f"Replica {self.name} status check failed:", err)
+            self.lag = None
+            self.healthy = False
+        finally:
+            conn.close()
+        if not self.healthy:
+            print(f"Replica {self.name} skipped (lag: {self.lag}).")
+        return self.healthy
+
+
+class StreamPool:
+    # Primary connections for streamed pages when no replica takes the read,
+    # kept per complex so a page doesn't pay for a new connection (and the
+    # database claim check) every time. At most `size` are open per complex,
+    # in use or idle; a page that finds them all in use waits up to
+    # STREAM_WAIT_SECONDS for one. close() on a connection handed out here
+    # gives it back; one closed with rows still unread is dropped.
+
+    def __init__(self, size=STREAM_POOL_SIZE, wait_seconds=STREAM_WAIT_SECONDS):
+        self.size = size
+        self.wait_seconds = wait_seconds
+        self._idle = {}
+        self._open = {}
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self.opened = 0
+        self.reused = 0
+        self.refused = 0
+
+    def connect(self, complex_id, background=False):
+        if not tenancy.breaker(complex_id, background).allow():
+            return None
+        deadline = time.monotonic() + self.wait_seconds
+        with self._returned:
+            while True:
+                idle = self._idle.get(complex_id)
+                if idle:
+                    conn = idle.pop()
+                    break
+                if self._open.get(complex_id, 0) < self.size:
+                    # Counted now, opened below outside the lock
+                    self._open[complex_id] = self._open.get(complex_id, 0) + 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.refused += 1
+                    print(f"Stream pool for complex {complex_id}: all {self.size} connections busy.")
+                    return None
+                self._returned.wait(remaining)
+
+        if conn is not None:
+            try:
+                if conn.is_connected():
+                    self.reused += 1
+                    return PooledStream(self, complex_id, conn)
+            except mysql.connector.Error:
+                pass
+            # Dead; a new one takes its place in the count
+            self._close(conn)
+        conn = tenancy.connect(complex_id, background=background)
+        if conn is None:
+            self._forget(complex_id)
+            return None
+        self.opened += 1
+        return PooledStream(self, complex_id, conn)
+
+    def give_back(self, complex_id, conn):
+        try:
+            if conn.unread_result:
+                raise mysql.connector.errors.InternalError(msg="unread rows")
+            # Ends the read's snapshot, so the next page sees current data
+            conn.rollback()
+        except mysql.connector.Error:
+            self._close(conn)
+            self._forget(complex_id)
+            return
+        with self._returned:
+            self._idle.setdefault(complex_id, []).append(conn)
+            self._returned.notify()
+
+    def _forget(self, complex_id):
+        with self._returned:
+            self._open[complex_id] -= 1
+            self._returned.notify()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def status(self):
+        return {'size': self.size, 'open': dict(self._open),
+                'idle': {complex_id: len(idle) for complex_id, idle in self._idle.items()},
+                'opened': self.opened, 'reused': self.reused, 'refused': self.refused}
+
+
+class PooledStream:
+    # What RowStream gets from the pool: the connection's cursor, and a
+    # close() that returns it
+
+    def __init__(self, pool, complex_id, conn):
+        self._pool = pool
+        self._complex_id = complex_id
+        self._conn = conn
+        self._cursors = []
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        for cursor in self._cursors:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        self._pool.give_back(self._complex_id, conn)
+
+
+class ReadRouter:
+    # Sends read-only queries to a healthy replica, round robin, and
+    # everything else to the primary. A session that wrote something in the
+    # last STICKY_SECONDS reads from the primary too, so residents see their
+    # own new complaint even while the replicas catch up.
+
+    def __init__(self, replicas=REPLICAS):
+        self.replicas = [Replica(spec, number) for number, spec in enumerate(replicas)]
+        self._turn = itertools.count()
+        self.reads = {'replica': 0, 'primary': 0}
+        self.streams = StreamPool()
+
+    def mark_write(self):
+        if self.replicas and has_request_context():
+            session['wrote_at'] = time.time()
+
+    def sticky(self):
+        if not has_request_context():
+            return False
+        wrote_at = session.get('wrote_at')
+        return wrote_at is not None and time.time() - wrote_at < STICKY_SECONDS
+
+    def replica_connection(self):
+        # A pooled replica connection (close() hands it back), or None when
+        # the read should go to the primary
+        complex_id = tenancy.current_complex_id()
+        if (not self.replicas or self.sticky() or complex_id is None
+                or tenancy.shard_of(complex_id) != 'main'):
+            return None
+        start = next(self._turn)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.usable():
+                conn = replica.connect()
+                if conn is not None:
+                    try:
+                        conn.database = tenancy.database_of(complex_id)
+                    except mysql.connector.Error as err:
+                        print(f"Replica {replica.name} has no database for complex {complex_id}:", err)
+                        conn.close()
+                        continue
+                    self.reads['replica'] += 1
+                    return conn
+        return None
+
+    @contextmanager
+    def reader(self, primary):
+        # with router.reader(db) as conn: ... -- primary is the shared app
+        # connection and is left open; a replica connection goes back to its pool
+        conn = self.replica_connection()
+        if conn is None:
+            self.reads['primary'] += 1
+            yield primary
+            return
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stream_connection(self, background=False):
+        # For streaming.RowStream, which closes whatever it is given: a
+        # replica connection goes back to its pool, a primary one to the
+        # stream pool
+        conn = self.replica_connection()
+        if conn is None:
+            self.reads['primary'] += 1
+            complex_id = tenancy.current_complex_id()
+            conn = self.streams.connect(complex_id, background) if complex_id is not None else None
+        return conn
+
+    def warm(self):
+        # Opens each replica's pool now instead of on the first read
+        for replica in self.replicas:
+            replica.usable()
+
+    def status(self):
+        return {
+            'reads': dict(self.reads),
+            'stream_pool': self.streams.status(),
+            'replicas': [{'name': r.name, 'healthy': r.healthy, 'lag_seconds': r.lag}
+                         for r in self.replicas],
+        }
+
+
+router = ReadRouter()
+
+
+def connections_needed():
+    # Connections one server process may hold: {shard: count} on the
+    # primaries, and the count on each replica. Per complex that is one
+    # per admission slot, one outside the slots, the background ones and
+    # the stream pool.
+    per_complex = (sum(c.slots for c in admission.classes.values()) + 1
+                   + BACKGROUND_CONNECTIONS + STREAM_POOL_SIZE)
+    shards = {}
+    for complex_id in tenancy.COMPLEXES:
+        shard = tenancy.shard_of(complex_id)
+        shards[shard] = shards.get(shard, 0) + per_complex
+    return shards, POOL_SIZE
+
+
+def _max_connections(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT @@max_connections")
+    limit = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return limit
+
+
+def check_connections(workers):
+    # Compares what `workers` server processes may open against each
+    # server's max_connections. Returns the servers that are short; a
+    # graceful reload runs old and new workers side by side, so less than
+    # twice the need only warns.
+    shards, per_replica = connections_needed()
+    servers = []
+    for shard, per_worker in shards.items():
+        complex_id = next(c for c in tenancy.COMPLEXES if tenancy.shard_of(c) == shard)
+        servers.append((f"shard {shard}", per_worker, lambda c=complex_id: tenancy.connect(c, background=True)))
+    for replica in router.replicas:
+        servers.append((f"replica {replica.name}", per_replica,
+                        lambda r=replica: mysql.connector.connect(connection_timeout=5, **r.args)))
+
+    short = []
+    for name, per_worker, connect in servers:
+        needed = workers * per_worker + 1     # + this check / the migrations
+        try:
+            conn = connect()
+            limit = _max_connections(conn) if conn is not None else None
+        except mysql.connector.Error as err:
+            print(f"Connections: {name} not checked:", err)
+            limit = None
+        if limit is None:
+            print(f"Connections: {name} needs max_connections >= {needed} ({workers} workers x {per_worker}).")
+        elif limit < needed:
+            print(f"Connections: {name} needs max_connections >= {needed} ({workers} workers x {per_worker}) "
+                  f"but has {limit}. Raise it, or lower WEB_WORKERS, WEB_THREADS or STREAM_POOL_SIZE.")
+            short.append(name)
+        elif limit < 2 * needed:
+            print(f"Connections: {name} has max_connections {limit}, enough for {needed} but not for the "
+                  f"{2 * needed} a graceful reload can briefly hold.")
+        else:
+            print(f"Connections: {name} needs {needed} of max_connections {limit}.")
+    return short
+
+
+if __name__ == "__main__":
+    # python db_router.py -- checks every configured replica and shows where
+    # reads would go. Point DB_REPLICAS at a second local server to try it.
+    if not router.replicas:
+        print("No DB_REPLICAS configured; every read goes to the primary.")
+        sys.exit(0)
+    for replica in router.replicas:
+        ok = replica.usable()
+        print(f"{replica.name:25} {'healthy' if ok else 'skipped'}  lag={replica.lag}")
+    for _ in range(len(router.replicas) * 2):
+        conn = router.replica_connection()
+        print("read ->", f"{conn.server_host}:{conn.server_port}" if conn else "primary")
+        if conn:
+            conn.close()
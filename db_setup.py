@@ -1,21 +1,418 @@
+import hashlib
+import threading
+import time
+
 import mysql.connector
 import config
+import job_route
+from circuit import CircuitOpen, GuardedCursor
+
+
+# Bump when adding an entry to MIGRATIONS. create_tables() always builds the
+# version 1 schema; later changes are applied on top as migrations.
+SCHEMA_VERSION = 14
+
+# Tables given a complex_id column by v9 (and dropped by v12)
+TENANT_TABLES = ['user_registeration_details', 'user_address_details', 'user_complaints_details',
+                 'admin_details', 'workers_details', 'complaint_events', 'sla_daily_rollups',
+                 'sla_rollup_state', 'worker_feedback_scores', 'scheduled_jobs']
+
+MIGRATIONS = {
+    # Optimistic concurrency counter, bumped by every state transition
+    2: ["ALTER TABLE user_complaints_details ADD COLUMN version INT NOT NULL DEFAULT 0"],
+    # Append-only complaint history, written by event_log.py
+    3: ["""CREATE TABLE IF NOT EXISTS complaint_events (
+            event_id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            complaint_id INT UNSIGNED NOT NULL,
+            event_type TINYINT UNSIGNED NOT NULL,
+            actor_role CHAR(1) NOT NULL,
+            actor VARCHAR(50),
+            detail VARCHAR(100),
+            created_at TIMESTAMP NOT NULL,
+            INDEX idx_events_complaint (complaint_id, event_id),
+            INDEX idx_events_type_time (event_type, created_at)
+        )"""],
+    # Daily SLA rollups with mergeable percentile sketches, built by analytics.py
+    4: ["""CREATE TABLE IF NOT EXISTS sla_daily_rollups (
+            day DATE NOT NULL,
+            metric TINYINT UNSIGNED NOT NULL,
+            complaint_type VARCHAR(100) NOT NULL,
+            priority VARCHAR(10) NOT NULL,
+            tower VARCHAR(50) NOT NULL,
+            worker VARCHAR(10) NOT NULL,
+            sample_count INT UNSIGNED NOT NULL,
+            sum_minutes BIGINT UNSIGNED NOT NULL,
+            sketch TEXT NOT NULL,
+            PRIMARY KEY (day, metric, complaint_type, priority, tower, worker)
+        )""",
+        "CREATE TABLE IF NOT EXISTS sla_rollup_state (last_day DATE NOT NULL)"],
+    # Running feedback aggregates per worker (complaint_type '' = all types),
+    # seeded from feedback already on the complaint rows
+    5: ["""CREATE TABLE IF NOT EXISTS worker_feedback_scores (
+            worker_phone_no CHAR(10) NOT NULL,
+            complaint_type VARCHAR(100) NOT NULL,
+            rating_count INT UNSIGNED NOT NULL,
+            rating_sum INT UNSIGNED NOT NULL,
+            rating_sum_sq INT UNSIGNED NOT NULL,
+            decayed_sum DOUBLE NOT NULL,
+            decayed_weight DOUBLE NOT NULL,
+            updated_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (worker_phone_no, complaint_type)
+        )""",
+        """INSERT INTO worker_feedback_scores
+            SELECT worker_phone_no, '', COUNT(*), SUM(feedback_rating), SUM(feedback_rating * feedback_rating),
+                   SUM(feedback_rating), COUNT(*), NOW()
+            FROM user_complaints_details
+            WHERE feedback_rating IS NOT NULL AND worker_phone_no IS NOT NULL
+            GROUP BY worker_phone_no""",
+        """INSERT INTO worker_feedback_scores
+            SELECT worker_phone_no, complaint_type, COUNT(*), SUM(feedback_rating), SUM(feedback_rating * feedback_rating),
+                   SUM(feedback_rating), COUNT(*), NOW()
+            FROM user_complaints_details
+            WHERE feedback_rating IS NOT NULL AND worker_phone_no IS NOT NULL
+              AND complaint_type IS NOT NULL AND complaint_type != ''
+            GROUP BY worker_phone_no, complaint_type"""],
+    # Duplicate Community complaints: flagged at submission, merged by an admin
+    6: ["ALTER TABLE user_complaints_details ADD COLUMN suspected_duplicate_of INT NULL",
+        "ALTER TABLE user_complaints_details ADD COLUMN parent_complaint_id INT NULL",
+        "CREATE INDEX idx_complaints_parent ON user_complaints_details (parent_complaint_id)"],
+    # Background jobs: one row per job, claimed by whichever process wins the
+    # conditional UPDATE on next_run_at
+    7: ["""CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            job_name VARCHAR(50) PRIMARY KEY,
+            next_run_at DATETIME NOT NULL,
+            owner VARCHAR(100),
+            claimed_at DATETIME,
+            last_duration_ms INT UNSIGNED,
+            last_error VARCHAR(255)
+        )""",
+        "ALTER TABLE user_complaints_details ADD COLUMN escalated_at DATETIME NULL"],
+    # Integer keys: complaints point at workers and residents by id, NULL
+    # worker_id means unassigned. The old assigned_to / worker_phone_no
+    # columns are no longer written; v13 drops them once backfill_keys()
+    # has filled in every existing row.
+    # The foreign key is added with foreign_key_checks off, which lets MySQL
+    # add it in place instead of copying the table; the column is new and
+    # all NULL, so there is nothing to check.
+    8: ["ALTER TABLE user_registeration_details ADD COLUMN user_id INT UNSIGNED NOT NULL AUTO_INCREMENT UNIQUE",
+        """ALTER TABLE user_complaints_details
+            ADD COLUMN user_id INT UNSIGNED NULL,
+            ADD COLUMN worker_id INT NULL,
+            ADD INDEX idx_complaints_user (user_id, complaint_datetime),
+            ADD INDEX idx_complaints_worker (worker_id, status),
+            ALGORITHM=INPLACE, LOCK=NONE""",
+        "SET foreign_key_checks = 0",
+        """ALTER TABLE user_complaints_details
+            ADD CONSTRAINT fk_complaints_worker FOREIGN KEY (worker_id)
+                REFERENCES workers_details (worker_id) ON DELETE SET NULL,
+            ALGORITHM=INPLACE, LOCK=NONE""",
+        "SET foreign_key_checks = 1"],
+    # Multi-complex tenancy: every database holds exactly one complex, named
+    # in complex_info (checked by tenancy.claim_database()). The per-row
+    # complex_id columns added here are dropped again by v12.
+    9: ["""CREATE TABLE IF NOT EXISTS complex_info (
+            complex_id SMALLINT UNSIGNED PRIMARY KEY,
+            claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )"""] + [f"ALTER TABLE {table} ADD COLUMN complex_id SMALLINT UNSIGNED NOT NULL DEFAULT 1"
+                 for table in TENANT_TABLES],
+    # One row per submitted complaint form, so a retried POST is answered
+    # with the first result; purged after IDEMPOTENCY_TTL_HOURS
+    10: ["""CREATE TABLE IF NOT EXISTS idempotency_keys (
+            idem_key CHAR(32) PRIMARY KEY,
+            user_id INT UNSIGNED,
+            complaint_id INT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_idempotency_created (created_at)
+        )"""],
+    # Visiting order of each worker's open jobs, kept by job_route.replan()
+    11: ["ALTER TABLE user_complaints_details ADD COLUMN route_position SMALLINT UNSIGNED NULL"],
+    # A database belongs to one complex as a whole, so no query filters on
+    # a per-row complex_id; complex_info is the only record of the owner
+    12: [f"ALTER TABLE {table} DROP COLUMN complex_id" for table in TENANT_TABLES],
+    # Workers by id everywhere: a deleted worker's phone number can be
+    # given to a new worker, who must not inherit the old one's scores,
+    # rollups or history. Assign/unassign events (types 2 and 8) name the
+    # worker by id from now on; older ones are rewritten, NULL where the
+    # worker is gone. The SLA rollups are emptied and rebuilt from the
+    # events by the next analytics run. Status and priority stay ENUMs:
+    # InnoDB already stores those as 1-byte codes.
+    13: ["ALTER TABLE user_complaints_details DROP COLUMN assigned_to, DROP COLUMN worker_phone_no",
+         """UPDATE complaint_events e
+            LEFT JOIN workers_details w ON w.worker_phone_no = e.detail
+            SET e.detail = w.worker_id
+            WHERE e.event_type IN (2, 8)""",
+         "ALTER TABLE worker_feedback_scores ADD COLUMN worker_id INT NULL FIRST",
+         """UPDATE worker_feedback_scores s
+            JOIN workers_details w ON w.worker_phone_no = s.worker_phone_no
+            SET s.worker_id = w.worker_id""",
+         "DELETE FROM worker_feedback_scores WHERE worker_id IS NULL",
+         """ALTER TABLE worker_feedback_scores
+            DROP PRIMARY KEY, DROP COLUMN worker_phone_no,
+            MODIFY worker_id INT NOT NULL, ADD PRIMARY KEY (worker_id, complaint_type)""",
+         "DELETE FROM sla_daily_rollups",
+         "DELETE FROM sla_rollup_state",
+         """ALTER TABLE sla_daily_rollups
+            DROP PRIMARY KEY, DROP COLUMN worker,
+            ADD COLUMN worker_id INT NOT NULL DEFAULT 0 AFTER tower,
+            ADD PRIMARY KEY (day, metric, complaint_type, priority, tower, worker_id)"""],
+    # Long-resolved complaints and their events, moved out of the live tables
+    # by maintenance.archive_resolved(). Same columns in the same order, so
+    # a later migration that changes either live table changes its archive too.
+    14: ["CREATE TABLE IF NOT EXISTS user_complaints_archive LIKE user_complaints_details",
+         "CREATE TABLE IF NOT EXISTS complaint_events_archive LIKE complaint_events"],
+}
+
+BACKFILL_BATCH = 1000
+SCHEMA_LOCK_SECONDS = 60   # how long a process waits for another's upgrade
+
+RECONNECT_DELAY = 5   # seconds between connect attempts after a failure
 
+# Bounds connecting and every read/write on the socket, so a stalled server
+# fails a call (and counts against the circuit breaker) instead of hanging it
+DB_TIMEOUT_SECONDS = getattr(config, 'DB_TIMEOUT_SECONDS', 10)
 
-def connection():
+
+def connection(**overrides):
+    # overrides: connect() arguments for another shard or complex database
+    args = {'host': config.DB_HOST, 'user': config.DB_USER,
+            'password': config.DB_PASS, 'database': config.DB_NAME,
+            'connection_timeout': DB_TIMEOUT_SECONDS}
+    args.update(overrides)
     try:
-        db = mysql.connector.connect(
-            host=config.DB_HOST,
-            user=config.DB_USER,
-            password=config.DB_PASS,
-            database=config.DB_NAME
-        )
+        db = mysql.connector.connect(**args)
         print("Database connected successfully.")
         return db
     except mysql.connector.Error as err:
         print("Error connecting to database:", err)
         return None
 
+
+class LazyConnection:
+    # Stands in for the connection object app.py used to open at import time.
+    # The real connection is made on first use, so importing the app (or
+    # forking a server worker) does no database work. `if not db` still
+    # works: truthiness triggers the connect attempt. With a breaker
+    # (circuit.py), calls fail fast with CircuitOpen while it is open; the
+    # connect function is expected to report its own outcome to the breaker
+    # (tenancy.connect does).
+
+    def __init__(self, connect=connection, check_schema=True, breaker=None):
+        self._connect = connect
+        self._check_schema = check_schema
+        self._breaker = breaker
+        self._conn = None
+        self._failed_at = 0
+        self._lock = threading.Lock()
+        self._after_commit = []
+
+    def get(self):
+        if self._breaker is not None:
+            self._breaker.check()
+        if self._conn is not None:
+            return self._conn
+        with self._lock:
+            if self._conn is None and time.monotonic() - self._failed_at >= RECONNECT_DELAY:
+                conn = self._connect()
+                if conn is None:
+                    self._failed_at = time.monotonic()
+                else:
+                    if self._check_schema:
+                        upgrade(conn)
+                        self._check_schema = False
+                    self._conn = conn
+        return self._conn
+
+    def reset(self):
+        # Drop the connection without touching the socket, e.g. after fork
+        self._conn = None
+        self._failed_at = 0
+        self._after_commit = []
+
+    def after_commit(self, func):
+        # func runs once the open transaction commits; a rollback drops it
+        self._after_commit.append(func)
+
+    def __bool__(self):
+        try:
+            return self.get() is not None
+        except CircuitOpen:
+            return False
+
+    def cursor(self, *args, **kwargs):
+        if self._breaker is None:
+            return self.get().cursor(*args, **kwargs)
+        conn = self.get()
+        if conn is None:
+            # Reaches the route's database error handling rather than
+            # failing on None
+            raise mysql.connector.errors.OperationalError(msg="No database connection available.")
+        return GuardedCursor(conn.cursor(*args, **kwargs), self._breaker, self.reset, transaction=self)
+
+    def commit(self):
+        try:
+            if self._breaker is None:
+                self.get().commit()
+            else:
+                self._breaker.call(self.get().commit, on_failure=self.reset)
+        except Exception:
+            self._after_commit = []
+            raise
+        callbacks, self._after_commit = self._after_commit, []
+        for func in callbacks:
+            func()
+
+    def rollback(self):
+        self._after_commit = []
+        if self._breaker is None:
+            return self.get().rollback()
+        return self._breaker.call(self.get().rollback, on_failure=self.reset)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def get_schema_version(data):
+    cursor = data.cursor()
+    try:
+        cursor.execute("SELECT version FROM schema_version")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    except mysql.connector.Error:
+        return 0
+    finally:
+        cursor.close()
+
+
+def set_schema_version(data, version):
+    cursor = data.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+    cursor.execute("DELETE FROM schema_version")
+    cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+    data.commit()
+    cursor.close()
+
+
+def ensure_schema(data):
+    started = time.perf_counter()
+    current = get_schema_version(data)
+    if current >= SCHEMA_VERSION:
+        print(f"Schema is current (v{current}), skipped DDL in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return False
+
+    # One process upgrades at a time (app workers, the scheduler, CLIs); the
+    # others wait here and then find the schema already current
+    cursor = data.cursor()
+    cursor.execute("SELECT GET_LOCK('schema_upgrade', %s)", (SCHEMA_LOCK_SECONDS,))
+    if cursor.fetchall()[0][0] != 1:
+        cursor.close()
+        raise mysql.connector.errors.OperationalError(msg="Timed out waiting for another schema upgrade.")
+    applied = []
+    try:
+        current = get_schema_version(data)
+        if current >= SCHEMA_VERSION:
+            print(f"Schema upgraded by another process (v{current}).")
+            return False
+        if current == 0:
+            create_tables(data)
+            set_schema_version(data, 1)
+        # The version is saved after every step, so an upgrade that fails
+        # part way resumes at the step that failed. A step stops here while
+        # an earlier step's backfill still has rows to fill (see upgrade()).
+        for version in range(max(current, 1) + 1, SCHEMA_VERSION + 1):
+            waiting = [step for step, (pending, _) in BACKFILLS.items() if step < version and pending(data)]
+            if waiting:
+                print(f"Schema v{version} waits for the v{waiting[0]} backfill.")
+                break
+            for statement in MIGRATIONS[version]:
+                cursor.execute(statement)
+            set_schema_version(data, version)
+            applied.append(version)
+    finally:
+        # Back on even if a step failed between turning it off and on
+        cursor.execute("SET foreign_key_checks = 1")
+        cursor.execute("SELECT RELEASE_LOCK('schema_upgrade')")
+        cursor.fetchall()
+        cursor.close()
+    for version in applied:
+        if version in AFTER_STEP:
+            AFTER_STEP[version](data)
+    reached = applied[-1] if applied else current
+    print(f"Schema upgraded v{current} -> v{reached} in {(time.perf_counter() - started) * 1000:.1f} ms.")
+    return bool(applied) or current == 0
+
+
+def upgrade(data):
+    # ensure_schema() with the data backfills run in between, outside the
+    # schema lock: other processes keep starting and serving while rows are
+    # filled in batches, and the step that needs them applies afterwards.
+    # Stops (leaving the schema behind) if a backfill makes no headway.
+    changed = ensure_schema(data)
+    version = get_schema_version(data)
+    while version < SCHEMA_VERSION:
+        waiting = [step for step, (pending, _) in BACKFILLS.items() if step <= version and pending(data)]
+        if not waiting:
+            break
+        for step in waiting:
+            BACKFILLS[step][1](data)
+        changed = ensure_schema(data) or changed
+        if get_schema_version(data) == version:
+            print(f"Schema left at v{version}; rows are still waiting for a backfill.")
+            break
+        version = get_schema_version(data)
+    return changed
+
+
+def backfill_keys(data, batch_size=BACKFILL_BATCH):
+    # Fills user_id / worker_id on complaints written before schema v8, one
+    # primary-key range per transaction so row locks stay short and the
+    # table stays usable. Safe to re-run; rows already done are skipped.
+    cursor = data.cursor()
+    cursor.execute("SELECT MIN(complaint_id), MAX(complaint_id) FROM user_complaints_details WHERE user_id IS NULL")
+    first_id, last_id = cursor.fetchone()
+    updated = 0
+    for start in range(first_id - 1 if first_id else 0, last_id or 0, batch_size):
+        cursor.execute("""
+            UPDATE user_complaints_details c
+            JOIN user_registeration_details u ON u.user_phone_no = c.user_phone_no
+            LEFT JOIN workers_details w ON w.worker_phone_no = c.worker_phone_no
+            SET c.user_id = u.user_id, c.worker_id = COALESCE(c.worker_id, w.worker_id)
+            WHERE c.complaint_id > %s AND c.complaint_id <= %s AND c.user_id IS NULL
+        """, (start, start + batch_size))
+        updated += cursor.rowcount
+        data.commit()
+    cursor.close()
+    if updated:
+        print(f"Backfilled integer keys on {updated} complaint(s).")
+    return updated
+
+
+def keys_pending(data):
+    # Complaints backfill_keys() can still fill in
+    cursor = data.cursor()
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM user_complaints_details c
+            JOIN user_registeration_details u ON u.user_phone_no = c.user_phone_no
+            WHERE c.user_id IS NULL)
+    """)
+    pending = cursor.fetchone()[0] == 1
+    cursor.close()
+    return pending
+
+
+# version -> (pending(data), backfill(data)): data a later step relies on,
+# filled in by upgrade() with no lock held
+BACKFILLS = {
+    8: (keys_pending, backfill_keys),
+}
+
+# version -> func(data), run once by the process that applied the step,
+# after it releases the schema lock
+AFTER_STEP = {
+    11: job_route.replan_all,
+}
+
+
 def create_tables(data):
     cursor = data.cursor()
     cursor.execute("""Create Table If Not Exists user_registeration_details(
@@ -27,7 +424,7 @@ def create_tables(data):
             user_gender ENUM('M','F','O'),
             user_password varchar(255) NOT NULL
             );""")
-    
+
     cursor.execute("""Create Table If Not Exists user_address_details (
             user_phone_no char(10) PRIMARY KEY,
             check (user_phone_no REGEXP '^[1-9][0-9]{9}$'),
@@ -38,9 +435,9 @@ def create_tables(data):
             user_area varchar(255),
             user_city varchar(255),
             user_state varchar(255) NOT NULL,
-            user_pincode int 
+            user_pincode int
             );""")
-    
+
     cursor.execute("""CREATE TABLE IF NOT EXISTS user_complaints_details (
                     complaint_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_phone_no CHAR(10),
@@ -52,9 +449,14 @@ def create_tables(data):
                     complaint_scope ENUM('Personal', 'Community'),
                     location VARCHAR(255),
                     assigned_to VARCHAR(100) DEFAULT 'Not Assigned',
+                    worker_phone_no CHAR(10),
+                    image_path VARCHAR(255),
+                    verification_code CHAR(6),
+                    feedback_rating TINYINT,
+                    feedback_text TEXT,
                     FOREIGN KEY (user_phone_no) REFERENCES user_registeration_details(user_phone_no)
                 );""")
-    
+
     cursor.execute(""" CREATE TABLE IF NOT EXISTS admin_details (
                         admin_id INT AUTO_INCREMENT PRIMARY KEY,
                         admin_username VARCHAR(50) NOT NULL,
@@ -64,9 +466,9 @@ def create_tables(data):
     if not cursor.fetchone():
         cursor.execute(
             "INSERT INTO admin_details (admin_username, admin_password) VALUES (%s, %s);",
-            (config.Admin1_username, config.Admin1_password)
+            (config.Admin1_username, hashlib.sha256(config.Admin1_password.encode()).hexdigest())
         )
-    
+
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS workers_details (
         worker_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -75,7 +477,6 @@ def create_tables(data):
         worker_password VARCHAR(255) NOT NULL,
         specialization VARCHAR(100)
          );""")
-     
+
     data.commit()
     cursor.close()
-
@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import config
+import tenancy
+
+
+WINDOW_HOURS = getattr(config, 'DEDUP_WINDOW_HOURS', 72)
+THRESHOLD = getattr(config, 'DEDUP_THRESHOLD', 0.3)
+BUCKET_SIZE = 50      # most recent complaints kept per (location, type)
+
+STOPWORDS = {'the', 'a', 'an', 'is', 'of', 'in', 'on', 'at', 'near', 'and', 'not', 'no',
+             'to', 'for', 'it', 'has', 'have', 'been', 'since', 'please', 'our', 'my'}
+ABBREVIATIONS = {'twr': 'tower', 'flr': 'floor', 'blk': 'block', 'bldg': 'building',
+                 'lft': 'lift', 'elevator': 'lift', 'gf': 'ground'}
+
+
+def _tokens(text):
+    words = re.findall(r"[a-z0-9]+", (text or '').lower())
+    return [ABBREVIATIONS.get(w, w) for w in words]
+
+
+def normalize_location(location):
+    # "Tower-B  Lift", "twr b lift" and "Lift, Tower B" all map to "b lift tower"
+    return " ".join(sorted(set(_tokens(location))))
+
+
+def shingles(text):
+    # Single words plus adjacent pairs: pairs reward the same phrasing, single
+    # words keep short, reordered descriptions ("lift not working in B" vs
+    # "B tower lift stuck") from scoring zero
+    words = [w for w in _tokens(text) if w not in STOPWORDS]
+    return set(words) | {words[i] + " " + words[i + 1] for i in range(len(words) - 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class DuplicateIndex:
+    # Open Community complaints bucketed by (normalized location, type).
+    # A lookup hashes to one bucket and compares against at most BUCKET_SIZE
+    # entries, so it costs the same no matter how many complaints exist.
+
+    def __init__(self, window_hours=WINDOW_HOURS, threshold=THRESHOLD):
+        self.window = timedelta(hours=window_hours)
+        self.threshold = threshold
+        self._buckets = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._warm = False
+        self._warm_lock = threading.Lock()
+
+    def _key(self, location, complaint_type):
+        return (normalize_location(location), (complaint_type or '').strip().lower())
+
+    def add(self, complaint_id, location, complaint_type, description, created=None):
+        key = self._key(location, complaint_type)
+        entry = (complaint_id, shingles(description), created or datetime.now())
+        with self._lock:
+            bucket = self._buckets.setdefault(key, deque(maxlen=BUCKET_SIZE))
+            bucket.append(entry)
+            self._keys[complaint_id] = key
+
+    def discard(self, complaint_id):
+        with self._lock:
+            key = self._keys.pop(complaint_id, None)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            for entry in list(bucket):
+                if entry[0] == complaint_id:
+                    bucket.remove(entry)
+            if not bucket:
+                del self._buckets[key]
+
+    def find(self, location, complaint_type, description):
+        # Returns (complaint_id, score) of the best open match, or None
+        key = self._key(location, complaint_type)
+        if not key[0]:
+            return None
+        probe = shingles(description)
+        cutoff = datetime.now() - self.window
+        best = None
+        with self._lock:
+            for complaint_id, other, created in self._buckets.get(key, ()):
+                if created < cutoff:
+                    continue
+                # Same place and type is already a strong signal; the text
+                # only has to overlap a little
+                score = 0.5 + 0.5 * jaccard(probe, other)
+                if score >= 0.5 + 0.5 * self.threshold and (best is None or score > best[1]):
+                    best = (complaint_id, round(score, 2))
+        return best
+
+    def warm(self, db):
+        # Loads recent open parent complaints once per process (wsgi's
+        # init_worker does it at start); a request arriving meanwhile waits
+        # for that load rather than running its own
+        if self._warm:
+            return
+        with self._warm_lock:
+            if not self._warm:
+                self._load(db)
+
+    def _load(self, db):
+        started = time.perf_counter()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT complaint_id, location, complaint_type, complaint_desc, complaint_datetime
+            FROM user_complaints_details
+            WHERE complaint_scope = 'Community' AND status != 'Resolved'
+              AND parent_complaint_id IS NULL AND suspected_duplicate_of IS NULL
+              AND complaint_datetime >= %s
+        """, (datetime.now() - self.window,))
+        rows = cursor.fetchall()
+        cursor.close()
+        for complaint_id, location, c_type, desc, created in rows:
+            self.add(complaint_id, location, c_type, desc, created)
+        self._warm = True
+        print(f"Duplicate index warmed with {len(rows)} complaints in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+
+index = tenancy.PerComplex(DuplicateIndex)
@@ -0,0 +1,158 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+
+import mysql.connector
+import config
+import tenancy
+from tenancy import ShardedConnection
+
+
+# Event and actor codes are stored as TINYINT / CHAR(1) to keep rows small
+CREATED = 1
+ASSIGNED = 2
+STATUS_CHANGED = 3
+FEEDBACK = 4
+DELETED = 5
+MERGED = 6
+ESCALATED = 7
+UNASSIGNED = 8
+ARCHIVED = 9
+
+EVENT_NAMES = {
+    CREATED: 'created',
+    ASSIGNED: 'assigned',
+    STATUS_CHANGED: 'status_changed',
+    FEEDBACK: 'feedback',
+    DELETED: 'deleted',
+    MERGED: 'merged',
+    ESCALATED: 'escalated',
+    UNASSIGNED: 'unassigned',
+    ARCHIVED: 'archived',
+}
+
+ROLE_USER = 'U'
+ROLE_ADMIN = 'A'
+ROLE_WORKER = 'W'
+ROLE_SYSTEM = 'S'
+
+# True: write each event with the caller's cursor, inside its transaction.
+# False: buffer in memory once the caller's transaction commits and flush in
+# batches (an event can be lost if the process dies before the next flush).
+DURABLE = getattr(config, 'EVENT_LOG_DURABLE', False)
+BATCH_SIZE = getattr(config, 'EVENT_LOG_BATCH_SIZE', 200)
+FLUSH_SECONDS = getattr(config, 'EVENT_LOG_FLUSH_SECONDS', 2.0)
+MAX_BUFFER = 50000    # cap while the DB is unreachable; oldest events dropped
+
+INSERT_EVENT = """
+    INSERT INTO complaint_events (complaint_id, event_type, actor_role, actor, detail, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+class EventLog:
+    def __init__(self, durable=DURABLE, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.durable = durable
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # Own connections so a flush never commits a request's half-done work
+        self._db = ShardedConnection(background=True)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, complaint_id, event_type, actor_role, actor=None, detail=None, cursor=None, at=None):
+        # at: when it happened, if not now (a worker's resolution synced later)
+        row = (complaint_id, event_type, actor_role, actor,
+               None if detail is None else str(detail)[:100],
+               (at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S"))
+
+        if self.durable and cursor is not None:
+            # Caller commits (or rolls back) the event together with its change
+            cursor.execute(INSERT_EVENT, row)
+            return
+
+        complex_id = tenancy.current_complex_id()
+        if complex_id is None:
+            print(f"Event for complaint {complaint_id} dropped: no complex selected.")
+            return
+        transaction = getattr(cursor, 'transaction', None)
+        if transaction is not None:
+            # Held until the caller commits, so a rolled-back change leaves
+            # no event behind
+            transaction.after_commit(lambda: self._buffer_row(complex_id, row))
+            return
+        self._buffer_row(complex_id, row)
+
+    def _buffer_row(self, complex_id, row):
+        with self._lock:
+            self._buffer.append((complex_id, row))
+            full = len(self._buffer) >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            by_complex = {}
+            for complex_id, row in rows:
+                by_complex.setdefault(complex_id, []).append(row)
+
+            written = 0
+            for complex_id, complex_rows in by_complex.items():
+                conn = self._db.for_complex(complex_id)
+                try:
+                    if not conn:
+                        raise mysql.connector.Error("no database connection")
+                    cursor = conn.cursor()
+                    # mysql-connector rewrites this into one multi-row INSERT
+                    cursor.executemany(INSERT_EVENT, complex_rows)
+                    conn.commit()
+                    cursor.close()
+                    written += len(complex_rows)
+                except mysql.connector.Error as err:
+                    print(f"Event log flush for complex {complex_id} failed, will retry:", err)
+                    conn.reset()
+                    with self._lock:
+                        self._buffer = ([(complex_id, row) for row in complex_rows] + self._buffer)[-MAX_BUFFER:]
+            return written
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='event-log-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def history(self, complaint_id):
+        self.flush()
+        cursor = self._db.cursor()
+        cursor.execute("""
+            SELECT event_type, actor_role, actor, detail, created_at
+            FROM complaint_events
+            WHERE complaint_id = %s
+            ORDER BY event_id
+        """, (complaint_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [(EVENT_NAMES.get(r[0], r[0]),) + tuple(r[1:]) for r in rows]
+
+
+events = EventLog()
+atexit.register(events.flush)
+
+
+def record(complaint_id, event_type, actor_role, actor=None, detail=None, cursor=None, at=None):
+    events.record(complaint_id, event_type, actor_role, actor, detail, cursor, at)
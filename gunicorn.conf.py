@@ -0,0 +1,74 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Graceful reload (new code, zero downtime): kill -HUP $(cat gunicorn.pid)
+# starts new workers, then lets the old ones finish their requests and exit.
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import config as app_config   # "config" is a gunicorn setting name
+
+
+bind = getattr(app_config, 'WEB_BIND', '0.0.0.0:5000')
+workers = getattr(app_config, 'WEB_WORKERS', None) or multiprocessing.cpu_count() * 2 + 1
+# Threads per worker, shared out between the request classes and the
+# live-updates streams by admission.py
+worker_class = 'gthread'
+threads = getattr(app_config, 'WEB_THREADS', 16)
+
+# A worker is replaced after this many requests (jittered so they don't all
+# restart together), which bounds memory growth from the in-process caches
+max_requests = getattr(app_config, 'WEB_MAX_REQUESTS', 5000)
+max_requests_jitter = max(max_requests // 10, 1) if max_requests else 0
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+pidfile = getattr(app_config, 'WEB_PIDFILE', 'gunicorn.pid')
+
+# The app is imported in each worker after the fork, never in the master, so
+# no database socket or background thread is shared between processes and
+# HUP picks up new code
+preload_app = False
+
+accesslog = '-'
+
+
+CONNECTIONS_SHORT = 3    # exit status of the check below
+
+
+def _migrate(server):
+    # In a child process, so the master imports none of the app's modules
+    # and a HUP still loads new code into new workers. Then checks that
+    # MySQL's max_connections covers every worker's connections
+    # (db_router.check_connections). -> False if it doesn't.
+    script = ("import sys, tenancy, db_router; tenancy.migrate_all(); "
+              f"sys.exit({CONNECTIONS_SHORT} if db_router.check_connections({server.cfg.workers}) else 0)")
+    result = subprocess.run([sys.executable, '-c', script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=False)
+    return result.returncode != CONNECTIONS_SHORT
+
+
+def on_starting(server):
+    # Pending migrations run here, once, before any worker starts
+    if not _migrate(server):
+        raise RuntimeError("MySQL max_connections is too low for this many workers (see above).")
+
+
+def on_reload(server):
+    # New code may bring new migrations; the old workers keep serving
+    # meanwhile and ensure_schema's lock keeps the new ones waiting
+    _migrate(server)
+
+
+def post_worker_init(worker):
+    import wsgi
+    wsgi.init_worker()
+
+
+def worker_exit(server, worker):
+    # Runs in the worker; the atexit hooks then flush the event log and
+    # pending notifications
+    import wsgi
+    wsgi.exit_worker()
@@ -0,0 +1,120 @@
+import http.cookiejar
+import re
+import secrets
+import sys
+import threading
+import urllib.parse
+import urllib.request
+
+import mysql.connector
+
+import config
+
+
+TTL_HOURS = getattr(config, 'IDEMPOTENCY_TTL_HOURS', 24)
+KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_key():
+    return secrets.token_hex(16)
+
+
+def valid(key):
+    return bool(KEY_PATTERN.match(key or ''))
+
+
+def claim(db, key, user_id):
+    # The primary key on idem_key lets exactly one INSERT win. Returns
+    # (True, None) to the winner, and (False, complaint_id) to every replay:
+    # complaint_id is None while the winner is still working.
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT INTO idempotency_keys (idem_key, user_id) VALUES (%s, %s)", (key, user_id))
+        db.commit()
+        return True, None
+    except mysql.connector.IntegrityError:
+        db.rollback()
+        cursor.execute("SELECT user_id, complaint_id FROM idempotency_keys WHERE idem_key = %s", (key,))
+        row = cursor.fetchone()
+        if row is None or row[0] != user_id:
+            return False, None
+        return False, row[1]
+    finally:
+        cursor.close()
+
+
+def complete(cursor, key, complaint_id):
+    # Runs in the same transaction as the complaint INSERT
+    cursor.execute("UPDATE idempotency_keys SET complaint_id = %s WHERE idem_key = %s", (complaint_id, key))
+
+
+def release(db, key):
+    # The submission failed before it created anything; let the form be sent again
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE idem_key = %s AND complaint_id IS NULL", (key,))
+    db.commit()
+    cursor.close()
+
+
+def purge(db, ttl_hours=TTL_HOURS):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s HOUR", (ttl_hours,))
+    removed = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return removed
+
+
+def fire_duplicates(base_url, phone, password, copies=10, complex_id=None):
+    # Logs in as a resident, loads the complaint form once and POSTs it
+    # `copies` times at the same moment with the same key, like a
+    # double-tap plus browser retries. Exactly one complaint should appear.
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    login = {'user_phone_no': phone, 'user_password': password}
+    if complex_id:
+        login['complex_id'] = complex_id
+    opener.open(base_url + '/user_login', urllib.parse.urlencode(login).encode())
+
+    form = opener.open(base_url + '/add_complain').read().decode()
+    match = re.search(r'name="idempotency_key" value="([0-9a-f]{32})"', form)
+    if not match:
+        print("No idempotency_key in the form; is the resident logged in?")
+        return False
+
+    marker = f"idempotency check {secrets.token_hex(4)}"
+    body = urllib.parse.urlencode({
+        'idempotency_key': match.group(1), 'complain': 'C', 'complain_type': 'Other',
+        'complain_description': marker, 'complain_priority': 'Normal', 'location': 'Test block',
+    }).encode()
+
+    barrier = threading.Barrier(copies)
+    statuses = []
+
+    def submit():
+        barrier.wait()
+        try:
+            statuses.append(opener.open(base_url + '/add_complain', body).status)
+        except Exception as e:
+            statuses.append(repr(e))
+
+    threads = [threading.Thread(target=submit) for _ in range(copies)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    created = opener.open(base_url + '/view_complaints').read().decode().count(marker)
+    print(f"{copies} concurrent POSTs -> statuses {sorted(map(str, statuses))}; complaints created: {created}")
+    return created == 1
+
+
+if __name__ == "__main__":
+    # python idempotency.py http://localhost:5000 <phone> <password> [copies] [complex_id]
+    if len(sys.argv) < 4:
+        print("Usage: python idempotency.py <base_url> <phone> <password> [copies] [complex_id]")
+        sys.exit(1)
+    ok = fire_duplicates(sys.argv[1].rstrip('/'), sys.argv[2], sys.argv[3],
+                         int(sys.argv[4]) if len(sys.argv) > 4 else 10,
+                         sys.argv[5] if len(sys.argv) > 5 else None)
+    sys.exit(0 if ok else 1)
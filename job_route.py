@@ -0,0 +1,162 @@
+import re
+import sys
+import time
+
+
+# A worker's open jobs, in the order they should be visited, are stored in
+# user_complaints_details.route_position. They are replanned whenever the
+# worker's assignments change, so the worker's page only runs ORDER BY.
+
+OPEN_JOBS = """
+    SELECT c.complaint_id, c.complaint_priority, c.complaint_scope, c.location,
+           a.user_tower_no, a.user_floor_no, a.user_house_no
+    FROM user_complaints_details c
+    LEFT JOIN user_address_details a
+           ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+    WHERE c.worker_id = %s AND c.status != 'Resolved'
+"""
+
+TOWER_IN_TEXT = re.compile(r'\b(?:tower|block|wing)\s*[-#:]?\s*([a-z0-9]+)\b', re.I)
+FLOOR_IN_TEXT = re.compile(r'\b(?:floor\s*[-#:]?\s*(\d+)|(\d+)\s*(?:st|nd|rd|th)?\s*floor)\b', re.I)
+GROUND_IN_TEXT = re.compile(r'\b(?:ground|lobby|basement|parking|gate|garden)\b', re.I)
+
+
+def tower_key(label):
+    # "Tower B", "tower-b" and "B" are the same tower
+    label = (label or '').strip()
+    match = TOWER_IN_TEXT.match(label)
+    return (match.group(1) if match else label).upper() or None
+
+
+def _natural(key):
+    return (0, int(key), '') if key.isdigit() else (1, 0, key)
+
+
+def locate(job):
+    # (tower, floor, house) for a job. Community complaints only have a
+    # free-text location; a tower and floor are read from it when it names
+    # them ("Tower C lift lobby", "3rd floor corridor").
+    if job['scope'] == 'Personal' and job['tower']:
+        return tower_key(job['tower']), job['floor'] or 0, job['house_no'] or 0
+    text = job['location'] or ''
+    tower = TOWER_IN_TEXT.search(text)
+    floor = FLOOR_IN_TEXT.search(text)
+    if floor:
+        floor = int(floor.group(1) or floor.group(2))
+    elif GROUND_IN_TEXT.search(text):
+        floor = 0
+    return (tower.group(1).upper() if tower else None), floor or 0, 0
+
+
+def plan(jobs):
+    # Urgent jobs always come first (hard constraint); within each priority
+    # the worker finishes one tower before walking to the nearest remaining
+    # one (towers taken as neighbours in label order), and inside a tower
+    # rides up once, floor by floor, house by house. Jobs with no known
+    # tower (common areas) close each priority group. Returns complaint_ids.
+    order = []
+    here = None
+    for urgent in (True, False):
+        group = [j for j in jobs if (j['priority'] == 'Urgent') == urgent]
+        by_tower = {}
+        unplaced = []
+        for job in group:
+            tower, floor, house = locate(job)
+            if tower is None:
+                unplaced.append(job['complaint_id'])
+            else:
+                by_tower.setdefault(tower, []).append((floor, house, job['complaint_id']))
+
+        towers = sorted(by_tower, key=_natural)
+        rank = {tower: i for i, tower in enumerate(sorted(set(towers) | ({here} if here else set()), key=_natural))}
+        while towers:
+            if here is None:
+                nearest = towers[0]
+            else:
+                nearest = min(towers, key=lambda t: (abs(rank[t] - rank[here]), rank[t]))
+            towers.remove(nearest)
+            order.extend(cid for _, _, cid in sorted(by_tower[nearest]))
+            here = nearest
+        order.extend(sorted(unplaced))
+    return order
+
+
+def replan(cursor, worker_id):
+    # Runs inside the caller's transaction, after the assignment change
+    if worker_id is None:
+        return 0
+    cursor.execute(OPEN_JOBS, (worker_id,))
+    jobs = [{'complaint_id': r[0], 'priority': r[1], 'scope': r[2], 'location': r[3],
+             'tower': r[4], 'floor': r[5], 'house_no': r[6]} for r in cursor.fetchall()]
+    if not jobs:
+        return 0
+    order = plan(jobs)
+    cases = " ".join(["WHEN %s THEN %s"] * len(order))
+    params = [value for position, cid in enumerate(order, 1) for value in (cid, position)]
+    cursor.execute(f"""
+        UPDATE user_complaints_details
+        SET route_position = CASE complaint_id {cases} END
+        WHERE complaint_id IN ({', '.join(['%s'] * len(order))})
+    """, (*params, *order))
+    return len(order)
+
+
+def replan_all(data):
+    # Schema v11 backfill: plans every worker who has open jobs
+    cursor = data.cursor()
+    cursor.execute("SELECT DISTINCT worker_id FROM user_complaints_details "
+                   "WHERE worker_id IS NOT NULL AND status != 'Resolved'")
+    workers = [row[0] for row in cursor.fetchall()]
+    for worker_id in workers:
+        replan(cursor, worker_id)
+        data.commit()
+    cursor.close()
+    if workers:
+        print(f"Planned job routes for {len(workers)} worker(s).")
+    return len(workers)
+
+
+def _synthetic_jobs(count, towers=6, floors=15):
+    import random
+    rng = random.Random(7)
+    jobs = []
+    for i in range(count):
+        community = rng.random() < 0.15
+        jobs.append({'complaint_id': i + 1, 'priority': 'Urgent' if rng.random() < 0.2 else 'Normal',
+                     'scope': 'Community' if community else 'Personal',
+                     'location': f"Tower {chr(65 + rng.randrange(towers))} lobby" if community and rng.random() < 0.5
+                                 else ('Garden' if community else None),
+                     'tower': None if community else f"Tower {chr(65 + rng.randrange(towers))}",
+                     'floor': None if community else rng.randrange(floors),
+                     'house_no': None if community else rng.randrange(1, 9)})
+    return jobs
+
+
+def _cost(jobs, order):
+    # Tower changes (walks) and lift stops, the way a worker would do them
+    where = {j['complaint_id']: locate(j) for j in jobs}
+    walks = stops = 0
+    previous = None
+    for cid in order:
+        tower, floor, _ = where[cid]
+        if previous is None or tower != previous[0]:
+            walks += previous is not None
+            stops += floor > 0
+        elif floor != previous[1]:
+            stops += 1
+        previous = (tower, floor)
+    return walks, stops
+
+
+if __name__ == "__main__":
+    # python job_route.py [jobs] -- compares database order with the planned
+    # route for one worker's synthetic job list
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+    jobs = _synthetic_jobs(count)
+    started = time.perf_counter()
+    order = plan(jobs)
+    elapsed = (time.perf_counter() - started) * 1000
+    for name, sequence in (('database order', [j['complaint_id'] for j in jobs]), ('planned route', order)):
+        walks, stops = _cost(jobs, sequence)
+        print(f"{name:15} tower changes={walks:4}  lift stops={stops:4}")
+    print(f"planned {count} jobs in {elapsed:.2f} ms")
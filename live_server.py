@@ -0,0 +1,226 @@
+import asyncio
+import os
+import sys
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+import config
+import tenancy
+from live_updates import (HEARTBEAT_SECONDS, RELAY_DIR, Broker, Channel, Relay, format_event,
+                          user_channel, worker_channel)
+
+
+# python live_server.py -- serves the dashboards' live-updates streams
+# (/worker_events, /user_events) from one asyncio event loop, next to
+# gunicorn. An open dashboard costs a socket and its channel's entry here,
+# not a server thread, so thousands can stay open. It joins the web workers'
+# relay for the events they publish, and reads their session cookie, so it
+# needs the same SECRET_KEY in its environment. Send those two paths here
+# from the proxy in front of gunicorn, or set LIVE_EVENTS_URL to this
+# server's address.
+BIND = getattr(config, 'LIVE_SERVER_BIND', '127.0.0.1:5001')
+MAX_STREAMS = getattr(config, 'LIVE_SERVER_MAX_STREAMS', 10000)
+RETRY_SECONDS = 30          # how soon a dashboard turned away tries again
+HEADER_TIMEOUT = 10         # seconds to send the request line and headers
+MAX_HEADERS = 100
+
+STREAMS = {'worker_events': 'worker_phone_no', 'user_events': 'user_phone_no'}
+
+
+class LoopChannel(Channel):
+    def __init__(self, history_size):
+        super().__init__(history_size)
+        self.changed = asyncio.Event()
+
+
+class LoopBroker(Broker):
+    # The Broker's channels and history, with listeners parked on an
+    # asyncio.Event instead of a thread each. Everything but the relay's
+    # receiver runs on the event loop; the receiver hands its events over
+    # with call_soon_threadsafe.
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def _new_channel(self):
+        return LoopChannel(self.history_size)
+
+    def relayed(self, name, event, data, event_id=None):
+        self.loop.call_soon_threadsafe(self.publish, name, event, data, event_id)
+
+    def publish(self, name, event, data, event_id=None):
+        channel = self._channels.get(name)
+        if channel is not None:
+            channel.append(event_id, event, data)
+            channel.changed.set()
+            channel.changed = asyncio.Event()
+        return event_id
+
+    async def listen(self, name, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+        channel = self.join(name)
+        try:
+            last_seen = channel.resume_point(last_event_id)
+            yield "retry: 5000\n\n"
+            while True:
+                pending = channel.pending(last_seen)
+                if not pending:
+                    try:
+                        await asyncio.wait_for(channel.changed.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                    pending = channel.pending(last_seen)
+
+                if not pending:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                for seq, event_id, event, data in pending:
+                    last_seen = seq
+                    yield format_event(event_id, event, data)
+        finally:
+            self.leave(channel)
+
+
+class RelayInbox:
+    # What Relay publishes received events into
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, name, event, data, event_id=None):
+        self.broker.relayed(name, event, data, event_id)
+
+
+class LiveServer:
+    def __init__(self, broker, secret_key):
+        self.broker = broker
+        session_app = Flask(__name__)
+        session_app.secret_key = secret_key
+        self.cookie_name = session_app.config['SESSION_COOKIE_NAME']
+        self.max_age = int(session_app.permanent_session_lifetime.total_seconds())
+        self.sessions = SecureCookieSessionInterface().get_signing_serializer(session_app)
+        self.open = 0
+        self.refused = 0
+
+    def session(self, headers):
+        morsel = SimpleCookie(headers.get('cookie', '')).get(self.cookie_name)
+        if morsel is None:
+            return {}
+        try:
+            return self.sessions.loads(morsel.value, max_age=self.max_age)
+        except BadSignature:
+            return {}
+
+    def channel(self, stream, headers):
+        # The channel the cookie's owner may listen on, chosen the way
+        # tenancy.select_complex picks the complex; None if not logged in
+        session = self.session(headers)
+        phone = session.get(STREAMS[stream])
+        chosen = session.get('complex_id')
+        host_complex = tenancy.complex_for_host(headers.get('host'))
+        if host_complex is not None:
+            if chosen not in (None, host_complex):
+                return None
+            chosen = host_complex
+        if chosen not in tenancy.COMPLEXES:
+            chosen = next(iter(tenancy.COMPLEXES)) if len(tenancy.COMPLEXES) == 1 else None
+        if not phone or chosen is None:
+            return None
+        with tenancy.use(chosen):
+            return worker_channel(phone) if stream == 'worker_events' else user_channel(phone)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            headers = {}
+            for _ in range(MAX_HEADERS):
+                line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3 or parts[0] != 'GET':
+                await self.reply(writer, '405 Method Not Allowed')
+                return
+            target = urlsplit(parts[1])
+            stream = target.path.rstrip('/').rsplit('/', 1)[-1]
+            if stream not in STREAMS:
+                await self.reply(writer, '404 Not Found')
+                return
+            channel = self.channel(stream, headers)
+            if channel is None:
+                await self.reply(writer, '401 Unauthorized', headers)
+                return
+            last_event_id = headers.get('last-event-id') or parse_qs(target.query).get('last_event_id', [None])[0]
+            await self.stream(writer, headers, channel, last_event_id)
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def cors(self, headers):
+        # A page from the main site (same host, another port) may read the
+        # stream with its cookie
+        origin = headers.get('origin')
+        host = (headers.get('host') or '').split(':')[0]
+        if not origin or urlsplit(origin).hostname != host:
+            return ''
+        return f"Access-Control-Allow-Origin: {origin}\r\nAccess-Control-Allow-Credentials: true\r\nVary: Origin\r\n"
+
+    async def reply(self, writer, status, headers=None):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n{self.cors(headers or {})}"
+                     "Connection: close\r\n\r\n".encode())
+        await writer.drain()
+
+    async def stream(self, writer, headers, channel, last_event_id):
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                      f"X-Accel-Buffering: no\r\n{self.cors(headers)}Connection: close\r\n\r\n").encode())
+        if self.open >= MAX_STREAMS:
+            # As in app.event_stream: an empty stream with a retry time
+            self.refused += 1
+            writer.write(f"retry: {RETRY_SECONDS * 1000}\n\n".encode())
+            await writer.drain()
+            return
+        self.open += 1
+        events = self.broker.listen(channel, last_event_id)
+        try:
+            async for chunk in events:
+                writer.write(chunk.encode())
+                # Raises once the client has gone, at the latest on the
+                # next heartbeat
+                await writer.drain()
+        finally:
+            self.open -= 1
+            await events.aclose()
+
+
+async def serve(host, port, secret_key, ready=None):
+    broker = LoopBroker(asyncio.get_running_loop())
+    relay = Relay(RelayInbox(broker), RELAY_DIR)
+    live = LiveServer(broker, secret_key)
+    server = await asyncio.start_server(live.handle, host, port, backlog=1024)
+    print(f"Live updates on {host}:{server.sockets[0].getsockname()[1]} (relay {RELAY_DIR}).")
+    if ready is not None:
+        ready(server, live)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        relay.close()
+
+
+if __name__ == "__main__":
+    secret_key = os.environ.get('SECRET_KEY')
+    if not secret_key:
+        print("Set SECRET_KEY to the web workers' value; it is needed to read their session cookie.")
+        sys.exit(1)
+    host, _, port = BIND.rpartition(':')
+    try:
+        asyncio.run(serve(host, int(port), secret_key))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,256 @@
+import glob
+import hashlib
+import os
+import secrets
+import socket
+import tempfile
+import threading
+import time
+import json
+from collections import deque
+
+from flask import url_for
+
+import config
+import tenancy
+
+
+HISTORY_SIZE = 200        # events kept per channel for Last-Event-ID resume
+HEARTBEAT_SECONDS = 15    # keeps proxies from closing idle streams
+RESUME_SECONDS = 30       # a channel outlives its last listener this long, for a reconnect to resume
+
+# Where each process's relay socket lives: shared by the web workers (old
+# and new ones during a graceful reload) and live_server.py. The default is
+# per checkout, so two installs on one machine never see each other's events.
+RELAY_DIR = getattr(config, 'LIVE_RELAY_DIR', None) or os.path.join(
+    tempfile.gettempdir(), 'complaints-live-' + hashlib.md5(os.path.abspath(__file__).encode()).hexdigest()[:8])
+
+# Where pages open their live-updates streams: None for this server's own
+# /worker_events and /user_events (or a proxy sending those paths to
+# live_server.py), or live_server.py's address, e.g. "http://example.org:5001"
+EVENTS_URL = getattr(config, 'LIVE_EVENTS_URL', None)
+
+
+class Channel:
+    def __init__(self, history_size):
+        self.events = deque(maxlen=history_size)   # (seq, event id, event, data)
+        self.last_seq = 0      # arrival order in this process
+        self.cond = threading.Condition()
+        self.listeners = 0
+        self.idle_since = time.monotonic()
+
+    def append(self, event_id, event, data):
+        self.last_seq += 1
+        self.events.append((self.last_seq, event_id, event, data))
+
+    def resume_point(self, last_event_id):
+        # The seq a new listener continues after: the latest, or for a
+        # reconnect, just before the first event it missed that is still
+        # in the history window
+        if last_event_id is not None and str(last_event_id).isdigit():
+            missed = [e[0] for e in self.events if e[1] > int(last_event_id)]
+            if missed:
+                return missed[0] - 1
+        return self.last_seq
+
+    def pending(self, last_seen):
+        return [e for e in self.events if e[0] > last_seen]
+
+
+_id_lock = threading.Lock()
+_last_event_id = 0
+
+
+def next_event_id():
+    # Event ids are given out by the publishing process and travel with the
+    # relayed event, so every worker shows an event under the same id and a
+    # Last-Event-ID from one worker resumes on any other. Microseconds since
+    # the epoch (rising across workers and restarts), with the last three
+    # digits of the pid so two workers never hand out the same id.
+    global _last_event_id
+    with _id_lock:
+        _last_event_id = max(time.time_ns() // 1000 * 1000 + os.getpid() % 1000, _last_event_id + 1000)
+        return _last_event_id
+
+
+class Broker:
+    # In-process pub/sub. Each subscriber is a generator parked on its
+    # channel's Condition, so an idle stream costs one sleeping thread and
+    # no polling or DB work until something is published. A channel exists
+    # while someone listens on it, and for RESUME_SECONDS after; events for
+    # a channel nobody here listens on are not kept.
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+        self._relay = None
+
+    def start_relay(self, directory=RELAY_DIR):
+        # Under a pre-fork server each worker process has its own broker;
+        # the relay passes every publish on to the others
+        if self._relay is None and hasattr(socket, 'AF_UNIX'):
+            self._relay = Relay(self, directory)
+
+    def stop_relay(self):
+        if self._relay is not None:
+            self._relay.close()
+            self._relay = None
+
+    def _new_channel(self):
+        return Channel(self.history_size)
+
+    def join(self, name):
+        with self._lock:
+            channel = self._channels.get(name)
+            if channel is None:
+                channel = self._channels[name] = self._new_channel()
+            channel.listeners += 1
+            return channel
+
+    def leave(self, channel):
+        with self._lock:
+            channel.listeners -= 1
+            now = time.monotonic()
+            if channel.listeners == 0:
+                channel.idle_since = now
+            if now - self._swept >= RESUME_SECONDS:
+                self._swept = now
+                for name, idle in list(self._channels.items()):
+                    if idle.listeners == 0 and now - idle.idle_since >= RESUME_SECONDS:
+                        del self._channels[name]
+
+    def channels(self):
+        return len(self._channels)
+
+    def publish(self, name, event, data, event_id=None):
+        # event_id is given for an event relayed from another worker
+        relayed = event_id is not None
+        if not relayed:
+            event_id = next_event_id()
+        channel = self._channels.get(name)
+        if channel is not None:
+            with channel.cond:
+                channel.append(event_id, event, data)
+                channel.cond.notify_all()
+        if not relayed and self._relay is not None:
+            self._relay.send(name, event_id, event, data)
+        return event_id
+
+    def listen(self, name, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+        channel = self.join(name)
+        try:
+            with channel.cond:
+                last_seen = channel.resume_point(last_event_id)
+
+            yield "retry: 5000\n\n"
+            while True:
+                with channel.cond:
+                    pending = channel.pending(last_seen)
+                    if not pending:
+                        channel.cond.wait(heartbeat)
+                        pending = channel.pending(last_seen)
+
+                if not pending:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                for seq, event_id, event, data in pending:
+                    last_seen = seq
+                    yield format_event(event_id, event, data)
+        finally:
+            self.leave(channel)
+
+
+class Relay:
+    # One unix datagram socket per worker process, all in one directory.
+    # A publish is sent to every other socket there; each worker's receiver
+    # thread publishes what arrives into its own broker. A socket nobody is
+    # bound to any more belongs to a worker that exited and is removed.
+
+    def __init__(self, broker, directory):
+        self.broker = broker
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # The pid alone could repeat: live_server.py may run in another
+        # container sharing the directory
+        self.path = os.path.join(directory, f"{os.getpid()}-{secrets.token_hex(4)}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._in = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._in.bind(self.path)
+        self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._out.setblocking(False)
+        threading.Thread(target=self._receive, name='live-updates-relay', daemon=True).start()
+
+    def send(self, name, event_id, event, data):
+        message = json.dumps([name, event_id, event, data], default=str).encode()
+        for path in glob.glob(os.path.join(self.directory, '*.sock')):
+            if path == self.path:
+                continue
+            try:
+                self._out.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as err:
+                # BlockingIOError: that worker's queue is full
+                print(f"Live update for {name} not relayed to {os.path.basename(path)}:", err)
+
+    def _receive(self):
+        while True:
+            try:
+                message = self._in.recv(65536)
+            except OSError:
+                return      # closed
+            name, event_id, event, data = json.loads(message)
+            self.broker.publish(name, event, data, event_id=event_id)
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self._in.close()
+        self._out.close()
+
+
+def format_event(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def events_url(endpoint):
+    # Template global: the stream URL for a dashboard's data-source
+    path = url_for(endpoint)
+    return EVENTS_URL.rstrip('/') + path if EVENTS_URL else path
+
+
+# Phone numbers are only unique within a complex
+def worker_channel(worker_phone_no):
+    return f"worker:{tenancy.current_complex_id()}:{worker_phone_no}"
+
+
+def user_channel(user_phone_no):
+    return f"user:{tenancy.current_complex_id()}:{user_phone_no}"
+
+
+broker = Broker()
+
+
+def notify_assignment(worker_phone_no, user_phone_no, complaint_id, worker_name):
+    payload = {'complaint_id': complaint_id, 'assigned_to': worker_name,
+               'status': 'In Progress', 'at': time.strftime("%Y-%m-%d %H:%M:%S")}
+    broker.publish(worker_channel(worker_phone_no), 'assigned', payload)
+    if user_phone_no:
+        broker.publish(user_channel(user_phone_no), 'status', payload)
+
+
+def notify_status(user_phone_no, complaint_id, status):
+    if not user_phone_no:
+        return
+    payload = {'complaint_id': complaint_id, 'status': status,
+               'at': time.strftime("%Y-%m-%d %H:%M:%S")}
+    broker.publish(user_channel(user_phone_no), 'status', payload)
@@ -0,0 +1,133 @@
+import config
+import analytics
+import complaint_cube
+import idempotency
+import report_snapshot
+import event_log
+import scheduler
+from notifications import notifier
+
+
+ESCALATE_AFTER_HOURS = getattr(config, 'ESCALATE_URGENT_AFTER_HOURS', 4)
+ARCHIVE_AFTER_DAYS = getattr(config, 'ARCHIVE_AFTER_DAYS', 365)
+ARCHIVE_BATCH = 500
+
+# Resolved complaints with no event for ARCHIVE_AFTER_DAYS. Duplicates merged
+# into one move with it, so a group goes only once all of it is resolved.
+ARCHIVABLE = """
+    SELECT c.complaint_id FROM user_complaints_details c
+    WHERE c.complaint_id > %s AND c.parent_complaint_id IS NULL AND c.status = 'Resolved'
+      AND c.complaint_datetime < NOW() - INTERVAL %s DAY
+      AND NOT EXISTS (
+          SELECT 1 FROM complaint_events e
+          WHERE e.complaint_id = c.complaint_id AND e.created_at >= NOW() - INTERVAL %s DAY)
+      AND NOT EXISTS (
+          SELECT 1 FROM user_complaints_details k
+          WHERE k.parent_complaint_id = c.complaint_id AND k.status != 'Resolved')
+    ORDER BY c.complaint_id
+    LIMIT %s
+"""
+
+
+@scheduler.job('escalate_urgent', every=600, jitter=60)
+def escalate_urgent():
+    # Urgent complaints nobody has picked up in time: flag once, tell the admins
+    db = scheduler.db
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT complaint_id, complaint_type, complaint_desc, complaint_datetime
+        FROM user_complaints_details
+        WHERE complaint_priority = 'Urgent' AND status = 'Pending' AND escalated_at IS NULL
+          AND complaint_datetime < NOW() - INTERVAL %s HOUR
+    """, (ESCALATE_AFTER_HOURS,))
+    overdue = cursor.fetchall()
+
+    escalated = 0
+    for complaint_id, c_type, desc, created in overdue:
+        cursor.execute("""
+            UPDATE user_complaints_details SET escalated_at = NOW()
+            WHERE complaint_id = %s AND escalated_at IS NULL AND status = 'Pending'
+        """, (complaint_id,))
+        if cursor.rowcount:
+            escalated += 1
+            event_log.record(complaint_id, event_log.ESCALATED, event_log.ROLE_SYSTEM, 'scheduler', None, cursor)
+            notifier.notify_admins(f"ESCALATED: Urgent complaint ID {complaint_id} ({c_type}) has been "
+                                   f"Pending since {created}: {desc}")
+    db.commit()
+    cursor.close()
+    print(f"Escalated {escalated} urgent complaint(s).")
+
+
+@scheduler.job('sla_rollups', daily_at='01:30', jitter=300)
+def sla_rollups():
+    analytics.run_rollups(conn=scheduler.db)
+
+
+@scheduler.job('flush_event_log', every=60, jitter=10)
+def flush_event_log():
+    event_log.events.flush()
+
+
+@scheduler.job('archive_resolved', daily_at='03:30', jitter=300)
+def archive_resolved():
+    # Moves old resolved complaints and their events to the archive tables,
+    # one batch per transaction so the live tables stay usable. Runs after
+    # the nightly report snapshot. An 'archived' event stays behind in the
+    # live log for each group, which takes it off the heatmap cube.
+    db = scheduler.db
+    cursor = db.cursor()
+    last_id = 0
+    archived = 0
+    while True:
+        cursor.execute(ARCHIVABLE, (last_id, ARCHIVE_AFTER_DAYS, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH))
+        parents = [row[0] for row in cursor.fetchall()]
+        if not parents:
+            break
+        last_id = parents[-1]
+        # Locks just these groups, by key; one that changed since the scan
+        # waits for the next run
+        marks = ', '.join(['%s'] * len(parents))
+        cursor.execute(f"""
+            SELECT complaint_id, COALESCE(parent_complaint_id, complaint_id), status
+            FROM user_complaints_details
+            WHERE complaint_id IN ({marks}) OR parent_complaint_id IN ({marks})
+            FOR UPDATE
+        """, parents + parents)
+        rows = cursor.fetchall()
+        unfinished = {group for _, group, status in rows if status != 'Resolved'}
+        parents = [complaint_id for complaint_id in parents if complaint_id not in unfinished]
+        ids = [complaint_id for complaint_id, group, _ in rows if group not in unfinished]
+        if not ids:
+            db.rollback()
+            continue
+        marks = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"INSERT INTO complaint_events_archive SELECT * FROM complaint_events WHERE complaint_id IN ({marks})", ids)
+        cursor.execute(f"DELETE FROM complaint_events WHERE complaint_id IN ({marks})", ids)
+        cursor.execute(f"INSERT INTO user_complaints_archive SELECT * FROM user_complaints_details WHERE complaint_id IN ({marks})", ids)
+        cursor.execute(f"DELETE FROM user_complaints_details WHERE complaint_id IN ({marks})", ids)
+        for complaint_id in parents:
+            event_log.record(complaint_id, event_log.ARCHIVED, event_log.ROLE_SYSTEM, 'scheduler', None, cursor)
+        db.commit()
+        archived += len(ids)
+    db.commit()
+    cursor.close()
+    print(f"Archived {archived} resolved complaint(s).")
+
+
+@scheduler.job('purge_idempotency_keys', every=3600, jitter=300)
+def purge_idempotency_keys():
+    removed = idempotency.purge(scheduler.db)
+    print(f"Purged {removed} expired idempotency key(s).")
+
+
+@scheduler.job('snapshot_complaint_cube', every=600, jitter=60)
+def snapshot_complaint_cube():
+    # Lets a restarted process map the heatmap cube instead of rebuilding it
+    if complaint_cube.available():
+        complaint_cube.cube.save(scheduler.db)
+
+
+@scheduler.job('report_snapshot', daily_at='02:30', jitter=300)
+def take_report_snapshot():
+    # Committee reports and ad hoc analysis read this instead of the live tables
+    report_snapshot.take()
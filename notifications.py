@@ -0,0 +1,157 @@
+import atexit
+import threading
+import time
+
+from flask_mail import Message
+
+import config
+import tenancy
+from tenancy import ShardedConnection
+
+
+WINDOW_SECONDS = getattr(config, 'NOTIFY_WINDOW_SECONDS', 120)
+ADMIN_EMAILS = getattr(config, 'ADMIN_NOTIFY_EMAILS', [])
+MAX_LINES = 200       # per recipient, in case SMTP is down for a long time
+
+
+class NotificationBatcher:
+    # Collects events per recipient and sends one digest per recipient once
+    # its oldest event is WINDOW_SECONDS old. Every digest that is due goes
+    # out over a single SMTP session.
+
+    def __init__(self, window=WINDOW_SECONDS):
+        self.window = window
+        self.app = None
+        self.mail = None
+        self._db = ShardedConnection(background=True)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.sent_total = 0
+        self.last_rate = 0.0
+
+    def init_app(self, app, mail):
+        self.app = app
+        self.mail = mail
+
+    def notify_user(self, user_phone_no, line):
+        # Phone numbers are only unique within a complex
+        if user_phone_no:
+            self._queue(('user', (tenancy.current_complex_id(), user_phone_no)), line)
+
+    def notify_admins(self, line):
+        # A complex can list its own admins under 'admin_emails' in COMPLEXES
+        for email in tenancy.setting('admin_emails', ADMIN_EMAILS):
+            self._queue(('email', email), line)
+
+    def _queue(self, recipient, line):
+        with self._lock:
+            entry = self._pending.setdefault(recipient, [time.time(), []])
+            entry[1] = (entry[1] + [line])[-MAX_LINES:]
+        self._start()
+
+    def _start(self):
+        if self._thread is not None or self.app is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notification-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(min(self.window, 5))
+            try:
+                self.flush()
+            except Exception as e:
+                print("Notification flush failed:", e)
+
+    def _take_due(self, force):
+        now = time.time()
+        with self._lock:
+            due = {r: e for r, e in self._pending.items() if force or now - e[0] >= self.window}
+            for recipient in due:
+                del self._pending[recipient]
+        return due
+
+    def _requeue(self, due):
+        with self._lock:
+            for recipient, (first_at, lines) in due.items():
+                entry = self._pending.setdefault(recipient, [first_at, []])
+                entry[0] = min(entry[0], first_at)
+                entry[1] = (lines + entry[1])[-MAX_LINES:]
+
+    def _user_emails(self, residents):
+        # One lookup per complex for every resident in the batch;
+        # returns {(complex_id, phone): email}
+        by_complex = {}
+        for complex_id, phone in residents:
+            by_complex.setdefault(complex_id, []).append(phone)
+        emails = {}
+        for complex_id, phones in by_complex.items():
+            conn = self._db.for_complex(complex_id)
+            if not conn:
+                continue
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT user_phone_no, user_email_id FROM user_registeration_details WHERE user_phone_no IN ("
+                + ", ".join(["%s"] * len(phones)) + ")",
+                tuple(phones))
+            emails.update(((complex_id, phone), email) for phone, email in cursor.fetchall())
+            cursor.close()
+        return emails
+
+    def flush(self, force=False):
+        if self.app is None:
+            return 0
+        due = self._take_due(force)
+        if not due:
+            return 0
+
+        started = time.perf_counter()
+        sent = set()
+        try:
+            emails = self._user_emails([r[1] for r in due if r[0] == 'user'])
+            with self.app.app_context():
+                messages = []
+                for recipient, (first_at, lines) in due.items():
+                    kind, target = recipient
+                    address = emails.get(target) if kind == 'user' else target
+                    if address:
+                        messages.append((recipient, render_digest(address, lines)))
+                if not messages:
+                    return 0
+
+                with self.mail.connect() as conn:
+                    for recipient, msg in messages:
+                        conn.send(msg)
+                        sent.add(recipient)
+        except Exception as e:
+            # Only the digests that didn't go out are tried again
+            print(f"Sending notification digests failed after {len(sent)} sent, will retry the rest:", e)
+            self._requeue({r: entry for r, entry in due.items() if r not in sent})
+            self.sent_total += len(sent)
+            return len(sent)
+
+        elapsed = time.perf_counter() - started
+        self.sent_total += len(messages)
+        self.last_rate = len(messages) / elapsed if elapsed else float(len(messages))
+        print(f"Sent {len(messages)} notification digest(s) in {elapsed * 1000:.1f} ms ({self.last_rate:.1f} messages/s).")
+        return len(messages)
+
+
+def render_digest(address, lines):
+    if len(lines) == 1:
+        subject = "Complaint Update"
+    else:
+        subject = f"{len(lines)} Complaint Updates"
+    body = "Dear User,\n\nHere is what changed since our last message:\n\n"
+    body += "\n".join(f"  - {line}" for line in lines)
+    body += "\n\nThank you.\n"
+    msg = Message(subject, recipients=[address])
+    msg.body = body
+    return msg
+
+
+notifier = NotificationBatcher()
+atexit.register(notifier.flush, True)
@@ -0,0 +1,172 @@
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request, session
+
+import config
+
+
+SAMPLE_RATE = getattr(config, 'PROFILE_SAMPLE_RATE', 0.0)      # fraction of requests profiled
+PROFILE_TOKEN = getattr(config, 'PROFILE_TOKEN', None)
+PROFILE_DIR = getattr(config, 'PROFILE_DIR', 'profiles')
+HEADER = 'X-Profile'
+INTERVAL = 0.005      # seconds between stack samples
+KEEP_PER_ROUTE = 20
+
+
+class Sampler:
+    # One background thread samples the stacks of every thread that is
+    # currently being profiled. A request pays nothing unless it is one of
+    # them, and a profiled one only pays for a stack walk every INTERVAL.
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self._active = {}        # thread ident -> {collapsed stack: samples}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = {}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, {})
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stack = collapse(frame)
+                        stacks[stack] = stacks.get(stack, 0) + 1
+
+
+def collapse(frame):
+    # Root first, "file:function" per frame -- the format flamegraph.pl and
+    # speedscope read
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+sampler = Sampler()
+
+
+def _requested_mode():
+    # Admin-only: the header counts from a logged-in admin, or from anyone
+    # presenting PROFILE_TOKEN (for curl against production)
+    value = request.headers.get(HEADER)
+    if value:
+        mode = 'cprofile' if value.split(':')[0] == 'cprofile' else 'sample'
+        if 'admin_username' in session:
+            return mode
+        if PROFILE_TOKEN and hmac.compare_digest(value.split(':')[-1].encode(), PROFILE_TOKEN.encode()):
+            return mode
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def start_profile():
+    if request.endpoint in (None, 'static', 'main.asset', 'main.profiles', 'main.profile_file'):
+        return
+    mode = _requested_mode()
+    if mode is None:
+        return
+    g.profile = {'mode': mode, 'started': time.perf_counter(), 'ident': threading.get_ident(),
+                 'endpoint': request.endpoint, 'method': request.method}
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profile['profiler'] = profiler
+            return
+        except ValueError:
+            # Python 3.12+ allows one cProfile at a time per process
+            g.profile['mode'] = 'sample'
+    sampler.start(g.profile['ident'])
+
+
+def finish_profile(response):
+    # Stopped when the response is closed, so the time spent streaming a
+    # template is included
+    info = g.pop('profile', None)
+    if info is not None:
+        response.headers['X-Profile-Mode'] = info['mode']
+        response.call_on_close(lambda: _save(info))
+    return response
+
+
+def discard_profile(exc):
+    # The request failed before after_request ran; drop its profile
+    info = g.pop('profile', None)
+    if info is not None:
+        if info['mode'] == 'cprofile':
+            info['profiler'].disable()
+        else:
+            sampler.stop(info['ident'])
+
+
+def _save(info):
+    elapsed_ms = (time.perf_counter() - info['started']) * 1000
+    route_dir = os.path.join(PROFILE_DIR, info['endpoint'].replace('.', '_'))
+    os.makedirs(route_dir, exist_ok=True)
+    base = os.path.join(route_dir, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{info['method']}-{elapsed_ms:.0f}ms")
+
+    if info['mode'] == 'cprofile':
+        profiler = info['profiler']
+        profiler.disable()
+        profiler.dump_stats(base + '.pstats')
+    else:
+        stacks = sampler.stop(info['ident'])
+        with open(base + '.folded', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    # Only the newest KEEP_PER_ROUTE profiles of each route are kept
+    files = sorted(os.listdir(route_dir))
+    for old in files[:-KEEP_PER_ROUTE]:
+        os.remove(os.path.join(route_dir, old))
+    print(f"Profiled {info['method']} {info['endpoint']} ({info['mode']}) in {elapsed_ms:.1f} ms.")
+
+
+def profile_routes():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(name for name in os.listdir(PROFILE_DIR)
+                  if os.path.isdir(os.path.join(PROFILE_DIR, name)))
+
+
+def saved_profiles():
+    # [(route, filename, size)] newest first, for the admin page
+    found = []
+    for route in profile_routes():
+        route_dir = os.path.join(PROFILE_DIR, route)
+        for name in os.listdir(route_dir):
+            found.append((route, name, os.path.getsize(os.path.join(route_dir, name))))
+    found.sort(key=lambda p: p[1], reverse=True)
+    return found
+
+
+def init_app(app):
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(discard_profile)
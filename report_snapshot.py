@@ -0,0 +1,229 @@
+import os
+import re
+import shutil
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import columnar
+import config
+import event_log
+import tenancy
+from db_router import router
+from streaming import RowStream
+
+
+# A nightly copy of the reporting data in columnar files (columnar.py), so
+# committee reports and ad hoc analysis read a file instead of running heavy
+# queries against the live tables. One directory per complex and day:
+#   REPORT_SNAPSHOT_DIR/<complex_id>/<YYYY-MM-DD>/<table>.col
+# Phone numbers, passwords, codes and free text are left out.
+SNAPSHOT_DIR = getattr(config, 'REPORT_SNAPSHOT_DIR', 'report_snapshots')
+SNAPSHOT_KEEP = getattr(config, 'REPORT_SNAPSHOT_KEEP', 7)     # days kept per complex
+
+DAY_DIR = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Complaints in id (so roughly time) order, which keeps the date zone maps
+# tight. The resident's tower and floor are copied in for the usual reports.
+COMPLAINTS = """
+    SELECT c.complaint_id, c.user_id, c.complaint_type, c.complaint_priority, c.complaint_datetime,
+           c.status, c.complaint_scope, c.location, c.worker_id, c.feedback_rating, c.escalated_at,
+           c.parent_complaint_id, c.suspected_duplicate_of, r.resolved_at,
+           a.user_tower_no, a.user_floor_no, a.user_house_no
+    FROM user_complaints_details c
+    LEFT JOIN user_address_details a
+           ON a.user_phone_no = c.user_phone_no AND c.complaint_scope = 'Personal'
+    LEFT JOIN (SELECT complaint_id, MAX(created_at) AS resolved_at FROM complaint_events
+               WHERE event_type = %s AND detail = 'Resolved' GROUP BY complaint_id) r
+           ON r.complaint_id = c.complaint_id
+    ORDER BY c.complaint_id
+"""
+COMPLAINT_COLUMNS = [('complaint_id', 'int'), ('user_id', 'int'), ('complaint_type', 'str'),
+                     ('priority', 'str'), ('complaint_datetime', 'datetime'), ('status', 'str'),
+                     ('scope', 'str'), ('location', 'str'), ('worker_id', 'int'), ('feedback_rating', 'int'),
+                     ('escalated_at', 'datetime'), ('parent_complaint_id', 'int'),
+                     ('suspected_duplicate_of', 'int'), ('resolved_at', 'datetime'),
+                     ('tower', 'str'), ('floor', 'int'), ('house_no', 'int')]
+
+ADDRESSES = """
+    SELECT u.user_id, a.user_tower_no, a.user_floor_no, a.user_house_no, a.user_locality,
+           a.user_area, a.user_city, a.user_state, a.user_pincode
+    FROM user_address_details a
+    JOIN user_registeration_details u ON u.user_phone_no = a.user_phone_no
+    ORDER BY u.user_id
+"""
+ADDRESS_COLUMNS = [('user_id', 'int'), ('tower', 'str'), ('floor', 'int'), ('house_no', 'int'),
+                   ('locality', 'str'), ('area', 'str'), ('city', 'str'), ('state', 'str'), ('pincode', 'int')]
+
+WORKERS = """
+    SELECT worker_id, worker_name, specialization FROM workers_details ORDER BY worker_id
+"""
+WORKER_COLUMNS = [('worker_id', 'int'), ('worker_name', 'str'), ('specialization', 'str')]
+
+# Running feedback totals per worker and complaint type ('' = all types)
+FEEDBACK = """
+    SELECT worker_id, complaint_type, rating_count, rating_sum, rating_sum_sq
+    FROM worker_feedback_scores
+    ORDER BY worker_id, complaint_type
+"""
+FEEDBACK_COLUMNS = [('worker_id', 'int'), ('complaint_type', 'str'), ('rating_count', 'int'),
+                    ('rating_sum', 'int'), ('rating_sum_sq', 'int')]
+
+TABLES = {
+    'complaints': (COMPLAINTS, lambda: (event_log.STATUS_CHANGED,), COMPLAINT_COLUMNS),
+    'addresses': (ADDRESSES, tuple, ADDRESS_COLUMNS),
+    'workers': (WORKERS, tuple, WORKER_COLUMNS),
+    'feedback': (FEEDBACK, tuple, FEEDBACK_COLUMNS),
+}
+
+
+def complex_dir(complex_id=None):
+    return os.path.join(SNAPSHOT_DIR, str(complex_id or tenancy.current_complex_id()))
+
+
+def take(day=None):
+    # Writes the current complex's snapshot for `day` (today). Each table is
+    # streamed off a replica when there is one, or a connection of its own,
+    # so the app's connection is never held. The day's directory appears
+    # complete or not at all.
+    day = day or date.today()
+    started = time.perf_counter()
+    base = complex_dir()
+    final = os.path.join(base, day.isoformat())
+    building = final + '.tmp'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    counts = {}
+    for name, (query, values, columns) in TABLES.items():
+        rows = RowStream(query, values(), connect=lambda: router.stream_connection(background=True))
+        counts[name] = columnar.write_table(os.path.join(building, f"{name}.col"), columns, rows)
+
+    if os.path.exists(final):
+        os.replace(final, final + '.old')
+    os.replace(building, final)
+    shutil.rmtree(final + '.old', ignore_errors=True)
+    days = sorted(n for n in os.listdir(base) if DAY_DIR.match(n))
+    for old in days[:-SNAPSHOT_KEEP] if SNAPSHOT_KEEP else []:
+        shutil.rmtree(os.path.join(base, old), ignore_errors=True)
+
+    size = sum(os.path.getsize(os.path.join(final, n)) for n in os.listdir(final))
+    print(f"Report snapshot {final}: " + ", ".join(f"{n}={c}" for n, c in counts.items())
+          + f" rows, {size / 1024:.0f} KiB in {time.perf_counter() - started:.1f}s.")
+    return final
+
+
+def latest(complex_id=None):
+    base = complex_dir(complex_id)
+    try:
+        days = sorted(n for n in os.listdir(base) if DAY_DIR.match(n))
+    except FileNotFoundError:
+        return None
+    return os.path.join(base, days[-1]) if days else None
+
+
+def open_table(name, complex_id=None):
+    directory = latest(complex_id)
+    if directory is None:
+        raise FileNotFoundError(f"No report snapshot under {complex_dir(complex_id)} yet; "
+                                f"run: python report_snapshot.py take")
+    return columnar.Table(os.path.join(directory, f"{name}.col"))
+
+
+def resolution_hours(complaints, where=()):
+    # Median and 90th percentile hours to resolve, per complaint type,
+    # straight from the mapped columns
+    import numpy as np
+    rows = complaints.select(list(where) + [('resolved_at', '>', datetime(1970, 1, 1))])
+    types = complaints.column('complaint_type')[rows]
+    hours = (complaints.column('resolved_at')[rows] - complaints.column('complaint_datetime')[rows]) / 3600
+    report = []
+    for code in np.unique(types):
+        taken = hours[types == code]
+        report.append({'complaint_type': complaints.meta['complaint_type']['dictionary'][code - 1] if code else None,
+                       'resolved': len(taken), 'median_hours': round(float(np.median(taken)), 1),
+                       'p90_hours': round(float(np.percentile(taken, 90)), 1)})
+    return report
+
+
+def committee_report(complex_id=None, days=30):
+    # The monthly committee numbers, without touching MySQL
+    since = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+    recent = [('complaint_datetime', '>=', since)]
+    with open_table('complaints', complex_id) as complaints, open_table('workers', complex_id) as workers:
+        names = {w['worker_id']: w['worker_name'] for w in workers.query(
+            group_by=['worker_id', 'worker_name'], aggregates={'n': ('count',)})}
+        by_worker = complaints.query(recent + [('worker_id', '>', 0)], ['worker_id'],
+                                     {'jobs': ('count',), 'rated': ('count', 'feedback_rating'),
+                                      'avg_rating': ('mean', 'feedback_rating')})
+        for entry in by_worker:
+            entry['worker_name'] = names.get(entry['worker_id'])
+        return {
+            'snapshot': complaints.created_at,
+            'since': since.date().isoformat(),
+            'by_tower_status': complaints.query(recent, ['tower', 'status']),
+            'by_type_priority': complaints.query(recent, ['complaint_type', 'priority']),
+            'escalated': complaints.query(recent + [('escalated_at', '>', datetime(1970, 1, 1))])[0]['count'],
+            'resolution_hours': resolution_hours(complaints, recent),
+            'workers': sorted(by_worker, key=lambda e: -e['jobs']),
+            'monthly': complaints.query([], ['complaint_datetime:month'], {'complaints': ('count',)}),
+        }
+
+
+def _parse_filter(table, text):
+    match = re.match(r'^(\w+)\s*(!=|<=|>=|=|<|>|~)\s*(.*)$', text)
+    if not match:
+        raise ValueError(f"Bad filter {text!r}; use column=value, column>=value, column~a,b,...")
+    name, op, value = match.groups()
+    kind = table.meta.get(name, {}).get('kind')
+    parse = {'int': int, 'datetime': datetime.fromisoformat}.get(kind, str)
+    if op == '~':
+        return name, 'in', [parse(v) for v in value.split(',')]
+    return name, op, parse(value)
+
+
+if __name__ == "__main__":
+    # python report_snapshot.py take               -- snapshot every complex now
+    # python report_snapshot.py report [cid] [days] -- committee numbers from the latest snapshot
+    # python report_snapshot.py query <table> [filters] [by=col,...] [agg=label:fn:col ...]
+    #   e.g. query complaints status=Resolved complaint_datetime>=2026-01-01 by=tower agg=avg:mean:feedback_rating
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'take':
+        for complex_id in tenancy.COMPLEXES:
+            with tenancy.use(complex_id):
+                take()
+    elif command == 'report':
+        complex_id = int(sys.argv[2]) if len(sys.argv) > 2 else next(iter(tenancy.COMPLEXES))
+        days = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+        started = time.perf_counter()
+        report = committee_report(complex_id, days)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"Snapshot of {report['snapshot']}, complaints since {report['since']} "
+              f"({report['escalated']} escalated):")
+        for section in ('by_tower_status', 'by_type_priority', 'resolution_hours', 'workers', 'monthly'):
+            print(f"\n{section}")
+            for entry in report[section]:
+                print("  " + "  ".join(f"{k}={v}" for k, v in entry.items()))
+        print(f"\nreport built in {elapsed:.1f} ms")
+    elif command == 'query' and len(sys.argv) > 2:
+        with open_table(sys.argv[2], next(iter(tenancy.COMPLEXES))) as table:
+            where, group_by, aggregates = [], [], {}
+            for arg in sys.argv[3:]:
+                if arg.startswith('by='):
+                    group_by.extend(arg[3:].split(','))
+                elif arg.startswith('agg='):
+                    label, fn, *column = arg[4:].split(':')
+                    aggregates[label] = (fn, *column)
+                else:
+                    where.append(_parse_filter(table, arg))
+            started = time.perf_counter()
+            result = table.query(where, group_by, aggregates or None)
+            elapsed = (time.perf_counter() - started) * 1000
+            for entry in result:
+                print("  ".join(f"{k}={v}" for k, v in entry.items()))
+            print(f"{len(result)} group(s) from {table.rows} rows in {elapsed:.2f} ms "
+                  f"(scanned {table.last_scan[0]} of {table.last_scan[1]} blocks)")
+    else:
+        print("Usage: python report_snapshot.py take | report [complex_id] [days] | "
+              "query <table> [column<op>value ...] [by=col,...] [agg=label:fn:column ...]")
+        print("Tables:", ", ".join(TABLES))
+        sys.exit(1)
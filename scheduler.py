@@ -0,0 +1,192 @@
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+import tenancy
+from tenancy import ShardedConnection
+
+
+TICK_SECONDS = 30
+
+
+class Job:
+    def __init__(self, name, func, every=None, daily_at=None, jitter=0):
+        self.name = name
+        self.func = func
+        self.every = every            # seconds between runs
+        self.daily_at = daily_at      # "HH:MM", local time
+        self.jitter = jitter          # up to this many seconds added to each run
+        self.runs = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = None
+        self.last_run = None
+        self.last_error = None
+
+    def next_run_after(self, now):
+        if self.daily_at:
+            hour, minute = map(int, self.daily_at.split(':'))
+            run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if run <= now:
+                run += timedelta(days=1)
+        else:
+            run = now + timedelta(seconds=self.every)
+        return run + timedelta(seconds=random.uniform(0, self.jitter))
+
+    def metrics(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run.isoformat(timespec='seconds') if self.last_run else None,
+            'last_ms': round(self.last_ms, 1) if self.last_ms is not None else None,
+            'avg_ms': round(self.total_ms / self.runs, 1) if self.runs else None,
+            'max_ms': round(self.max_ms, 1),
+            'last_error': self.last_error,
+        }
+
+
+jobs = {}
+db = ShardedConnection(check_schema=True, background=True)
+_started_pid = None
+_lock = threading.Lock()
+
+
+def job(name, every=None, daily_at=None, jitter=0):
+    def register(func):
+        jobs[name] = Job(name, func, every, daily_at, jitter)
+        return func
+    return register
+
+
+def claim(name, job_def):
+    # Leader election per run: every process races the same conditional
+    # UPDATE and only the one that moves next_run_at forward gets rowcount 1.
+    now = datetime.now()
+    cursor = db.cursor()
+    cursor.execute("INSERT IGNORE INTO scheduled_jobs (job_name, next_run_at) VALUES (%s, %s)",
+                   (name, job_def.next_run_after(now) if job_def.daily_at else now))
+    cursor.execute("""
+        UPDATE scheduled_jobs
+        SET next_run_at = %s, owner = %s, claimed_at = %s
+        WHERE job_name = %s AND next_run_at <= %s
+    """, (job_def.next_run_after(now), f"{socket.gethostname()}:{os.getpid()}", now, name, now))
+    claimed = cursor.rowcount == 1
+    db.commit()
+    cursor.close()
+    return claimed
+
+
+def record_run(name, duration_ms, error):
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE scheduled_jobs SET last_duration_ms = %s, last_error = %s
+        WHERE job_name = %s
+    """, (int(duration_ms), error and error[:255], name))
+    db.commit()
+    cursor.close()
+
+
+def run_job(name):
+    job_def = jobs[name]
+    started = time.perf_counter()
+    error = None
+    try:
+        job_def.func()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        job_def.failures += 1
+        print(f"Job {name} failed: {error}")
+
+    elapsed = (time.perf_counter() - started) * 1000
+    job_def.runs += 1
+    job_def.total_ms += elapsed
+    job_def.max_ms = max(job_def.max_ms, elapsed)
+    job_def.last_ms = elapsed
+    job_def.last_run = datetime.now()
+    job_def.last_error = error
+    print(f"Job {name} finished in {elapsed:.1f} ms.")
+    return elapsed, error
+
+
+def tick():
+    # Each complex keeps its own scheduled_jobs rows, so every job runs once
+    # per complex, inside that complex's database
+    for complex_id in tenancy.COMPLEXES:
+        with tenancy.use(complex_id):
+            if not db:
+                continue
+            for name, job_def in list(jobs.items()):
+                try:
+                    if not claim(name, job_def):
+                        continue
+                except mysql.connector.Error as err:
+                    print(f"Could not claim job {name} for complex {complex_id}:", err)
+                    db.for_complex(complex_id).reset()
+                    continue
+                elapsed, error = run_job(name)
+                try:
+                    record_run(name, elapsed, error)
+                except mysql.connector.Error as err:
+                    print(f"Could not record job {name} for complex {complex_id}:", err)
+
+
+def _loop():
+    # Random start offset so processes booted together don't all hit the DB at once
+    time.sleep(random.uniform(0, TICK_SECONDS))
+    while True:
+        tick()
+        time.sleep(TICK_SECONDS)
+
+
+def start():
+    # Safe to call on every request: starts one thread per process, and a
+    # forked worker gets its own since threads don't survive fork
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid != os.getpid():
+            _started_pid = os.getpid()
+            threading.Thread(target=_loop, name='job-scheduler', daemon=True).start()
+
+
+def metrics():
+    return {name: job_def.metrics() for name, job_def in jobs.items()}
+
+
+if __name__ == "__main__":
+    # Import through the module name so the jobs register where tick() looks
+    import scheduler
+    import maintenance   # noqa: F401  (registers the jobs)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == 'list':
+        for name, job_def in scheduler.jobs.items():
+            print(f"{name:25} every={job_def.every} daily_at={job_def.daily_at} jitter={job_def.jitter}")
+        sys.exit(0)
+
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != 'run' or sys.argv[2] not in scheduler.jobs:
+        print("Usage: python scheduler.py list | run <job_name> [complex_id]")
+        print("Jobs:", ", ".join(scheduler.jobs))
+        sys.exit(1)
+
+    # Runs the job once, right now, without claiming a schedule slot, for
+    # one complex or each in turn
+    from app import create_app
+    create_app()
+    complexes = [int(sys.argv[3])] if len(sys.argv) == 4 else list(tenancy.COMPLEXES)
+    failed = False
+    for complex_id in complexes:
+        if complex_id not in tenancy.COMPLEXES:
+            print(f"No complex {complex_id}; complexes: {', '.join(map(str, tenancy.COMPLEXES))}")
+            sys.exit(1)
+        with tenancy.use(complex_id):
+            print(f"Complex {complex_id}:")
+            _, failure = scheduler.run_job(sys.argv[2])
+            failed = failed or bool(failure)
+    sys.exit(1 if failed else 0)
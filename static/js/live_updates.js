@@ -0,0 +1,22 @@
+// Listens on the stream named in #live-updates data-source and adds a line
+// per event, linking to data-link
+(function () {
+    var box = document.getElementById('live-updates');
+    if (!box || !window.EventSource) return;
+
+    function show(html) {
+        box.style.display = 'block';
+        box.innerHTML += '<p>' + html + ' - <a href="' + box.dataset.link + '">' + box.dataset.linkText + '</a></p>';
+    }
+
+    // withCredentials: the stream may come from live_server.py on another port
+    var source = new EventSource(box.dataset.source, {withCredentials: true});
+    source.addEventListener('assigned', function (e) {
+        var data = JSON.parse(e.data);
+        show('New complaint assigned: ID ' + data.complaint_id);
+    });
+    source.addEventListener('status', function (e) {
+        var data = JSON.parse(e.data);
+        show('Complaint ID ' + data.complaint_id + ' is now ' + data.status);
+    });
+})();
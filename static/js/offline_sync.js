@@ -0,0 +1,112 @@
+// Worker resolutions are queued in localStorage and sent in one batch to
+// #offline-sync data-endpoint whenever the browser is online, so a job
+// resolved in a basement with no signal syncs once the worker is back up.
+// Without JavaScript the resolve form still posts one complaint at a time.
+(function () {
+    var box = document.getElementById('offline-sync');
+    if (!box || !window.localStorage || !window.fetch) return;
+
+    var key = 'pendingResolutions:' + box.dataset.worker;
+    var form = document.getElementById('resolve-form');
+    var flushing = false;
+
+    function load() {
+        try {
+            return JSON.parse(localStorage.getItem(key)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function save(queue) {
+        localStorage.setItem(key, JSON.stringify(queue));
+        showCount();
+    }
+
+    function showCount() {
+        var count = load().length;
+        document.getElementById('offline-sync-count').textContent = count
+            ? count + ' resolution(s) waiting to sync' + (navigator.onLine ? '...' : ' (offline).')
+            : '';
+    }
+
+    function note(text) {
+        var line = document.createElement('p');
+        line.textContent = text;
+        box.appendChild(line);
+    }
+
+    function markOption(complaintId, text) {
+        if (!form) return;
+        var option = form.querySelector('option[value="' + complaintId + '"]');
+        if (option) {
+            option.disabled = true;
+            option.textContent = option.textContent.replace(/ \(.*\)$/, '') + ' (' + text + ')';
+        }
+    }
+
+    function flush() {
+        var queue = load();
+        if (flushing || !queue.length || !navigator.onLine) return;
+        flushing = true;
+        fetch(box.dataset.endpoint, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({items: queue.slice(0, 100)})
+        }).then(function (response) {
+            if (response.status === 401) {
+                note('Log in again to sync your queued resolutions.');
+                throw new Error('login required');
+            }
+            if (!response.ok) throw new Error('sync failed: ' + response.status);
+            return response.json();
+        }).then(function (data) {
+            var answered = {};
+            data.results.forEach(function (result) {
+                answered[result.complaint_id] = true;
+                note(result.message);
+                if (result.result === 'wrong_code') {
+                    // Enter the code again to retry
+                    var option = form && form.querySelector('option[value="' + result.complaint_id + '"]');
+                    if (option) {
+                        option.disabled = false;
+                        option.textContent = option.textContent.replace(/ \(.*\)$/, '');
+                    }
+                } else {
+                    markOption(result.complaint_id, result.result.replace('_', ' '));
+                }
+            });
+            save(load().filter(function (item) { return !answered[item.complaint_id]; }));
+        }).catch(function () {
+            // Still offline or the server is down; the queue is kept for the next try
+        }).then(function () {
+            flushing = false;
+            showCount();
+            if (load().length && navigator.onLine) setTimeout(flush, 30000);
+        });
+    }
+
+    if (form) {
+        form.addEventListener('submit', function (e) {
+            e.preventDefault();
+            var complaintId = parseInt(form.elements.complaint_id.value, 10);
+            var code = form.elements.verification_code.value.trim();
+            if (!complaintId || !code) return;
+            var queue = load().filter(function (item) { return item.complaint_id !== complaintId; });
+            queue.push({complaint_id: complaintId, code: code, resolved_at: Date.now()});
+            save(queue);
+            markOption(complaintId, 'queued');
+            form.elements.verification_code.value = '';
+            var next = form.querySelector('option:not([disabled])');
+            if (next) next.selected = true;
+            flush();
+        });
+    }
+
+    load().forEach(function (item) { markOption(item.complaint_id, 'queued'); });
+    window.addEventListener('online', flush);
+    window.addEventListener('offline', showCount);
+    showCount();
+    flush();
+})();
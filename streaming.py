@@ -0,0 +1,126 @@
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import mysql.connector
+from flask import Response, stream_template
+
+from db_setup import connection
+
+
+FETCH_SIZE = 500          # rows pulled off the socket at a time
+CHUNK_SIZE = 16 * 1024    # bytes of HTML gathered before each write
+
+
+class RowStream:
+    # Rows of one query read through an unbuffered cursor on a connection of
+    # its own, so the shared app connection stays free while the page is
+    # still being sent. The query runs and the first FETCH_SIZE rows are
+    # read when the object is created, so SQL and connection errors reach
+    # the route before any byte goes out. A later failure ends the rows
+    # early and is kept in .error for the template to report.
+
+    def __init__(self, query, values=(), connect=connection):
+        self.error = None
+        self.conn = connect()
+        if self.conn is None:
+            raise mysql.connector.Error("Database connection unavailable.")
+        try:
+            self.cursor = self.conn.cursor(buffered=False)
+            self.cursor.execute(query, tuple(values))
+            self._first = self.cursor.fetchmany(FETCH_SIZE)
+        except mysql.connector.Error:
+            self.close()
+            raise
+
+    def __iter__(self):
+        try:
+            rows, self._first = self._first, None
+            while rows:
+                yield from rows
+                rows = self.cursor.fetchmany(FETCH_SIZE)
+        except mysql.connector.Error as err:
+            # The page is partly sent by now; it ends with a notice instead
+            print("Streamed rows cut short:", err)
+            self.error = err
+        finally:
+            self.close()
+
+    def close(self):
+        # Also runs when the client disconnects halfway through the page;
+        # dropping the connection discards whatever rows were still unread
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except mysql.connector.Error:
+                pass
+            self.conn = None
+
+
+def _chunked(parts):
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    # Jinja yields a string per template node; gathering them into
+    # CHUNK_SIZE writes keeps the first write early without sending (and
+    # compressing) thousands of tiny pieces. The session cookie is already
+    # sent by then, so templates streamed this way must not pop flashes.
+    return Response(_chunked(stream_template(template_name, **context)), mimetype='text/html')
+
+
+def _synthetic_rows(count):
+    from datetime import datetime
+    for i in range(count):
+        yield (i, f"98765{i % 1000:05d}", ['Plumbing', 'Electrical', 'Lift', 'Cleaning'][i % 4],
+               f"Complaint {i}: water leaking near the staircase on floor {i % 12}",
+               'Urgent' if i % 5 == 0 else 'Normal', datetime(2026, 1, 1, 9, i % 60),
+               ['Pending', 'In Progress', 'Resolved'][i % 3], 'Personal', f"Tower {chr(65 + i % 6)}",
+               'Not Assigned', None)
+
+
+def _bench_one(mode, count):
+    # Runs in its own process so ru_maxrss is this mode's peak alone
+    from flask import render_template
+    from app import create_app
+
+    app = create_app()
+    with app.test_request_context():
+        started = time.perf_counter()
+        if mode == 'buffered':
+            # What the routes did before: fetchall() then render the whole page
+            rows = list(_synthetic_rows(count))
+            body = iter([render_template('view_all_complaints.html', complaints=rows)])
+        else:
+            body = iter(stream_page('view_all_complaints.html', complaints=_synthetic_rows(count)).response)
+        first = next(body)
+        ttfb = (time.perf_counter() - started) * 1000
+        total = len(first) + sum(len(chunk) for chunk in body)
+        elapsed = (time.perf_counter() - started) * 1000
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:9} rows={count:7}  ttfb={ttfb:8.1f} ms  total={elapsed:8.1f} ms  "
+          f"html={total / 1024 / 1024:6.1f} MiB  peak_rss={peak_mb:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    # python streaming.py [rows ...] -- renders view_all_complaints from
+    # synthetic rows both ways and compares time to first byte and peak RSS
+    if len(sys.argv) == 4 and sys.argv[1] == '--one':
+        _bench_one(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for count in counts:
+        for mode in ('buffered', 'streamed'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--one', mode, str(count)], check=True)
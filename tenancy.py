@@ -0,0 +1,274 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from flask import g, has_app_context, has_request_context, request, session
+
+import circuit
+import config
+from db_setup import LazyConnection, connection, upgrade
+
+
+# complex_id -> settings. Each complex has a database of its own, on the
+# shard (server) named by 'shard'; 'hosts' lets a complex be picked by the
+# site's host name instead of the login form. Without COMPLEXES the app runs
+# a single complex in DB_NAME, exactly as before tenancy existed.
+COMPLEXES = getattr(config, 'COMPLEXES', None) or {1: {'name': 'Default', 'database': config.DB_NAME}}
+
+# shard name -> connect() arguments (host, port, user, password). 'main' is
+# the server in DB_HOST; a large complex can be moved to a shard of its own.
+SHARDS = {'main': {}}
+SHARDS.update(getattr(config, 'DB_SHARDS', {}))
+
+LOGIN_KEYS = ('user_phone_no', 'admin_username', 'worker_phone_no')
+
+_local = threading.local()
+
+
+def setting(name, default=None, complex_id=None):
+    complex_id = complex_id or current_complex_id()
+    return COMPLEXES.get(complex_id, {}).get(name, default)
+
+
+def shard_of(complex_id):
+    return COMPLEXES[complex_id].get('shard', 'main')
+
+
+def database_of(complex_id):
+    return COMPLEXES[complex_id].get('database', config.DB_NAME)
+
+
+def complex_for_host(host):
+    host = (host or '').split(':')[0].lower()
+    for complex_id, settings in COMPLEXES.items():
+        if host in settings.get('hosts', ()):
+            return complex_id
+    return None
+
+
+def current_complex_id():
+    # Background work sets the complex explicitly with use(); requests get
+    # it from select_complex(). A single-complex install always has one.
+    override = getattr(_local, 'complex_id', None)
+    if override is not None:
+        return override
+    if has_app_context() and g.get('complex_id') is not None:
+        return g.complex_id
+    if len(COMPLEXES) == 1:
+        return next(iter(COMPLEXES))
+    return None
+
+
+@contextmanager
+def use(complex_id):
+    previous = getattr(_local, 'complex_id', None)
+    _local.complex_id = complex_id
+    try:
+        yield complex_id
+    finally:
+        _local.complex_id = previous
+
+
+def select_complex():
+    # before_request hook. The host name wins if it maps to a complex; a
+    # session cookie from another complex's site is dropped. Before login
+    # the form's complex_id choice is kept in the session so multi-step
+    # flows (password reset) stay on the same complex.
+    logged_in = any(key in session for key in LOGIN_KEYS)
+    host_complex = complex_for_host(request.host)
+    chosen = session.get('complex_id')
+
+    if host_complex is not None:
+        if chosen not in (None, host_complex):
+            session.clear()
+        chosen = host_complex
+    elif not logged_in:
+        picked = request.values.get('complex_id', '')
+        if picked.isdigit() and int(picked) in COMPLEXES:
+            chosen = int(picked)
+
+    if chosen not in COMPLEXES:
+        chosen = next(iter(COMPLEXES)) if len(COMPLEXES) == 1 else None
+    if chosen is not None and not logged_in:
+        session['complex_id'] = chosen
+    g.complex_id = chosen
+
+
+def template_context():
+    # The login and registration forms show a picker only when the complex
+    # isn't already known from the host name
+    choices = []
+    if len(COMPLEXES) > 1 and complex_for_host(request.host) is None:
+        choices = [(complex_id, settings.get('name', f"Complex {complex_id}"))
+                   for complex_id, settings in sorted(COMPLEXES.items())]
+    complex_id = current_complex_id()
+    return {'complex_choices': choices, 'current_complex_id': complex_id,
+            'current_complex_name': setting('name', '', complex_id) if complex_id else ''}
+
+
+def init_app(app):
+    app.before_request(select_complex)
+    app.context_processor(template_context)
+
+
+def claim_database(conn, complex_id):
+    # Ties a database to one complex on first use and refuses it to any
+    # other, so a misconfigured COMPLEXES entry can never mix two
+    # complexes' rows
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT complex_id FROM complex_info")
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO complex_info (complex_id) VALUES (%s)", (complex_id,))
+            conn.commit()
+            print(f"Database {database_of(complex_id)} claimed for complex {complex_id}.")
+            return True
+        if row[0] != complex_id:
+            print(f"Database {database_of(complex_id)} belongs to complex {row[0]}, not {complex_id}; not using it.")
+            return False
+        return True
+    finally:
+        cursor.close()
+
+
+def breaker(complex_id=None, background=False):
+    # The circuit breaker of the server holding this complex's database.
+    # Background work (scheduled jobs, the event log and mail queues,
+    # snapshots, CLIs) has one of its own that counts only failures, so a
+    # long rollup never trips the site's breaker and its degraded page.
+    complex_id = complex_id or current_complex_id()
+    if complex_id not in COMPLEXES:
+        return None
+    if background:
+        return circuit.breaker_for(f"{shard_of(complex_id)} (background)", slow_ms=float('inf'))
+    return circuit.breaker_for(shard_of(complex_id))
+
+
+def connect(complex_id, check_schema=False, background=False):
+    # A connection of the caller's own (streamed pages, scripts). Refused
+    # while the shard's breaker is open; the connect itself counts for it.
+    shard_breaker = breaker(complex_id, background)
+    if not shard_breaker.allow():
+        return None
+    args = dict(SHARDS[shard_of(complex_id)])
+    args['database'] = database_of(complex_id)
+    started = time.perf_counter()
+    conn = connection(**args)
+    shard_breaker.record(conn is not None, (time.perf_counter() - started) * 1000, error="could not connect")
+    if conn is None:
+        return None
+    try:
+        if check_schema:
+            upgrade(conn)
+        if claim_database(conn, complex_id):
+            return conn
+    except mysql.connector.Error as err:
+        print(f"Complex {complex_id} database not ready:", err)
+    conn.close()
+    return None
+
+
+def migrate_all():
+    # Brings every complex's database up to SCHEMA_VERSION. gunicorn's master
+    # runs this once before starting workers (gunicorn.conf.py), so workers
+    # only find the version current.
+    ready = 0
+    for complex_id in COMPLEXES:
+        conn = connect(complex_id, check_schema=True, background=True)
+        if conn is None:
+            print(f"Complex {complex_id}: schema not checked, database not reachable.")
+            continue
+        conn.close()
+        ready += 1
+    return ready
+
+
+class ShardedConnection(LazyConnection):
+    # Drop-in for LazyConnection: every call goes to the current complex's
+    # database, with one lazily opened connection per complex
+    # (check_schema=True runs migrations on each complex's first connect).
+    # lane, when given, returns a key for the running request (see
+    # admission.lane) and each key gets a connection of its own.
+    # background=True uses the background breaker (see breaker()).
+
+    def __init__(self, check_schema=False, lane=None, background=False):
+        self._by_complex = {}
+        self._sharded_lock = threading.Lock()
+        self._schema = check_schema
+        self._lane = lane
+        self._background = background
+        self._checked = set()
+
+    def _open(self, complex_id):
+        conn = connect(complex_id, self._schema and complex_id not in self._checked, self._background)
+        if conn is not None:
+            self._checked.add(complex_id)
+        return conn
+
+    def for_complex(self, complex_id, lane=None):
+        key = (complex_id, lane) if lane is not None else complex_id
+        conn = self._by_complex.get(key)
+        if conn is None:
+            with self._sharded_lock:
+                conn = self._by_complex.get(key)
+                if conn is None:
+                    conn = LazyConnection(connect=lambda: self._open(complex_id), check_schema=False,
+                                          breaker=breaker(complex_id, self._background))
+                    self._by_complex[key] = conn
+        return conn
+
+    def current(self):
+        complex_id = current_complex_id()
+        if complex_id not in COMPLEXES:
+            return None
+        return self.for_complex(complex_id, self._lane() if self._lane is not None else None)
+
+    def get(self):
+        conn = self.current()
+        return conn.get() if conn is not None else None
+
+    def _selected(self):
+        # A mysql.connector.Error, so routes handle it like any other
+        # database error (e.g. no complex picked yet on a multi-complex site)
+        conn = self.current()
+        if conn is None:
+            raise mysql.connector.Error("No complex selected; pick your complex and try again.")
+        return conn
+
+    def cursor(self, *args, **kwargs):
+        return self._selected().cursor(*args, **kwargs)
+
+    def commit(self):
+        return self._selected().commit()
+
+    def rollback(self):
+        return self._selected().rollback()
+
+    def reset(self):
+        for conn in list(self._by_complex.values()):
+            conn.reset()
+
+
+class PerComplex:
+    # One instance of factory() per complex (in-memory indexes and caches),
+    # chosen by the current complex on every attribute access
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._instances_lock = threading.Lock()
+
+    def for_complex(self, complex_id):
+        instance = self._instances.get(complex_id)
+        if instance is None:
+            with self._instances_lock:
+                instance = self._instances.setdefault(complex_id, self._factory())
+        return instance
+
+    def __getattr__(self, name):
+        complex_id = current_complex_id()
+        if complex_id is None:
+            raise RuntimeError("No complex selected for this request.")
+        return getattr(self.for_complex(complex_id), name)
@@ -0,0 +1,174 @@
+import importlib
+import os
+import sqlite3
+import sys
+import threading
+
+import mysql.connector
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py holds credentials and isn't in the repo; the sample's settings
+# are enough for the tests, which only reach a real database when
+# TEST_MYSQL_DATABASE is set (see `database` below)
+try:
+    import config
+except ImportError:
+    sys.modules['config'] = config = importlib.import_module('config_sample')
+
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        try:
+            self._cursor.execute(query.replace('%s', '?'), tuple(params))
+        except sqlite3.IntegrityError as err:
+            raise mysql.connector.IntegrityError(msg=str(err)) from err
+        except sqlite3.OperationalError as err:
+            raise mysql.connector.errors.OperationalError(msg=str(err)) from err
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    # The connection and cursor calls the modules under test make, on SQLite
+    # with MySQL's %s placeholders. Each thread opens its own, like the
+    # app's per-slot connections, and SQLite serialises the writes, so
+    # conditional UPDATEs race the way they do on MySQL.
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+
+    def cursor(self, *args, **kwargs):
+        return SqliteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._conn.close()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    # -> connect(), opening connections to one SQLite file per test
+    path = str(tmp_path / 'test.db')
+    opened = []
+
+    def connect():
+        conn = SqliteConnection(path)
+        opened.append(conn)
+        return conn
+    yield connect
+    for conn in opened:
+        conn.close()
+
+
+class MysqlConnection:
+    # A real connection with buffered cursors, so a test can fetchone()
+    # and move on the way the SQLite cursors allow
+
+    def __init__(self, database):
+        self._conn = mysql.connector.connect(host=config.DB_HOST, user=config.DB_USER,
+                                             password=config.DB_PASS, database=database)
+
+    def cursor(self, *args, **kwargs):
+        return self._conn.cursor(buffered=True)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def is_connected(self):
+        return self._conn.is_connected()
+
+    def close(self):
+        self._conn.close()
+
+
+# The race tests run on SQLite, whose database-wide write lock serialises
+# the conditional UPDATEs. Set TEST_MYSQL_DATABASE to a scratch database
+# (its tables are dropped!) on config.DB_HOST to run them on InnoDB's row
+# locks as well.
+MYSQL_DATABASE = os.environ.get('TEST_MYSQL_DATABASE')
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def database(request, sqlite_db):
+    # -> connect(), for tests whose SQL runs on both
+    if request.param == 'sqlite':
+        yield sqlite_db
+        return
+    if not MYSQL_DATABASE:
+        pytest.skip("TEST_MYSQL_DATABASE is not set")
+    opened = []
+
+    def connect():
+        conn = MysqlConnection(MYSQL_DATABASE)
+        opened.append(conn)
+        return conn
+
+    def drop_tables():
+        conn = MysqlConnection(MYSQL_DATABASE)
+        cursor = conn.cursor()
+        cursor.execute("SHOW TABLES")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"DROP TABLE `{table}`")
+        conn.commit()
+        conn.close()
+    drop_tables()
+    yield connect
+    for conn in opened:
+        conn.close()
+    drop_tables()
+
+
+def race(threads, func):
+    # Runs func(n) in `threads` threads released at the same moment;
+    # returns the results in thread order
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+    errors = []
+
+    def run(n):
+        barrier.wait()
+        try:
+            results[n] = func(n)
+        except Exception as err:
+            errors.append(err)
+
+    pool = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
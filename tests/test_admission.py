@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+from flask import Flask, Response
+
+import admission
+from admission import RequestClass
+
+
+@pytest.fixture
+def classes(monkeypatch):
+    fresh = {'admin': RequestClass('admin', 1, 1, 0.05), 'public': RequestClass('public', 2, 1, 0.05)}
+    monkeypatch.setattr(admission, 'classes', fresh)
+    return fresh
+
+
+@pytest.mark.parametrize('threads', [6, 8, 12, 16, 24, 32, 64, 100])
+def test_default_limits_fit_the_threads(threads):
+    budget = threads - max(1, threads // 4)
+    limits = admission.split_threads(budget)
+    assert set(limits) == set(admission.SHARES)
+    assert sum(slots + queue for slots, queue, _ in limits.values()) == budget
+    assert all(slots >= 1 for slots, _, _ in limits.values())
+
+
+def test_configured_limits_fit_web_threads():
+    admission.check_limits()
+    used = sum(c.slots + c.queue_limit for c in admission.classes.values()) + admission.LIVE_STREAMS
+    assert used <= admission.THREADS
+
+
+def test_too_many_slots_refuse_to_start(monkeypatch):
+    monkeypatch.setattr(admission, 'classes', {'user': RequestClass('user', admission.THREADS, 1, 1.0)})
+    with pytest.raises(ValueError, match="WEB_THREADS"):
+        admission.check_limits()
+
+
+def test_class_queues_then_turns_away(classes):
+    admin = classes['admin']
+    slot, waited = admin.acquire()
+    assert (slot, waited) == (0, 0.0)
+
+    # One request may wait for the slot; it gets it once the first finishes
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(admin.acquire()))
+    waiter.start()
+    while admin.waiting == 0:
+        pass
+    # The queue is full: the next one is turned away at once
+    assert admin.acquire() == (None, 0.0)
+    admin.release(slot)
+    waiter.join()
+    assert got[0][0] == 0
+
+    # Nobody releases this time: the waiter gives up after max_wait
+    assert admin.acquire()[0] is None
+    metrics = admin.metrics()
+    assert (metrics['admitted'], metrics['queued'], metrics['rejected'], metrics['timed_out']) == (2, 1, 1, 1)
+
+
+def test_lanes_cover_every_slot(classes):
+    assert admission.lanes() == [('admin', 0), ('public', 0), ('public', 1)]
+
+
+def test_live_streams_are_capped(monkeypatch):
+    monkeypatch.setattr(admission, 'LIVE_STREAMS', 1)
+    first = admission.open_stream(iter(['a', 'b']))
+    assert first is not None
+    assert next(first) == 'a'
+    assert admission.open_stream(iter(['c'])) is None
+    first.close()
+    assert admission.metrics()['live_streams']['open'] == 0
+    assert list(admission.open_stream(iter(['c']))) == ['c']
+
+
+def test_streamed_page_keeps_its_slot_until_sent(classes):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    admission.init_app(app)
+    seen = {}
+
+    @app.route('/page')
+    def page():
+        seen['in_view'] = classes['public'].metrics()['running']
+
+        def body():
+            seen['while_sending'] = classes['public'].metrics()['running']
+            yield 'rows'
+        return Response(body())
+
+    @app.route('/plain')
+    def plain():
+        return 'done'
+
+    response = app.test_client().get('/page')
+    assert response.data == b'rows'
+    assert seen == {'in_view': 1, 'while_sending': 1}
+    assert classes['public'].metrics()['running'] == 1
+    response.close()
+    assert classes['public'].metrics()['running'] == 0
+
+    assert app.test_client().get('/plain').data == b'done'
+    assert classes['public'].metrics()['running'] == 0
@@ -0,0 +1,40 @@
+import gzip
+import os
+
+import pytest
+
+import assets
+
+
+@pytest.fixture
+def app():
+    import app as appmod
+    app = appmod.create_app()
+    app.config['SCHEDULER_ENABLED'] = False
+    return app
+
+
+def fetch(app, filename, **headers):
+    with app.test_request_context():
+        url = assets.asset_url(filename)
+    return app.test_client().get(url, headers=headers)
+
+
+def test_assets_are_sent_gzipped(app):
+    with open(os.path.join(app.static_folder, 'js', 'offline_sync.js'), 'rb') as f:
+        original = f.read()
+    response = fetch(app, 'js/offline_sync.js', **{'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data) == original
+    assert len(response.data) < len(original)
+
+
+def test_plain_copy_without_accept_encoding(app):
+    response = fetch(app, 'js/offline_sync.js')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    response.close()
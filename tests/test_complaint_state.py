@@ -0,0 +1,96 @@
+import pytest
+
+import complaint_state
+import event_log
+from complaint_state import IN_PROGRESS, PENDING, RESOLVED
+from conftest import race
+
+
+@pytest.fixture
+def events(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(event_log, 'record', lambda complaint_id, event_type, *args, **kwargs:
+                        recorded.append((complaint_id, event_type)))
+    return recorded
+
+
+@pytest.fixture
+def complaints(database):
+    conn = database()
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE user_complaints_details (
+        complaint_id INTEGER PRIMARY KEY, status TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0,
+        worker_id INTEGER, parent_complaint_id INTEGER, verification_code TEXT)""")
+    cursor.execute("INSERT INTO user_complaints_details VALUES (1, %s, 0, NULL, NULL, '111111')", (PENDING,))
+    cursor.execute("INSERT INTO user_complaints_details VALUES (2, %s, 3, 7, NULL, '222222')", (IN_PROGRESS,))
+    # In Progress from before unassign_worker sent those back to Pending
+    cursor.execute("INSERT INTO user_complaints_details VALUES (3, %s, 1, NULL, NULL, '333333')", (IN_PROGRESS,))
+    conn.commit()
+    return database
+
+
+def status_of(connect, complaint_id):
+    cursor = connect().cursor()
+    cursor.execute("SELECT status, version FROM user_complaints_details WHERE complaint_id = %s", (complaint_id,))
+    return cursor.fetchone()
+
+
+def test_transitions_are_forward_only():
+    assert complaint_state.TRANSITIONS[PENDING] == {IN_PROGRESS}
+    assert complaint_state.TRANSITIONS[RESOLVED] == set()
+    assert complaint_state.sources_for(RESOLVED) == [IN_PROGRESS]
+
+
+def test_pending_cannot_jump_to_resolved(complaints, events):
+    ok, reason = complaint_state.change_status(complaints(), 1, RESOLVED)
+    assert not ok
+    assert reason == "Cannot move a complaint from Pending to Resolved."
+    assert status_of(complaints, 1) == (PENDING, 0)
+    assert events == []
+
+
+def test_only_assigned_complaints_progress(complaints, events):
+    ok, reason = complaint_state.change_status(complaints(), 1, IN_PROGRESS)
+    assert not ok
+    assert reason == "Assign a worker before marking the complaint In Progress."
+    ok, reason = complaint_state.change_status(complaints(), 3, RESOLVED)
+    assert not ok
+    assert reason == "Assign a worker before marking the complaint Resolved."
+    assert status_of(complaints, 1) == (PENDING, 0)
+    assert status_of(complaints, 3) == (IN_PROGRESS, 1)
+    assert events == []
+
+
+def test_resolved_cannot_go_back(complaints, events):
+    assert complaint_state.change_status(complaints(), 2, RESOLVED) == (True, None)
+    ok, reason = complaint_state.change_status(complaints(), 2, IN_PROGRESS)
+    assert not ok
+    assert reason == "Cannot downgrade from Resolved. No changes made."
+    assert events == [(2, event_log.STATUS_CHANGED)]
+
+
+def test_stale_version_is_refused(complaints, events):
+    ok, reason = complaint_state.change_status(complaints(), 2, RESOLVED, expected_version=2)
+    assert not ok
+    assert "changed by someone else" in reason
+    assert status_of(complaints, 2) == (IN_PROGRESS, 3)
+
+
+def test_racing_admin_and_worker_resolutions_one_wins(complaints, events):
+    # An admin resolves from the status form while the worker enters the
+    # resident's code, each on a connection of their own
+    def resolve(n):
+        if n == 0:
+            return complaint_state.change_status(complaints(), 2, RESOLVED, expected_version=3)[0]
+        return complaint_state.resolve_with_code(complaints(), 2, 7, None, '222222')[0]
+
+    assert sorted(race(2, resolve)) == [False, True]
+    assert status_of(complaints, 2) == (RESOLVED, 4)
+    assert events == [(2, event_log.STATUS_CHANGED)]
+
+
+def test_many_racing_transitions_one_wins(complaints, events):
+    results = race(20, lambda n: complaint_state.change_status(complaints(), 2, RESOLVED, actor=f"admin{n}")[0])
+    assert results.count(True) == 1
+    assert status_of(complaints, 2) == (RESOLVED, 4)
+    assert len(events) == 1
@@ -0,0 +1,29 @@
+import db_router
+import tenancy
+
+
+class LimitConnection:
+    def __init__(self, limit):
+        self.limit = limit
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        assert query == "SELECT @@max_connections"
+
+    def fetchone(self):
+        return (self.limit,)
+
+    def close(self):
+        pass
+
+
+def test_connection_budget_is_checked(monkeypatch, capsys):
+    shards, _ = db_router.connections_needed()
+    per_worker = shards['main']
+    monkeypatch.setattr(tenancy, 'connect', lambda complex_id, background=False: LimitConnection(151))
+
+    assert db_router.check_connections(151 // per_worker + 1) == ['shard main']
+    assert "Raise it" in capsys.readouterr().out
+    assert db_router.check_connections(1) == []
@@ -0,0 +1,37 @@
+import time
+from datetime import datetime
+
+import dedup
+from conftest import race
+
+
+class SlowCursor:
+    # The warm-up query, taking long enough for every thread to arrive
+    def __init__(self, queries):
+        self.queries = queries
+
+    def execute(self, query, values=()):
+        self.queries.append(query)
+        time.sleep(0.05)
+
+    def fetchall(self):
+        return [(1, 'Tower B lift', 'Lift', 'lift stuck on floor 3', datetime.now())]
+
+    def close(self):
+        pass
+
+
+class SlowDb:
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        return SlowCursor(self.queries)
+
+
+def test_concurrent_first_requests_warm_once():
+    index = dedup.DuplicateIndex()
+    db = SlowDb()
+    race(8, lambda n: index.warm(db))
+    assert len(db.queries) == 1
+    assert index.find('twr b lft', 'Lift', 'lift stuck on floor 3') == (1, 1.0)
@@ -0,0 +1,62 @@
+import pytest
+
+import circuit
+import event_log
+import tenancy
+from db_setup import LazyConnection
+
+
+@pytest.fixture
+def log(monkeypatch):
+    events = event_log.EventLog(durable=False, batch_size=100)
+    monkeypatch.setattr(events, '_start_flusher', lambda: None)
+    return events
+
+
+@pytest.fixture
+def db(sqlite_db):
+    conn = LazyConnection(connect=sqlite_db, check_schema=False, breaker=circuit.CircuitBreaker('test'))
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE user_complaints_details (complaint_id INTEGER PRIMARY KEY, status TEXT)")
+    conn.commit()
+    return conn
+
+
+def buffered(log):
+    return [(complex_id, row[0], row[1]) for complex_id, row in log._buffer]
+
+
+def test_rolled_back_change_leaves_no_event(log, db):
+    with tenancy.use(1):
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO user_complaints_details VALUES (7, 'Pending')")
+        log.record(7, event_log.CREATED, event_log.ROLE_USER, '9999999999', 'Normal', cursor)
+        assert buffered(log) == []
+        db.rollback()
+    assert buffered(log) == []
+
+
+def test_event_is_buffered_on_commit(log, db):
+    with tenancy.use(1):
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO user_complaints_details VALUES (7, 'Pending')")
+        log.record(7, event_log.CREATED, event_log.ROLE_USER, '9999999999', 'Normal', cursor)
+        db.commit()
+        # The next transaction starts with nothing pending
+        db.commit()
+    assert buffered(log) == [(1, 7, event_log.CREATED)]
+
+
+def test_failed_commit_drops_the_event(log, db, monkeypatch):
+    with tenancy.use(1):
+        cursor = db.cursor()
+        log.record(7, event_log.CREATED, event_log.ROLE_USER, '9999999999', 'Normal', cursor)
+
+        def lost():
+            raise event_log.mysql.connector.errors.OperationalError(msg="Lost connection")
+        monkeypatch.setattr(db.get(), 'commit', lost)
+        with pytest.raises(event_log.mysql.connector.Error):
+            db.commit()
+        monkeypatch.undo()
+        db.commit()
+    assert buffered(log) == []
@@ -0,0 +1,152 @@
+import io
+import threading
+
+import pytest
+
+import admission
+import idempotency
+import tenancy
+from admission import RequestClass
+from conftest import race
+
+KEY = idempotency.new_key()
+
+
+KEYS_TABLE = """CREATE TABLE idempotency_keys (
+    idem_key VARCHAR(32) PRIMARY KEY, user_id INTEGER NOT NULL, complaint_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP)"""
+
+
+@pytest.fixture
+def keys(database):
+    conn = database()
+    cursor = conn.cursor()
+    cursor.execute(KEYS_TABLE)
+    conn.commit()
+    return database
+
+
+@pytest.fixture
+def site(sqlite_db):
+    # What add_complain touches for a personal complaint by a resident
+    # with an address on file and no email
+    conn = sqlite_db()
+    cursor = conn.cursor()
+    cursor.execute(KEYS_TABLE)
+    cursor.execute("CREATE TABLE user_address_details (user_phone_no TEXT, address TEXT)")
+    cursor.execute("INSERT INTO user_address_details VALUES ('9999999999', 'Flat 1')")
+    cursor.execute("CREATE TABLE user_registeration_details (user_phone_no TEXT, user_email_id TEXT)")
+    cursor.execute("""CREATE TABLE user_complaints_details (
+        complaint_id INTEGER PRIMARY KEY, user_phone_no TEXT, user_id INTEGER, complaint_type TEXT,
+        complaint_desc TEXT, complaint_priority TEXT, complaint_datetime TEXT, status TEXT,
+        complaint_scope TEXT, location TEXT, image_path TEXT, verification_code TEXT,
+        suspected_duplicate_of INTEGER)""")
+    conn.commit()
+    return sqlite_db
+
+
+def stored(connect):
+    cursor = connect().cursor()
+    cursor.execute("SELECT idem_key, complaint_id FROM idempotency_keys")
+    return cursor.fetchall()
+
+
+def test_keys_are_validated():
+    assert idempotency.valid(KEY)
+    assert not idempotency.valid(KEY.upper())
+    assert not idempotency.valid('')
+    assert not idempotency.valid(None)
+
+
+def test_concurrent_duplicate_submits_one_claims(keys):
+    # A double tap plus browser retries: the same key from the same resident
+    # at the same moment, each request on its own connection
+    results = race(10, lambda n: idempotency.claim(keys(), KEY, 5))
+    assert results.count((True, None)) == 1
+    assert results.count((False, None)) == 9
+
+    conn = keys()
+    cursor = conn.cursor()
+    idempotency.complete(cursor, KEY, 42)
+    conn.commit()
+    assert idempotency.claim(keys(), KEY, 5) == (False, 42)
+    # Someone else's key never reveals the complaint
+    assert idempotency.claim(keys(), KEY, 6) == (False, None)
+
+
+def test_release_frees_only_unfinished_keys(keys):
+    other = idempotency.new_key()
+    assert idempotency.claim(keys(), KEY, 5) == (True, None)
+    assert idempotency.claim(keys(), other, 5) == (True, None)
+    conn = keys()
+    cursor = conn.cursor()
+    idempotency.complete(cursor, other, 42)
+    conn.commit()
+
+    idempotency.release(keys(), KEY)
+    idempotency.release(keys(), other)
+    assert stored(keys) == [(other, 42)]
+    assert idempotency.claim(keys(), KEY, 5) == (True, None)
+
+
+@pytest.fixture
+def app(site, monkeypatch, tmp_path):
+    monkeypatch.setattr(tenancy, 'connect', lambda complex_id, check_schema=False, background=False: site())
+    # Room for two residents' requests at once, each on its own connection
+    monkeypatch.setattr(admission, 'classes', dict(admission.classes, user=RequestClass('user', 2, 1, 3.0)))
+    import app as appmod
+    appmod.db.reset()
+    app = appmod.create_app()
+    app.config['SCHEDULER_ENABLED'] = False
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'missing')     # saving the image fails
+    yield app
+    appmod.db.reset()
+
+
+def resident(app):
+    test_client = app.test_client()
+    with test_client.session_transaction() as session:
+        session['user_phone_no'] = '9999999999'
+        session['user_id'] = 5
+    return test_client
+
+
+@pytest.fixture
+def client(app):
+    return resident(app)
+
+
+def test_failed_image_save_releases_the_key(client, site):
+    keys = site
+    form = {'idempotency_key': KEY, 'complain': 'C', 'complain_type': 'Other', 'complain_description': 'leak',
+            'complain_priority': 'Normal', 'location': 'Block A',
+            'complaint_image': (io.BytesIO(b'\xff\xd8image'), 'photo.jpg')}
+    response = client.post('/add_complain', data=form, content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert stored(keys) == []
+    # The resident can send the same form again
+    assert idempotency.claim(keys(), KEY, 5) == (True, None)
+
+
+def test_simultaneous_submits_create_one_complaint(app, site, monkeypatch):
+    # Both POSTs pass validation before either claims the key, as when a
+    # double tap reaches two threads at once
+    barrier = threading.Barrier(2)
+    claim = idempotency.claim
+
+    def claim_together(db, key, user_id):
+        barrier.wait(timeout=5)
+        return claim(db, key, user_id)
+    monkeypatch.setattr(idempotency, 'claim', claim_together)
+
+    form = {'idempotency_key': KEY, 'complain': 'P', 'complain_type': 'Plumbing',
+            'complain_description': 'leak', 'complain_priority': 'Normal'}
+    clients = [resident(app), resident(app)]
+    responses = race(2, lambda n: clients[n].post('/add_complain', data=form))
+
+    assert [r.status_code for r in responses] == [302, 302]
+    assert responses[0].headers['Location'] == responses[1].headers['Location'] == '/user_dashboard'
+    cursor = site().cursor()
+    cursor.execute("SELECT complaint_id, complaint_desc FROM user_complaints_details")
+    assert cursor.fetchall() == [(1, 'leak')]
+    assert stored(site) == [(KEY, 1)]
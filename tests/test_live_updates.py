@@ -0,0 +1,85 @@
+import asyncio
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+import live_server
+import live_updates
+from live_updates import Broker
+
+
+def test_channel_goes_once_its_listeners_leave(monkeypatch):
+    monkeypatch.setattr(live_updates, 'RESUME_SECONDS', 0)
+    broker = Broker()
+    stream = broker.listen('user:1:9999999999')
+    assert next(stream) == "retry: 5000\n\n"
+    broker.publish('user:1:9999999999', 'status', {'complaint_id': 7})
+    assert 'complaint_id' in next(stream)
+    # Nobody listens here, so nothing is kept
+    broker.publish('user:1:8888888888', 'status', {'complaint_id': 8})
+    assert broker.channels() == 1
+    stream.close()
+    assert broker.channels() == 0
+
+
+def cookie(secret_key, session):
+    app = Flask(__name__)
+    app.secret_key = secret_key
+    return SecureCookieSessionInterface().get_signing_serializer(app).dumps(session)
+
+
+async def get(port, path, headers=''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost:{port}\r\n{headers}\r\n".encode())
+    status = (await reader.readline()).decode()
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    return status, reader, writer
+
+
+async def read_event(reader):
+    lines = []
+    while True:
+        line = (await asyncio.wait_for(reader.readline(), 5)).decode()
+        if line == '\n':
+            return ''.join(lines)
+        lines.append(line)
+
+
+def test_live_server_streams_relayed_events(monkeypatch, tmp_path):
+    relay_dir = str(tmp_path / 'relay')
+    monkeypatch.setattr(live_server, 'RELAY_DIR', relay_dir)
+
+    async def scenario():
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.ensure_future(live_server.serve('127.0.0.1', 0, 'test-key',
+                                                       ready=lambda server, live: started.set_result((server, live))))
+        server, live = await started
+        port = server.sockets[0].getsockname()[1]
+        try:
+            status, _, writer = await get(port, '/user_events')
+            assert status.startswith('HTTP/1.1 401')
+            writer.close()
+
+            session = cookie('test-key', {'user_phone_no': '9999999999', 'complex_id': 1})
+            status, reader, writer = await get(port, '/user_events', f"Cookie: session={session}\r\n")
+            assert status.startswith('HTTP/1.1 200')
+            assert await read_event(reader) == 'retry: 5000\n'
+            assert live.open == 1
+
+            # A web worker publishes; the event reaches the stream through the relay
+            worker = Broker()
+            worker.start_relay(relay_dir)
+            try:
+                event_id = worker.publish('user:1:9999999999', 'status', {'complaint_id': 7, 'status': 'Resolved'})
+                event = await read_event(reader)
+            finally:
+                worker.stop_relay()
+            assert event.startswith(f"id: {event_id}\nevent: status\n")
+            assert '"complaint_id": 7' in event
+            writer.close()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+
+import mysql.connector
+import pytest
+from flask import Flask
+from flask_mail import Mail
+
+from notifications import NotificationBatcher
+
+
+class FakeMail:
+    # Fails on the message to `fail_on`, like an SMTP server dropping the
+    # session half way through a batch
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.sent = []
+
+    @contextmanager
+    def connect(self):
+        yield self
+
+    def send(self, msg):
+        if msg.recipients == [self.fail_on]:
+            raise OSError("connection closed")
+        self.sent.append(msg.recipients[0])
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    notifier = NotificationBatcher(window=0)
+    notifier.app = Flask(__name__)
+    Mail(notifier.app)     # digests are built with the app's mail settings
+    emails = {(1, '111'): 'a@example.com', (1, '222'): 'b@example.com', (1, '333'): 'c@example.com'}
+    monkeypatch.setattr(notifier, '_user_emails', lambda residents: {r: emails[r] for r in residents})
+    monkeypatch.setattr(notifier, '_start', lambda: None)
+    for phone in ('111', '222', '333'):
+        notifier._queue(('user', (1, phone)), f"update for {phone}")
+    return notifier
+
+
+def test_flush_sends_every_digest(batcher):
+    batcher.mail = FakeMail()
+    assert batcher.flush(force=True) == 3
+    assert sorted(batcher.mail.sent) == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert batcher._pending == {}
+
+
+def test_smtp_failure_requeues_only_unsent(batcher):
+    batcher.mail = FakeMail(fail_on='b@example.com')
+    assert batcher.flush(force=True) == 1
+    assert batcher.mail.sent == ['a@example.com']
+    assert set(batcher._pending) == {('user', (1, '222')), ('user', (1, '333'))}
+
+    batcher.mail = FakeMail()
+    assert batcher.flush(force=True) == 2
+    assert sorted(batcher.mail.sent) == ['b@example.com', 'c@example.com']
+    assert batcher._pending == {}
+
+
+def test_email_lookup_failure_keeps_the_batch(batcher, monkeypatch):
+    def down(residents):
+        raise mysql.connector.errors.OperationalError(msg="server gone")
+    monkeypatch.setattr(batcher, '_user_emails', down)
+    batcher.mail = FakeMail()
+    assert batcher.flush(force=True) == 0
+    assert len(batcher._pending) == 3
+    assert batcher._pending[('user', (1, '111'))][1] == ["update for 111"]
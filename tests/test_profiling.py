@@ -0,0 +1,32 @@
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def admin(monkeypatch, tmp_path):
+    (tmp_path / 'profiles' / 'main_index').mkdir(parents=True)
+    (tmp_path / 'profiles' / 'main_index' / 'run.folded').write_text('main;index 3\n')
+    (tmp_path / 'config.py').write_text("DB_PASSWORD = 'secret'\n")
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    import app as appmod
+    app = appmod.create_app()
+    app.config['SCHEDULER_ENABLED'] = False
+    test_client = app.test_client()
+    with test_client.session_transaction() as session:
+        session['admin_username'] = 'admin'
+    return test_client
+
+
+def test_saved_profiles_are_served(admin):
+    with admin.get('/profiles/main_index/run.folded') as response:
+        assert response.status_code == 200
+        assert response.data == b'main;index 3\n'
+
+
+@pytest.mark.parametrize('path', ['/profiles/../config.py', '/profiles/..%2F..%2Fprofiles/config.py',
+                                  '/profiles/main_index/..%2F..%2Fconfig.py', '/profiles/other/run.folded'])
+def test_nothing_outside_the_profile_directories(admin, path):
+    with admin.get(path) as response:
+        assert response.status_code == 404
+        assert b'secret' not in response.data
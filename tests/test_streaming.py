@@ -0,0 +1,100 @@
+import mysql.connector
+import pytest
+
+import streaming
+from circuit import LastGood
+from streaming import RowStream
+
+
+class BatchCursor:
+    # Hands out the given batches, raising any that is an exception
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def execute(self, query, values=()):
+        pass
+
+    def fetchmany(self, size):
+        batch = self.batches.pop(0) if self.batches else []
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+
+class BatchConnection:
+    def __init__(self, batches):
+        self.batches = batches
+        self.closed = False
+
+    def cursor(self, buffered=True):
+        return BatchCursor(self.batches)
+
+    def close(self):
+        self.closed = True
+
+
+def test_error_before_the_first_rows_reaches_the_route():
+    conn = BatchConnection([mysql.connector.errors.OperationalError(msg="Lost connection")])
+    with pytest.raises(mysql.connector.Error):
+        RowStream("SELECT 1", connect=lambda: conn)
+    assert conn.closed
+
+
+def test_error_midway_ends_the_rows_and_saves_nothing():
+    conn = BatchConnection([[(1,), (2,)], mysql.connector.errors.OperationalError(msg="Lost connection")])
+    rows = RowStream("SELECT 1", connect=lambda: conn)
+    saved = LastGood()
+    assert list(saved.tee('page', rows)) == [(1,), (2,)]
+    assert isinstance(rows.error, mysql.connector.Error)
+    assert conn.closed
+    assert saved.get('page') is None
+
+
+def test_only_short_lists_are_saved():
+    saved = LastGood()
+    assert list(saved.tee('short', iter([(1,), (2,)]), max_rows=2)) == [(1,), (2,)]
+    assert saved.get('short')[1] == {'complaints': [(1,), (2,)]}
+    assert list(saved.tee('long', iter([(1,), (2,), (3,)]), max_rows=2)) == [(1,), (2,), (3,)]
+    assert saved.get('long') is None
+
+
+def test_streamed_page_reports_a_cut_short_list(monkeypatch):
+    monkeypatch.setattr(streaming, 'FETCH_SIZE', 1)
+    conn = BatchConnection([[(1, 'leak', 'Pending', 0)], mysql.connector.errors.OperationalError(msg="gone")])
+    import app as appmod
+    app = appmod.create_app()
+    with app.test_request_context():
+        rows = RowStream("SELECT 1", connect=lambda: conn)
+        body = ''.join(streaming.stream_page('update_complaint_status.html', complaints=rows, stream=rows).response)
+    assert 'ID: 1 | leak' in body
+    assert 'The list was cut short' in body
+
+
+class PoolConnection(BatchConnection):
+    unread_result = False
+
+    def __init__(self):
+        super().__init__([])
+
+    def is_connected(self):
+        return not self.closed
+
+    def rollback(self):
+        pass
+
+
+def test_stream_pool_caps_open_connections(monkeypatch):
+    import db_router
+    import tenancy
+    opened = []
+    monkeypatch.setattr(tenancy, 'connect', lambda complex_id, background=False: opened.append(1) or PoolConnection())
+    pool = db_router.StreamPool(size=2, wait_seconds=0.05)
+    first, second = pool.connect(1), pool.connect(1)
+    assert first and second
+    assert pool.connect(1) is None
+    first.close()
+    third = pool.connect(1)
+    assert third is not None
+    assert len(opened) == 2
+    assert pool.status()['open'] == {1: 2}
+    assert pool.status()['refused'] == 1
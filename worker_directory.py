@@ -0,0 +1,79 @@
+import threading
+import time
+from bisect import bisect_left
+
+import tenancy
+
+
+REFRESH_SECONDS = 300   # picks up roster changes made by other processes
+MAX_SUGGESTIONS = 10
+
+
+class WorkerDirectory:
+    # Prefix index over the worker roster. Every word of the name, the phone
+    # number and the specialization become sorted (key, worker_id) entries,
+    # so a lookup is one bisect plus a short forward scan and never touches
+    # the database.
+
+    def __init__(self, refresh=REFRESH_SECONDS):
+        self.refresh = refresh
+        self._keys = []
+        self._workers = {}
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        # Called after add_worker / delete_worker; the next lookup rebuilds
+        self._built_at = None
+
+    def rebuild(self, db):
+        started = time.perf_counter()
+        cursor = db.cursor()
+        cursor.execute("SELECT worker_id, worker_name, worker_phone_no, specialization FROM workers_details")
+        rows = cursor.fetchall()
+        cursor.close()
+
+        keys = []
+        workers = {}
+        for worker_id, name, phone, specialization in rows:
+            workers[worker_id] = {'worker_id': worker_id, 'name': name,
+                                  'phone': phone, 'specialization': specialization}
+            terms = set((name or '').lower().split()) | {(name or '').lower(), phone or ''}
+            terms.add((specialization or '').lower())
+            keys.extend((term, worker_id) for term in terms if term)
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._workers = workers
+            self._built_at = time.time()
+        print(f"Worker directory rebuilt with {len(workers)} workers in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    def _ensure(self, db):
+        if self._built_at is None or time.time() - self._built_at > self.refresh:
+            self.rebuild(db)
+
+    def search(self, db, prefix, limit=MAX_SUGGESTIONS):
+        self._ensure(db)
+        prefix = (prefix or '').strip().lower()
+        if not prefix:
+            return []
+        with self._lock:
+            keys, workers = self._keys, self._workers
+        # Matches come out ordered by the matched term, so a common prefix
+        # like a specialization stops after `limit` workers instead of
+        # walking the whole range
+        found = {}
+        i = bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix) and (limit is None or len(found) < limit):
+            found.setdefault(keys[i][1], None)
+            i += 1
+        return [workers[w] for w in found]
+
+    def ids_named(self, db, name):
+        # Exact, case-insensitive name match for a filter typed without picking a suggestion
+        name = (name or '').strip().lower()
+        return [w['worker_id'] for w in self.search(db, name, limit=None) if w['name'].lower() == name]
+
+
+directory = tenancy.PerComplex(WorkerDirectory)
@@ -0,0 +1,53 @@
+import math
+
+import config
+
+
+# Ratings lose half their weight in the recent score after this many days
+HALF_LIFE_DAYS = getattr(config, 'FEEDBACK_HALF_LIFE_DAYS', 30)
+DECAY_PER_SECOND = math.log(2) / (HALF_LIFE_DAYS * 86400)
+
+# complaint_type value of the row that aggregates all of a worker's types
+ALL_TYPES = ''
+
+
+# One upsert per row. MySQL applies the SET list left to right, so the decay
+# factor is computed from the old updated_at before updated_at is bumped.
+UPSERT_SCORE = """
+    INSERT INTO worker_feedback_scores
+        (worker_id, complaint_type, rating_count, rating_sum, rating_sum_sq,
+         decayed_sum, decayed_weight, updated_at)
+    VALUES (%s, %s, 1, %s, %s, %s, 1, NOW())
+    ON DUPLICATE KEY UPDATE
+        rating_count = rating_count + 1,
+        rating_sum = rating_sum + VALUES(rating_sum),
+        rating_sum_sq = rating_sum_sq + VALUES(rating_sum_sq),
+        decayed_sum = decayed_sum * EXP(-%s * TIMESTAMPDIFF(SECOND, updated_at, NOW())) + VALUES(decayed_sum),
+        decayed_weight = decayed_weight * EXP(-%s * TIMESTAMPDIFF(SECOND, updated_at, NOW())) + 1,
+        updated_at = NOW()
+"""
+
+
+def record_feedback(cursor, worker_id, complaint_type, rating):
+    # O(1): two single-row upserts in the caller's transaction, no scan of
+    # past complaints
+    if not worker_id:
+        return
+    types = [ALL_TYPES] + ([complaint_type] if complaint_type else [])
+    for c_type in types:
+        cursor.execute(UPSERT_SCORE, (worker_id, c_type, rating, rating * rating, rating,
+                                      DECAY_PER_SECOND, DECAY_PER_SECOND))
+
+
+def summary(count, total, total_sq, decayed_sum, decayed_weight):
+    # Turns the stored running sums into what the assignment page shows
+    if not count:
+        return None
+    mean = total / count
+    variance = max(total_sq / count - mean * mean, 0)
+    return {
+        'count': count,
+        'average': round(mean, 2),
+        'stddev': round(math.sqrt(variance), 2),
+        'recent': round(decayed_sum / decayed_weight, 2) if decayed_weight else None,
+    }
@@ -0,0 +1,169 @@
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import mysql.connector
+
+import admission
+import dedup
+import tenancy
+from app import create_app, db
+from db_router import router
+from live_updates import broker
+
+
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
+
+
+def init_worker():
+    # gunicorn post_worker_init: runs in each worker after it has imported
+    # the app. Migrations have already run in the master (on_starting), so
+    # this only opens the connections requests will use: one per admission
+    # slot per complex (see admission.lane), and the replica pools; loads
+    # each complex's duplicate index; then it joins the live-updates relay.
+    started = time.perf_counter()
+    opened = 0
+    for complex_id in tenancy.COMPLEXES:
+        for lane in admission.lanes():
+            if not db.for_complex(complex_id, lane):
+                print(f"Worker {os.getpid()}: complex {complex_id} database not reachable yet.")
+                break
+            opened += 1
+        else:
+            try:
+                with tenancy.use(complex_id):
+                    dedup.index.warm(db)
+            except mysql.connector.Error as err:
+                # The first community complaint loads it instead
+                print(f"Worker {os.getpid()}: duplicate index for complex {complex_id} not loaded:", err)
+    router.warm()
+    broker.start_relay()
+    print(f"Worker {os.getpid()} ready in {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({opened} connection(s) opened).")
+
+
+def exit_worker():
+    broker.stop_relay()
+
+
+def _wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _client(port, path, seconds, threads, results):
+    # One load-generating process: keep-alive connections, one per thread.
+    # A request on a kept-alive connection the server has just closed (a
+    # recycled worker) is retried once on a new connection, as browsers do.
+    latencies = []
+    counts = {'errors': 0, 'retried': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def fetch(conn):
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        if response.status >= 500:
+            raise http.client.HTTPException(response.status)
+
+    def run():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        mine = []
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                try:
+                    fetch(conn)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    with lock:
+                        counts['retried'] += 1
+                    conn.close()
+                    fetch(conn)
+                mine.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    counts['errors'] += 1
+                conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((latencies, counts))
+
+
+def bench(mode, port, path='/', seconds=10, clients=4, threads=8):
+    # Starts the server the way `mode` would run in production, drives it
+    # from `clients` processes x `threads` connections and prints throughput
+    # and latency percentiles
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Extra gunicorn flags (e.g. --workers 2) can be passed in GUNICORN_CMD_ARGS
+    env = dict(os.environ, GUNICORN_CMD_ARGS=f"{os.environ.get('GUNICORN_CMD_ARGS', '')} --bind 127.0.0.1:{port}")
+    if mode == 'dev':
+        # What `python app.py` runs, minus the file-watching reloader process
+        command = [sys.executable, '-c', "from app import create_app; "
+                   f"create_app().run(host='127.0.0.1', port={port}, debug=True, use_reloader=False)"]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(here, 'gunicorn.conf.py'), 'wsgi:app']
+    server = subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    try:
+        if not _wait_for_port(port):
+            print(f"{mode}: server did not start")
+            return
+        time.sleep(1)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_client, args=(port, path, seconds, threads, results))
+                 for _ in range(clients)]
+        for p in procs:
+            p.start()
+        latencies, errors, retried = [], 0, 0
+        for _ in procs:
+            part, counts = results.get()
+            latencies.extend(part)
+            errors += counts['errors']
+            retried += counts['retried']
+        for p in procs:
+            p.join()
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+    latencies.sort()
+    if not latencies:
+        print(f"{mode:9} no successful requests ({errors} errors)")
+        return
+    pct = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+    print(f"{mode:9} {len(latencies) / seconds:8.0f} req/s  p50={pct(0.5):6.1f} ms  p99={pct(0.99):7.1f} ms  "
+          f"errors={errors} retried={retried}  ({clients * threads} connections, GET {path})")
+
+
+if __name__ == "__main__":
+    # python wsgi.py bench [path] [seconds] -- the dev server (python app.py)
+    # against gunicorn with gunicorn.conf.py, on the same machine
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print("Usage: python wsgi.py bench [path] [seconds]")
+        print("Serve with: gunicorn -c gunicorn.conf.py wsgi:app")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else '/'
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f"{os.cpu_count()} CPU core(s)")
+    bench('dev', 5051, path, seconds)
+    bench('gunicorn', 5052, path, seconds)